@@ -0,0 +1,6 @@
+"""
+End-to-end benchmarks of ``conf_publisher``, ``conf_page_maker`` and ``conf_page_dumper`` against
+``conf_publisher.testing.fake_confluence``. Run from the repository root::
+
+    $ python -m benchmarks.run --pages 500 --depth 3 --output results.json
+"""
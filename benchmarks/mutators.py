@@ -0,0 +1,111 @@
+"""
+Removes and adds the link and watermark blocks of multi-megabyte page bodies with ``PageMutatorPipeline`` and
+compares it with the previous mutators: a greedy ``prefix.*suffix`` substitution built for every removal and a
+concatenated copy of the body for every added block.
+"""
+import argparse
+import json
+import re
+import timeit
+from collections import OrderedDict
+
+from conf_publisher.confluence import Page
+from conf_publisher.mutators.page_mutator import WatermarkPageMutator, LinkPageMutator, PageMutatorPipeline
+
+PARAGRAPH = '<p>Paragraph {} of the page <strong>body</strong> with <a href="#anchor-{}">a link</a>.</p>\n'
+
+
+class LegacyPipeline(object):
+    """
+    The previous way: every mutator on its own, one pass over the body each.
+    """
+
+    def __init__(self, mutators):
+        self.mutators = mutators
+
+    def apply_forward(self, page):
+        for mutator in self.mutators:
+            page.body = mutator.template_prefix + mutator.template.format(**mutator.template_params) + \
+                mutator.template_suffix + page.body
+
+    def apply_backward(self, page):
+        for mutator in self.mutators:
+            page.body = re.sub(re.escape(mutator.template_prefix) + '.*' + re.escape(mutator.template_suffix), '',
+                               page.body, flags=re.DOTALL)
+
+
+def mutators():
+    return [LinkPageMutator('https://example.com/docs/'), WatermarkPageMutator('Generated page: do not edit.')]
+
+
+def page_body(size):
+    """
+    Published page body of about ``size`` bytes: link and watermark blocks followed by paragraphs.
+    """
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = PARAGRAPH.format(len(paragraphs), len(paragraphs) % 100)
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    page = Page()
+    page.body = ''.join(paragraphs)
+    PageMutatorPipeline(mutators()).apply_forward(page)
+    return page.body
+
+
+def measure(pipeline_class, body, repeat):
+    pipeline = pipeline_class(mutators())
+
+    def republish():
+        page = Page()
+        page.body = body
+        pipeline.apply_backward(page)
+        pipeline.apply_forward(page)
+        return page.body
+
+    result = republish()
+    return min(timeit.repeat(republish, number=1, repeat=repeat)), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark page mutators on large page bodies')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16],
+                        help='Body sizes in megabytes. Default: 1 4 16.')
+    parser.add_argument('--repeat', type=int, default=5, help='Best of REPEAT runs. Default: 5.')
+    parser.add_argument('-o', '--output', type=str, help='Save results as JSON.')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        body = page_body(int(size * 1048576))
+        legacy_seconds, legacy_body = measure(LegacyPipeline, body, args.repeat)
+        current_seconds, current_body = measure(PageMutatorPipeline, body, args.repeat)
+        if legacy_body != current_body:
+            raise AssertionError('Pipelines disagree on a {} MB body'.format(size))
+        results.append(OrderedDict([
+            ('body_size', len(body)),
+            ('legacy_seconds', legacy_seconds),
+            ('current_seconds', current_seconds),
+        ]))
+
+    header = ('Body MB', 'Legacy ms', 'Current ms', 'Speedup')
+    rows = [header]
+    for result in results:
+        rows.append((
+            '{:.1f}'.format(result['body_size'] / 1048576.0),
+            '{:.2f}'.format(result['legacy_seconds'] * 1000),
+            '{:.2f}'.format(result['current_seconds'] * 1000),
+            '{:.1f}x'.format(result['legacy_seconds'] / result['current_seconds']),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Parses entity-heavy page bodies with ``PageBodyComparator`` on the lxml and standard library backends and compares
+it with the previous parser: a fresh parser per document and, on the standard library, one more re-parse from the
+start for every distinct entity the parser did not know.
+
+The previous parser remembered learned entities for the rest of the process, so legacy numbers are those of the
+first body using them.
+"""
+import argparse
+import json
+import re
+import timeit
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from conf_publisher.confluence import PageBodyComparator, AllEntitiesXMLParser, FingerprintCache, HTML_ENTITIES
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# entities known to the old parser
+LEGACY_KNOWN_ENTITY = ('nbsp', 'ldquo', 'rdquo')
+
+
+class LegacyAllEntitiesXMLParser(object):
+    """
+    The previous standard library parser: starts over on every undefined entity.
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.known_entity = dict((name, name) for name in LEGACY_KNOWN_ENTITY)
+        self._original_parser = None
+
+    def feed(self, data):
+        self.counter['passes'] += 1
+        self._original_parser = ElementTree.XMLParser()
+        self._original_parser.entity.update(self.known_entity)
+        try:
+            return self._original_parser.feed(data)
+        except ElementTree.ParseError as err:
+            entity = re.search(r'&\w+;', str(err))
+            if 'undefined entity' not in str(err) or not entity:
+                raise
+            self.known_entity[entity.group()[1:-1]] = entity.group()[1:-1]
+            return self.feed(data)
+
+    def close(self):
+        return self._original_parser.close()
+
+
+class CountingXMLParser(AllEntitiesXMLParser):
+    counter = None
+
+    def feed(self, data):
+        self.counter['passes'] += 1
+        return super(CountingXMLParser, self).feed(data)
+
+
+def comparator_class(backend, counter, legacy=False):
+    """
+    ``PageBodyComparator`` on ``backend`` (``stdlib`` or ``lxml``) counting parser passes in ``counter``.
+    """
+    etree = ElementTree if backend == 'stdlib' else lxml_etree
+
+    class Comparator(PageBodyComparator):
+        cache = FingerprintCache()
+
+        @classmethod
+        def _parser(cls):
+            if backend == 'lxml':
+                counter['passes'] += 1
+                return etree.HTMLParser() if legacy else super(Comparator, cls)._parser()
+            if legacy:
+                return LegacyAllEntitiesXMLParser(counter)
+            parser = CountingXMLParser()
+            parser.counter = counter
+            return parser
+
+    Comparator.etree = etree
+    return Comparator
+
+
+def entity_body(distinct, paragraphs=200):
+    """
+    Page body with ``paragraphs`` paragraphs using ``distinct`` different named entities.
+    """
+    names = sorted(name for name in HTML_ENTITIES if name not in LEGACY_KNOWN_ENTITY and name.isalpha())[:distinct]
+    parts = []
+    for number in range(paragraphs):
+        entities = ''.join('&{};'.format(names[(number + i) % len(names)]) for i in range(5)) if names else ''
+        parts.append('<p>Paragraph {} &nbsp;{} text&ldquo;quoted&rdquo;</p>'.format(number, entities))
+    return ''.join(parts)
+
+
+def measure(backend, body, legacy, repeat):
+    counter = {'passes': 0}
+    comparator = comparator_class(backend, counter, legacy)
+    seconds = min(timeit.repeat(lambda: comparator._fingerprint(body), number=1, repeat=repeat))
+    return seconds, counter['passes'] // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing of entity-heavy page bodies')
+    parser.add_argument('--entities', type=int, nargs='+', default=[0, 5, 20, 100],
+                        help='Numbers of distinct entities in a body. Default: 0 5 20 100.')
+    parser.add_argument('--paragraphs', type=int, default=200, help='Paragraphs per body. Default: 200.')
+    parser.add_argument('--repeat', type=int, default=5, help='Best of REPEAT parses. Default: 5.')
+    parser.add_argument('-o', '--output', type=str, help='Save results as JSON.')
+    args = parser.parse_args()
+
+    backends = ['stdlib'] + (['lxml'] if lxml_etree is not None else [])
+    results = []
+    for backend in backends:
+        for distinct in args.entities:
+            body = entity_body(distinct, args.paragraphs)
+            result = OrderedDict([('backend', backend), ('entities', distinct), ('body_size', len(body))])
+            for name, legacy in (('legacy', True), ('current', False)):
+                seconds, passes = measure(backend, body, legacy, args.repeat)
+                result[name] = OrderedDict([('seconds', seconds), ('passes', passes)])
+            results.append(result)
+
+    header = ('Backend', 'Entities', 'Body KB', 'Legacy ms', 'Passes', 'Current ms', 'Passes', 'Speedup')
+    rows = [header]
+    for result in results:
+        rows.append((
+            result['backend'],
+            str(result['entities']),
+            '{:.0f}'.format(result['body_size'] / 1024.0),
+            '{:.2f}'.format(result['legacy']['seconds'] * 1000),
+            str(result['legacy']['passes']),
+            '{:.2f}'.format(result['current']['seconds'] * 1000),
+            str(result['current']['passes']),
+            '{:.1f}x'.format(result['legacy']['seconds'] / result['current']['seconds']),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]))
+    if lxml_etree is None:
+        print('lxml is not installed: only the standard library backend was measured')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
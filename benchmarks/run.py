@@ -0,0 +1,226 @@
+"""
+Runs ``conf_page_maker``, ``conf_publisher`` and ``conf_page_dumper`` on a synthetic build tree against a local
+fake Confluence and saves wall time, request count, requests per second, bytes moved and peak RSS of every run.
+
+Scenarios, in order:
+
+* ``make``: ``conf_page_maker`` creates every page of the tree
+* ``cold``: the first publish uploads every body and attachment
+* ``noop``: a publish with nothing changed
+* ``changed``: a publish after 10% of the page sources changed
+* ``dump``: ``conf_page_dumper`` dumps one page
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, OrderedDict
+
+from conf_publisher.auth import base64
+from conf_publisher.config import ConfigLoader, flatten_page_config_list
+from conf_publisher.testing.fake_confluence import FakeConfluence, FakeConfluenceServer
+
+from .tree import SyntheticTree, add_spec_arguments, spec_from_args
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTH = base64('benchmark:benchmark')
+
+
+class RunResult(object):
+    def __init__(self, scenario, command):
+        self.scenario = scenario
+        self.command = command
+        self.exit_code = None
+        self.wall_seconds = None
+        self.peak_rss_bytes = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.endpoints = Counter()
+        self.client_metrics = None
+
+    @property
+    def requests_per_second(self):
+        if not self.wall_seconds:
+            return None
+        return self.requests / self.wall_seconds
+
+    def to_dict(self):
+        return OrderedDict([
+            ('scenario', self.scenario),
+            ('command', self.command),
+            ('exit_code', self.exit_code),
+            ('wall_seconds', self.wall_seconds),
+            ('requests', self.requests),
+            ('requests_per_second', self.requests_per_second),
+            ('bytes_sent', self.bytes_sent),
+            ('bytes_received', self.bytes_received),
+            ('peak_rss_bytes', self.peak_rss_bytes),
+            ('endpoints', OrderedDict(sorted(self.endpoints.items()))),
+            ('client_metrics', self.client_metrics),
+        ])
+
+
+def run_command(args):
+    """
+    Runs a Python module in a subprocess and returns its exit code and peak RSS in bytes (``None`` if unknown).
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPOSITORY_ROOT, env.get('PYTHONPATH')]))
+    process = subprocess.Popen([sys.executable, '-m'] + args, cwd=REPOSITORY_ROOT, env=env)
+
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    # kilobytes on Linux, bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    return process.returncode, peak_rss
+
+
+class Benchmark(object):
+    """
+    Publishes ``tree`` to ``confluence`` served by a local ``FakeConfluenceServer``.
+
+    :param publisher_args:  extra ``conf_publisher`` arguments, e.g. ``['--jobs', '8']``
+    """
+
+    def __init__(self, tree, confluence, publisher_args=None, change_fraction=0.1):
+        self.tree = tree
+        self.confluence = confluence
+        self.publisher_args = list(publisher_args or [])
+        self.change_fraction = change_fraction
+        self.results = []
+
+    def run(self):
+        with FakeConfluenceServer(self.confluence) as server:
+            root_id = self.confluence.add_page(title='Benchmark root')
+            self.tree.generate(server.url)
+
+            self._run('make', ['conf_publisher.page_maker', self.tree.config_path, '--url', server.url,
+                               '--auth', AUTH, '--parent-id', root_id])
+            self._run_publisher('cold', server.url)
+            self._run_publisher('noop', server.url)
+            self.tree.change(self.change_fraction)
+            self._run_publisher('changed', server.url)
+
+            page_id = self._first_page_id()
+            if page_id is not None:
+                self._run('dump', ['conf_publisher.page_dumper', str(page_id), '--url', server.url, '--auth', AUTH,
+                                   '--output', os.path.join(self.tree.root, 'dump.html')])
+        return self.results
+
+    def _run_publisher(self, scenario, url):
+        metrics_path = os.path.join(self.tree.root, 'metrics-{}.json'.format(scenario))
+        result = self._run(scenario, ['conf_publisher.publish', self.tree.config_path, '--url', url, '--auth', AUTH,
+                                      '--metrics-file', metrics_path] + self.publisher_args)
+        if os.path.exists(metrics_path):
+            with open(metrics_path) as f:
+                result.client_metrics = json.load(f, object_pairs_hook=OrderedDict)
+        return result
+
+    def _run(self, scenario, args):
+        result = RunResult(scenario, ' '.join(args))
+        requests_before = len(self.confluence.requests)
+        bytes_before = (self.confluence.bytes_received, self.confluence.bytes_sent)
+
+        started = time.time()
+        result.exit_code, result.peak_rss_bytes = run_command(args)
+        result.wall_seconds = time.time() - started
+
+        requests = self.confluence.requests[requests_before:]
+        result.requests = len(requests)
+        result.endpoints.update(endpoint for _, endpoint in requests)
+        # the client's point of view: bytes it sent are the bytes the server received
+        result.bytes_sent = self.confluence.bytes_received - bytes_before[0]
+        result.bytes_received = self.confluence.bytes_sent - bytes_before[1]
+
+        self.results.append(result)
+        return result
+
+    def _first_page_id(self):
+        config = ConfigLoader.from_yaml(self.tree.config_path)
+        for page_config in flatten_page_config_list(config.pages):
+            if page_config.id:
+                return page_config.id
+        return None
+
+
+def format_results(results):
+    header = ('Scenario', 'Exit', 'Wall s', 'Requests', 'Req/s', 'Sent KB', 'Received KB', 'Peak RSS MB')
+    rows = [header]
+    for result in results:
+        rows.append((
+            result.scenario,
+            str(result.exit_code),
+            '{:.2f}'.format(result.wall_seconds),
+            str(result.requests),
+            '{:.0f}'.format(result.requests_per_second or 0),
+            '{:.0f}'.format(result.bytes_sent / 1024.0),
+            '{:.0f}'.format(result.bytes_received / 1024.0),
+            '-' if result.peak_rss_bytes is None else '{:.1f}'.format(result.peak_rss_bytes / 1048576.0),
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in
+                                                           zip(row[1:], widths[1:])]) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark publishing a synthetic Sphinx build tree to a local '
+                                                 'fake Confluence')
+    add_spec_arguments(parser)
+    parser.add_argument('--change', type=float, default=0.1,
+                        help='Fraction of pages changed before the "changed" publish. Default: 0.1.')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds the server adds to every request.')
+    parser.add_argument('--bandwidth', type=int, help='Bytes per second of every request and response body.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='conf_publisher --jobs. Default: 1.')
+    parser.add_argument('-e', '--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='conf_publisher --engine. Default: threads.')
+    parser.add_argument('--workdir', type=str, help='Directory of the build tree. Default: a temporary directory, '
+                                                    'removed afterwards.')
+    parser.add_argument('-o', '--output', type=str, default='benchmark-results.json',
+                        help='Results JSON file. Default: benchmark-results.json.')
+    args = parser.parse_args()
+
+    spec = spec_from_args(args)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='conf-publisher-benchmark-')
+    confluence = FakeConfluence(latency=args.latency, bandwidth=args.bandwidth)
+    benchmark = Benchmark(SyntheticTree(workdir, spec), confluence,
+                          ['--jobs', str(args.jobs), '--engine', args.engine], args.change)
+    try:
+        results = benchmark.run()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = OrderedDict([
+        ('spec', spec.to_dict()),
+        ('server', OrderedDict([('latency', args.latency), ('bandwidth', args.bandwidth)])),
+        ('jobs', args.jobs),
+        ('engine', args.engine),
+        ('change', args.change),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('runs', [result.to_dict() for result in results]),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(format_results(results))
+    print('Results saved to {}'.format(args.output))
+    if any(result.exit_code for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
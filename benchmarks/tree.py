@@ -0,0 +1,246 @@
+"""
+Synthetic Sphinx build trees and matching version 2 configs.
+"""
+import argparse
+import codecs
+import json
+import math
+import os
+import random
+
+from conf_publisher.serializers import yaml_serializer
+
+WORDS = ('confluence', 'sphinx', 'publisher', 'page', 'section', 'release', 'config', 'request', 'attachment',
+         'version', 'module', 'package', 'build', 'deploy', 'service', 'client', 'server', 'storage', 'format')
+
+# the smallest valid PNG: 1x1 transparent pixel
+PNG_PIXEL = bytes(bytearray([
+    0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a, 0x00, 0x00, 0x00, 0x0d, 0x49, 0x48, 0x44, 0x52,
+    0x00, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01, 0x08, 0x06, 0x00, 0x00, 0x00, 0x1f, 0x15, 0xc4,
+    0x89, 0x00, 0x00, 0x00, 0x0d, 0x49, 0x44, 0x41, 0x54, 0x78, 0x9c, 0x63, 0x00, 0x01, 0x00, 0x00,
+    0x05, 0x00, 0x01, 0x0d, 0x0a, 0x2d, 0xb4, 0x00, 0x00, 0x00, 0x00, 0x49, 0x45, 0x4e, 0x44, 0xae,
+    0x42, 0x60, 0x82,
+]))
+
+
+class TreeSpec(object):
+    """
+    Scale of a synthetic build tree.
+
+    :param pages:           number of pages
+    :param depth:           maximum nesting depth of the page tree
+    :param body_size:       approximate size of a page body in bytes
+    :param images:          images per page
+    :param image_size:      size of an image in bytes
+    :param downloads:       downloads per page
+    :param download_size:   size of a download in bytes
+    :param source_format:   ``fjson`` or ``html``
+    :param seed:            random seed of the generated content
+    """
+    ATTRS = ('pages', 'depth', 'body_size', 'images', 'image_size', 'downloads', 'download_size', 'source_format',
+             'seed')
+
+    def __init__(self, pages=100, depth=3, body_size=8192, images=1, image_size=4096, downloads=1,
+                 download_size=16384, source_format='fjson', seed=0):
+        self.pages = pages
+        self.depth = depth
+        self.body_size = body_size
+        self.images = images
+        self.image_size = image_size
+        self.downloads = downloads
+        self.download_size = download_size
+        self.source_format = source_format
+        self.seed = seed
+
+    @property
+    def fanout(self):
+        """
+        Number of subpages of every page, so that ``pages`` fit into ``depth`` levels.
+        """
+        return max(int(math.ceil(self.pages ** (1.0 / max(self.depth, 1)))), 1)
+
+    def parent_index(self, index):
+        """
+        Index of the parent page of page ``index`` or ``None`` for a top level page.
+        """
+        parent = index // self.fanout - 1
+        return parent if parent >= 0 else None
+
+    def to_dict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.ATTRS)
+
+
+class SyntheticTree(object):
+    """
+    Build tree in ``root``: page sources, ``_images``, ``_downloads`` and ``config.yml``.
+    """
+    SOURCE_EXTS = {'fjson': '.fjson', 'html': '.html'}
+
+    def __init__(self, root, spec):
+        self.root = os.path.abspath(root)
+        self.spec = spec
+        self.config_path = os.path.join(self.root, 'config.yml')
+        self.revisions = [0] * spec.pages
+        self._random = random.Random(spec.seed)
+
+    @property
+    def source_ext(self):
+        return self.SOURCE_EXTS[self.spec.source_format]
+
+    def source_name(self, index):
+        return 'pages/page_{:05d}'.format(index)
+
+    def image_names(self, index):
+        return ['image_{:05d}_{}.png'.format(index, number) for number in range(self.spec.images)]
+
+    def download_names(self, index):
+        return ['download_{:05d}_{}.bin'.format(index, number) for number in range(self.spec.downloads)]
+
+    def generate(self, url):
+        """
+        Writes every page source, image, download and the config.
+        """
+        for dirname in ('pages', '_images', '_downloads'):
+            path = os.path.join(self.root, dirname)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        for index in range(self.spec.pages):
+            self._write_source(index)
+            for name in self.image_names(index):
+                self._write_binary(os.path.join(self.root, '_images', name),
+                                   PNG_PIXEL + self._random_bytes(self.spec.image_size - len(PNG_PIXEL)))
+            for name in self.download_names(index):
+                self._write_binary(os.path.join(self.root, '_downloads', name),
+                                   self._random_bytes(self.spec.download_size))
+
+        self.write_config(url)
+        return self
+
+    def write_config(self, url):
+        """
+        Writes ``config.yml`` without page ids: ``conf_page_maker`` creates the pages and fills them in.
+        """
+        page_dicts = []
+        children = [page_dicts]
+        for index in range(self.spec.pages):
+            page_dict = {
+                'title': self._title(index),
+                'source': self.source_name(index),
+            }
+            if self.spec.images or self.spec.downloads:
+                page_dict['attachments'] = {
+                    'images': self.image_names(index),
+                    'downloads': self.download_names(index),
+                }
+            page_dict['pages'] = []
+            children.append(page_dict['pages'])
+
+            parent = self.spec.parent_index(index)
+            children[0 if parent is None else parent + 1].append(page_dict)
+
+        config_dict = {
+            'version': 2,
+            'url': url,
+            'base_dir': self.root,
+            'source_ext': self.source_ext,
+            'pages': page_dicts,
+        }
+        with open(self.config_path, 'w') as f:
+            yaml_serializer.dump(config_dict, stream=f)
+
+    def change(self, fraction):
+        """
+        Edits the body of every ``1 / fraction``-th page and returns the indexes of the edited pages.
+        """
+        if fraction <= 0:
+            return []
+        step = max(int(round(1 / fraction)), 1)
+        changed = list(range(0, self.spec.pages, step))
+        for index in changed:
+            self.revisions[index] += 1
+            self._write_source(index)
+        return changed
+
+    def _title(self, index):
+        return 'Page {:05d}'.format(index)
+
+    def _write_source(self, index):
+        random_ = random.Random('{}-{}'.format(self.spec.seed, index))
+        title = self._title(index)
+        body = self._body(index, random_)
+        path = os.path.join(self.root, self.source_name(index) + self.source_ext)
+
+        with codecs.open(path, 'w', encoding='utf-8') as f:
+            if self.spec.source_format == 'html':
+                f.write('<html><head><title>{}</title></head><body>{}</body></html>'.format(title, body))
+            else:
+                json.dump({'title': title, 'body': body, 'current_page_name': self.source_name(index)}, f)
+
+    def _body(self, index, random_):
+        parts = ['<h1>{}</h1>'.format(self._title(index))]
+        if self.revisions[index]:
+            parts.append('<p>Revision {}.</p>'.format(self.revisions[index]))
+        for name in self.image_names(index):
+            parts.append('<p><ac:image><ri:attachment ri:filename="{}" /></ac:image></p>'.format(name))
+
+        size = sum(len(part) for part in parts)
+        section = 0
+        while size < self.spec.body_size:
+            if section % 4 == 3:
+                part = '<pre>{}</pre>'.format(self._sentence(random_, 12).replace(' ', '\n    '))
+            elif section % 4 == 0:
+                part = '<h2 id="section-{0}">Section {0}</h2>'.format(section)
+            else:
+                part = '<p>{} <strong>{}</strong> {}</p>'.format(self._sentence(random_, 20), random_.choice(WORDS),
+                                                                 self._sentence(random_, 20))
+            parts.append(part)
+            size += len(part)
+            section += 1
+        return '\n'.join(parts)
+
+    @staticmethod
+    def _sentence(random_, words):
+        return ' '.join(random_.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def _random_bytes(self, size, block_size=1024):
+        # a random block repeated: content does not matter, only its size and uniqueness
+        block = bytes(bytearray(self._random.getrandbits(8) for _ in range(min(max(size, 0), block_size))))
+        return (block * (size // block_size + 1))[:max(size, 0)]
+
+    @staticmethod
+    def _write_binary(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+def add_spec_arguments(parser):
+    parser.add_argument('--pages', type=int, default=100, help='Number of pages. Default: 100.')
+    parser.add_argument('--depth', type=int, default=3, help='Maximum nesting depth of pages. Default: 3.')
+    parser.add_argument('--body-size', type=int, default=8192, help='Page body size in bytes. Default: 8192.')
+    parser.add_argument('--images', type=int, default=1, help='Images per page. Default: 1.')
+    parser.add_argument('--image-size', type=int, default=4096, help='Image size in bytes. Default: 4096.')
+    parser.add_argument('--downloads', type=int, default=1, help='Downloads per page. Default: 1.')
+    parser.add_argument('--download-size', type=int, default=16384, help='Download size in bytes. Default: 16384.')
+    parser.add_argument('--format', dest='source_format', choices=('fjson', 'html'), default='fjson',
+                        help='Page source format. Default: fjson.')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def spec_from_args(args):
+    return TreeSpec(**dict((attr, getattr(args, attr)) for attr in TreeSpec.ATTRS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Sphinx build tree and its config')
+    parser.add_argument('root', type=str, help='Output directory')
+    parser.add_argument('-u', '--url', type=str, default='http://127.0.0.1:8090', help='Confluence Url')
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    tree = SyntheticTree(args.root, spec_from_args(args)).generate(args.url)
+    print('Generated {} pages in {}'.format(tree.spec.pages, tree.root))
+
+
+if __name__ == '__main__':
+    main()
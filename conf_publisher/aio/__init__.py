@@ -0,0 +1,6 @@
+import sys
+
+from ..constants import ASYNCIO_MIN_PYTHON
+
+if sys.version_info < ASYNCIO_MIN_PYTHON:
+    raise ImportError('The asyncio engine requires Python {}.{} or newer'.format(*ASYNCIO_MIN_PYTHON))
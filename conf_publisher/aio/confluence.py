@@ -0,0 +1,103 @@
+import asyncio
+
+from ..confluence import ConfluencePageManager, AttachmentPublisher, attachment_file
+from ..errors import AttachmentsError
+
+
+class AsyncConfluencePageManager(ConfluencePageManager):
+
+    async def load(self, content_id, with_body=False):
+        """
+        Loads the page. A body not loaded with ``with_body`` can not be fetched on access: use ``load_body``.
+        """
+        data = await self._api.get_content(content_id, self._expand(with_body))
+        return self._page_from_data(data)
+
+    async def load_many(self, content_ids, with_body=False):
+        pages = dict()
+        for cql in self._ids_cql(content_ids):
+            async for content_data in self._api.iter_search(cql, expand=self._expand(with_body),
+                                                            page_size=self.search_limit):
+                pages[content_data['id']] = self._page_from_data(content_data)
+        return pages
+
+    async def load_body(self, content_id):
+        data = await self._api.get_content(content_id, self.body_expand)
+        return data['body']['storage']['value']
+
+    def _page_from_data(self, data):
+        page = super(AsyncConfluencePageManager, self)._page_from_data(data)
+        # the loader would return a coroutine
+        page.body_loader = None
+        return page
+
+    async def load_versions(self, content_ids):
+        versions = dict()
+        for cql in self._ids_cql(content_ids):
+            async for content_data in self._api.iter_search(cql, expand='version', page_size=self.search_limit):
+                versions[content_data['id']] = content_data['version']['number']
+        return versions
+
+    async def load_titles(self, content_ids):
+        titles = dict()
+        for cql in self._ids_cql(content_ids):
+            async for content_data in self._api.iter_search(cql, page_size=self.search_limit):
+                titles[content_data['id']] = content_data['title']
+        return titles
+
+    async def create(self, page):
+        ret = await self._api.create_content(self._create_payload(page))
+        page.id = ret['id']
+        return page.id
+
+    async def update(self, page, bump_version=True):
+        if bump_version:
+            page.version_number += 1
+
+        ret = await self._api.update_content(page.id, self._update_payload(page))
+        page.id = ret['id']
+        return page.id
+
+
+class AsyncAttachmentPublisher(AttachmentPublisher):
+
+    async def publish(self, content_id, filepath, force=False):
+        loop = asyncio.get_event_loop()
+        await self.publish_page(content_id, [await loop.run_in_executor(None, attachment_file, filepath)], force)
+
+    async def publish_page(self, content_id, attachment_files, force=False):
+        attachments_index = await self._attachments_index(content_id)
+        updates, batches = self._plan_uploads(attachments_index, attachment_files, force)
+
+        failures = []
+        for original_attachment, attachment_file_ in updates:
+            try:
+                await self._api.update_attachment_data(content_id, original_attachment.id, attachment_file_,
+                                                       comment=self._digest_comment(attachment_file_),
+                                                       callback=self._progress_callback([attachment_file_]))
+            except Exception as err:
+                failures.append((attachment_file_.filename, err))
+
+        for batch in batches:
+            try:
+                ret = await self._api.create_attachments(content_id, batch,
+                                                         comments=[self._digest_comment(f) for f in batch],
+                                                         callback=self._progress_callback(batch))
+            except Exception as err:
+                failures.extend((f.filename, err) for f in batch)
+                continue
+            failures.extend(self._batch_failures(attachments_index, batch, ret))
+
+        if failures:
+            raise AttachmentsError(failures)
+
+    async def _attachments_index(self, content_id):
+        attachments_index = dict()
+        async for attachment in self._get_page_attachments(content_id):
+            attachments_index[attachment.title] = attachment
+        return attachments_index
+
+    async def _get_page_attachments(self, content_id):
+        async for attachment_data in self._api.iter_attachments(content_id, expand='version',
+                                                                page_size=self.list_limit):
+            yield self._parse_attachment(attachment_data)
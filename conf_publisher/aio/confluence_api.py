@@ -0,0 +1,195 @@
+import asyncio
+import json
+from timeit import default_timer
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .. import log
+from ..confluence_api import ConfluenceRestApiBase, ConfluenceRestApi553
+from ..constants import DEFAULT_CONFLUENCE_API_VERSION
+from ..errors import PublisherError
+from ..multipart import MultipartEncoder
+
+
+def create_client_session(session, limit=100, limit_per_host=0, keep_alive=True, stats=None):
+    """
+    Creates ``aiohttp.ClientSession`` authenticated the same way as ``session``.
+
+    :param session:         ``requests.Session`` returned by ``parse_authentication``
+    :param limit:           maximum number of simultaneous connections
+    :param limit_per_host:  maximum number of simultaneous connections to one host. ``0`` means no limit
+    :param keep_alive:      reuse connections between requests
+    :param stats:           ``ConnectionStats`` updated with every request and new connection. Optional
+    :return:
+    """
+    if aiohttp is None:
+        raise PublisherError('aiohttp is required for the asyncio engine. '
+                             'Install it with: pip install confluence-publisher[async]')
+
+    headers = {}
+    if session.auth is not None:
+        request = session.auth(requests.Request('GET', 'http://localhost/').prepare())
+        headers['Authorization'] = request.headers['Authorization']
+
+    trace_configs = []
+    if stats is not None:
+        trace_configs.append(_stats_trace_config(stats))
+
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, force_close=not keep_alive)
+    return aiohttp.ClientSession(connector=connector, headers=headers, trace_configs=trace_configs)
+
+
+def _stats_trace_config(stats):
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        stats.add_request()
+
+    async def on_connection_create_end(session, context, params):
+        stats.add_connection()
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+def create_async_confluence_api(version, url, session, **kwargs):
+    confluence_api_class = None
+    if version == DEFAULT_CONFLUENCE_API_VERSION:
+        confluence_api_class = AsyncConfluenceRestApi553
+
+    if confluence_api_class is None:
+        raise NotImplementedError('This API Version is not implemented')
+
+    confluence_api = confluence_api_class(url, session, **kwargs)
+
+    return confluence_api
+
+
+class AsyncConfluenceRestApiBase(ConfluenceRestApiBase):
+    """
+    Asynchronous counterpart of ``ConfluenceRestApiBase`` working on top of ``aiohttp.ClientSession``.
+
+    ``_request`` is a coroutine, so every API method built on top of it must be awaited. ``limiter`` must be
+    an ``AsyncConcurrencyLimiter``.
+    """
+
+    async def _request(self, method, url, endpoint=None, **kwargs):
+        if 'headers' not in kwargs:
+            kwargs['headers'] = self.headers
+
+        log.debug('Request URL: %s', url)
+        log.debug('Request Arguments: %s', kwargs)
+
+        # serialized once, so the body size is known and retries do not serialize it again
+        payload = kwargs.pop('json', None)
+        if payload is not None:
+            kwargs['data'] = json.dumps(payload).encode('utf-8')
+
+        data = kwargs.get('data')
+        if isinstance(data, MultipartEncoder):
+            kwargs['headers'] = dict(kwargs['headers'], **{'Content-Length': str(len(data))})
+
+        attempt = 0
+        # a PUT retried after a gateway or connection error may have been applied by an earlier attempt
+        maybe_applied = False
+        while True:
+            if isinstance(data, MultipartEncoder):
+                data.rewind()
+                kwargs['data'] = self._stream(data)
+
+            if self.limiter is not None:
+                await self.limiter.acquire()
+            status = None
+            body = b''
+            started = default_timer()
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    status = r.status
+                    body = await r.read()
+                    if status == requests.codes.ok:
+                        ret = await r.json(content_type=None)
+                        break
+                    delay = self._retry_delay(method, attempt, status, retry_after=r.headers.get('Retry-After'))
+                    if delay is None and not (maybe_applied and status == requests.codes.conflict):
+                        log.error(body)
+                        r.raise_for_status()
+                        ret = await r.json(content_type=None)
+                        break
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                delay = self._retry_delay(method, attempt, error=err)
+                if delay is None:
+                    raise
+            finally:
+                if self.limiter is not None:
+                    await self.limiter.release(self._is_throttled(status))
+                if self.metrics is not None:
+                    bytes_sent = len(data) if data is not None and status is not None else 0
+                    self.metrics.record(endpoint or method, status, default_timer() - started, bytes_sent, len(body))
+
+            if delay is None:
+                return await self._applied_update(url, payload, r, body)
+
+            maybe_applied = maybe_applied or (method.upper() == 'PUT' and not self._is_throttled(status))
+            self._log_retry(method, url, attempt, status, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        log.debug('Request Response: %s', ret)
+
+        return ret
+
+    async def _applied_update(self, url, payload, response, body):
+        version = self._update_version(payload)
+        if version is not None:
+            current = await self._get(url, 'get_content', params={'expand': 'version'})
+            if current.get('version', {}).get('number') == version:
+                self._log_applied(url, version)
+                return current
+        log.error(body)
+        response.raise_for_status()
+
+    async def _paginate(self, fetch, page_size):
+        """
+        Async counterpart of ``ConfluenceRestApiBase._paginate``. The next page is requested in a task while
+        the items of the current one are consumed.
+        """
+        start = 0
+        data = await fetch(start, page_size)
+        while True:
+            next_page = None
+            if self._has_next(data):
+                start += len(data['results'])
+                next_page = asyncio.ensure_future(fetch(start, page_size))
+
+            try:
+                for item in data['results']:
+                    yield item
+            except BaseException:
+                if next_page is not None:
+                    next_page.cancel()
+                raise
+
+            if next_page is None:
+                break
+            data = await next_page
+
+    @staticmethod
+    async def _stream(encoder):
+        loop = asyncio.get_event_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, encoder.read, encoder.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class AsyncConfluenceRestApi553(AsyncConfluenceRestApiBase, ConfluenceRestApi553):
+    # Same method surface as ConfluenceRestApi553, every method returns a coroutine and iter_* methods return
+    # async iterators
+    pass
@@ -0,0 +1,161 @@
+import asyncio
+import functools
+
+from .. import log
+from ..confluence import attachment_file
+from ..constants import DEFAULT_CONFLUENCE_API_VERSION
+from ..errors import PublishError
+from ..publish import Publisher, create_data_provider
+from ..retry import AdaptiveLimit
+from ..transport import HttpSettings, ConnectionStats, log_connection_stats
+from .confluence import AsyncConfluencePageManager, AsyncAttachmentPublisher
+from .confluence_api import create_client_session, create_async_confluence_api
+from .retry import AsyncConcurrencyLimiter
+
+
+def create_async_publisher(config, confluence_api, jobs=1, state=None):
+    page_manager = AsyncConfluencePageManager(confluence_api)
+    attachment_publisher = AsyncAttachmentPublisher(confluence_api)
+    data_provider = create_data_provider(config)
+    return AsyncPublisher(config, data_provider, page_manager, attachment_publisher, jobs=jobs, state=state)
+
+
+class AsyncPublisher(Publisher):
+    """
+    Publisher running on an asyncio event loop.
+
+    Every page is loaded, compared, updated and gets its attachments uploaded as one pipeline. At most ``jobs``
+    pipelines run at a time. Comparison is CPU bound and runs in the loop executor.
+    """
+
+    async def _load_remote_versions(self, page_configs):
+        if self._state is None:
+            return
+        self._remote_versions = await self._page_manager.load_versions(
+            [page_config.id for page_config in page_configs]
+        )
+
+    async def _load_titles(self, page_configs):
+        content_ids = [page_config.id for page_config in page_configs]
+        try:
+            return await self._page_manager.load_titles(content_ids)
+        except Exception as err:
+            log.warning('Loading titles of %d pages at once failed (%s). Loading them one by one.'
+                        % (len(content_ids), err))
+
+        semaphore = asyncio.Semaphore(self._jobs)
+
+        async def load(content_id):
+            async with semaphore:
+                return await self._page_manager.load(content_id)
+
+        titles = dict()
+        pages = await asyncio.gather(*[load(content_id) for content_id in content_ids], return_exceptions=True)
+        for content_id, page in zip(content_ids, pages):
+            if isinstance(page, Exception):
+                self._page_failed(content_id, page)
+            else:
+                titles[str(content_id)] = page.title
+        return titles
+
+    async def _load_anchors(self, page_configs):
+        titles = await self._load_titles(page_configs)
+        loop = asyncio.get_event_loop()
+        self._anchors = await loop.run_in_executor(None, self._anchor_index, page_configs, titles)
+        return self._without_failed(page_configs)
+
+    async def _page_to_update(self, page_config, force=False, hold_titles=False):
+        loop = asyncio.get_event_loop()
+        page_source = await loop.run_in_executor(None, self._page_source, page_config, force, hold_titles)
+        if page_source is None:
+            return None
+        source_data, page_source_hash = page_source
+
+        current_page = await self._page_manager.load(page_config.id, with_body=True)
+        compared_page = functools.partial(self._compared_page, current_page, page_config, source_data,
+                                          page_source_hash, force, hold_titles)
+        return await loop.run_in_executor(None, compared_page)
+
+    async def publish(self, force=False, watermark=False, hold_titles=False):
+        self._failures = []
+        page_configs = self._page_configs()
+        semaphore = asyncio.Semaphore(self._jobs)
+
+        try:
+            await self._load_remote_versions(page_configs)
+            if hold_titles:
+                page_configs = await self._load_anchors(page_configs)
+            errors = await asyncio.gather(*[
+                self._publish_page_config(semaphore, page_config, force, hold_titles)
+                for page_config in page_configs
+            ])
+        finally:
+            if self._state is not None:
+                self._state.commit()
+
+        for page_config, err in zip(page_configs, errors):
+            if err is not None:
+                self._page_failed(page_config.id, err)
+
+        if self._failures:
+            raise PublishError(self._failures)
+
+    async def _publish_page_config(self, semaphore, page_config, force=False, hold_titles=False):
+        async with semaphore:
+            try:
+                page = await self._page_to_update(page_config, force, hold_titles)
+                if page is not None:
+                    await self._publish_page(page)
+
+                filepaths = self._page_attachment_files(page_config)
+                if filepaths:
+                    loop = asyncio.get_event_loop()
+                    attachment_files = await asyncio.gather(*[
+                        loop.run_in_executor(None, attachment_file, filepath) for filepath in filepaths
+                    ])
+                    await self._publish_page_attachements(page_config.id, attachment_files, force)
+            except Exception as err:
+                return err
+        return None
+
+    async def _publish_page(self, page):
+        log.info('Publishing page: id: %s' % page.id)
+        content_id = await self._page_manager.update(page)
+        self._remember_published(content_id, self._source_hashes.pop(str(page.id), None), page.version_number)
+        log.info('Published to: %s' % content_id)
+
+    async def _publish_page_attachements(self, content_id, attachment_files, force=False):
+        log.info('Publishing attachments: %s (parent_id: %s)'
+                 % (', '.join(attachment_file.filepath for attachment_file in attachment_files), content_id))
+        await self._attachment_manager.publish_page(content_id, attachment_files, force)
+        log.info('Published to: %s' % content_id)
+
+
+async def publish(config, session, jobs=1, force=False, watermark=False, hold_titles=False, state=None,
+                  retry_policy=None, metrics=None):
+    limiter = None
+    if retry_policy is not None:
+        limiter = AsyncConcurrencyLimiter(AdaptiveLimit(jobs, max_limit=jobs))
+
+    settings = HttpSettings(config.http, jobs)
+    stats = ConnectionStats()
+    client_session = create_client_session(session, limit=settings.pool_maxsize, limit_per_host=settings.pool_maxsize,
+                                           keep_alive=settings.keep_alive, stats=stats)
+    async with client_session:
+        confluence_api = create_async_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, config.url, client_session,
+                                                     retry_policy=retry_policy, limiter=limiter, metrics=metrics)
+        publisher = create_async_publisher(config, confluence_api, jobs, state)
+        try:
+            await publisher.publish(force, watermark, hold_titles)
+        finally:
+            log_connection_stats(stats)
+
+
+def run_publish(config, session, jobs=1, force=False, watermark=False, hold_titles=False, state=None,
+                retry_policy=None, metrics=None):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(publish(config, session, jobs, force, watermark, hold_titles, state, retry_policy,
+                                        metrics))
+    finally:
+        loop.close()
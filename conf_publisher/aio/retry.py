@@ -0,0 +1,29 @@
+import asyncio
+
+
+class AsyncConcurrencyLimiter(object):
+    """
+    Asyncio counterpart of ``ConcurrencyLimiter`` sharing the same ``AdaptiveLimit``.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = None
+
+    async def acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self, throttled=False):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit.on_throttle()
+            else:
+                self.limit.on_success()
+            self._condition.notify_all()
@@ -12,6 +12,7 @@ class Config(object):
         self.downloads_dir = None
         self.images_dir = None
         self.source_ext = None
+        self.http = HttpConfig()
         self.pages = list()
 
     def __eq__(self, other):
@@ -31,6 +32,22 @@ class Config(object):
         return first == second
 
 
+class HttpConfig(object):
+    """
+    HTTP connection settings. Settings left as ``None`` are sized to the publish concurrency.
+    """
+    ATTRS = ('pool_connections', 'pool_maxsize', 'pool_block', 'keep_alive')
+
+    def __init__(self):
+        self.pool_connections = None
+        self.pool_maxsize = None
+        self.pool_block = None
+        self.keep_alive = None
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+
 class PageConfig(object):
     def __init__(self):
         self.id = None
@@ -111,10 +128,21 @@ class ConfigLoader:
             if attr in config_dict:
                 setattr(config, attr, config_dict[attr])
 
+        config.http = cls._http_from_dict(config_dict.get('http', dict()))
         config.pages = cls._pages_from_list(config_dict.get('pages', list()))
 
         return config
 
+    @staticmethod
+    def _http_from_dict(http_dict):
+        http_config = HttpConfig()
+
+        for attr in HttpConfig.ATTRS:
+            if attr in http_dict:
+                setattr(http_config, attr, http_dict[attr])
+
+        return http_config
+
     @classmethod
     def _pages_from_list(cls, pages_list):
         pages = list()
@@ -166,10 +194,25 @@ class ConfigDumper:
             if attr_value:
                 config_dict[attr] = attr_value
 
+        http_dict = cls._http_to_dict(config.http)
+        if len(http_dict):
+            config_dict['http'] = http_dict
+
         config_dict['pages'] = cls._pages_to_list(config.pages)
 
         return config_dict
 
+    @staticmethod
+    def _http_to_dict(http_config):
+        http_dict = OrderedDict()
+
+        for attr in HttpConfig.ATTRS:
+            attr_value = getattr(http_config, attr)
+            if attr_value is not None:
+                http_dict[attr] = attr_value
+
+        return http_dict
+
     @classmethod
     def _pages_to_list(cls, pages_config):
         pages = list()
@@ -190,7 +233,7 @@ class ConfigDumper:
             page_dict['attachments'] = OrderedDict()
         if len(page_config.images):
             page_dict['attachments']['images'] = cls._attaches_to_path(page_config.images)
-        if len(page_config.images):
+        if len(page_config.downloads):
             page_dict['attachments']['downloads'] = cls._attaches_to_path(page_config.downloads)
 
         pages = cls._pages_to_list(page_config.pages)
@@ -1,89 +1,143 @@
 import os
 import re
-import copy
+import functools
+import hashlib
+import json
 import mimetypes
-from collections import namedtuple
-from operator import attrgetter
+import threading
+from collections import namedtuple, OrderedDict
 
 try:
     from lxml import etree
 except ImportError:
     import xml.etree.ElementTree as etree
 
+from xml.etree import ElementTree
+
+try:
+    from html.entities import html5 as _html5_entities
+    HTML_ENTITIES = dict((name[:-1], value) for name, value in _html5_entities.items() if name.endswith(';'))
+except ImportError:
+    from htmlentitydefs import name2codepoint as _name2codepoint
+    HTML_ENTITIES = dict((name, unichr(codepoint)) for name, codepoint in _name2codepoint.items())
+
 try:
     from urllib import pathname2url
 except ImportError:
     from urllib.request import pathname2url
 
 from . import log
+from .errors import PublisherError, AttachmentsError
+from .multipart import ProgressLogger
+
+
+# body of a page loaded without it
+NOT_LOADED = object()
 
 
 class Content(object):
-    type = None
+    """
+    Confluence content. Models have ``__slots__``: tens of thousands of them are held by bulk loads.
+
+    ``_fields`` lists every slot compared by ``==``.
+    """
+    __slots__ = ('id', 'type')
+    _fields = __slots__
+    TYPE = None
 
     def __init__(self):
         self.id = None
+        self.type = self.TYPE
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        for field in self._fields:
+            if getattr(self, field) != getattr(other, field, None):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
 
 
 class Attachement(Content):
-    type = 'attachment'
+    __slots__ = ('title', 'media_type', 'file_size', 'version_number', 'digest')
+    _fields = Content._fields + __slots__
+    TYPE = 'attachment'
 
     def __init__(self):
         self.title = ''
         self.media_type = ''
+        self.file_size = None
+        self.version_number = None
+        self.digest = None
         super(Attachement, self).__init__()
 
 
 class ImageAttachement(Attachement):
-    pass
+    __slots__ = ()
 
 
 class DownloadAttachement(Attachement):
-    pass
+    __slots__ = ()
 
 
 class Page(Content):
-    type = 'page'
+    """
+    Confluence page. The body of a page loaded without it is fetched by ``body_loader`` on first access.
+    """
+    __slots__ = ('version_number', 'space_key', 'ancestors', '_body', 'body_loader', 'title', 'unused_title')
+    # compared before ancestors and the body, which are expensive
+    _fields = Content._fields + ('version_number', 'space_key', 'title', 'unused_title')
+    TYPE = 'page'
 
     def __init__(self):
         self.version_number = 0
         self.space_key = None
         self.ancestors = list()
-        self.body = None
+        self._body = None
+        self.body_loader = None
         self.title = None
         self.unused_title = None
         super(Page, self).__init__()
 
+    @property
+    def body(self):
+        if self._body is NOT_LOADED:
+            if self.body_loader is None:
+                raise PublisherError('Body of page {} is not loaded'.format(self.id))
+            self._body = self.body_loader()
+            self.body_loader = None
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+        self.body_loader = None
+
+    @property
+    def body_loaded(self):
+        return self._body is not NOT_LOADED
+
     def __eq__(self, other):
-        first = copy.copy(self.__dict__)
-        second = copy.copy(other.__dict__)
+        if not super(Page, self).__eq__(other):
+            return False
 
-        del first['ancestors']
-        del second['ancestors']
         if len(self.ancestors) != len(other.ancestors):
             return False
-
-        for first_ancestor, second_ancestor in zip(self.ancestors, other.ancestors):
-            if not (first_ancestor == second_ancestor):
+        for i in range(len(self.ancestors)):
+            if self.ancestors[i] != other.ancestors[i]:
                 return False
 
-        del first['body']
-        del second['body']
-
-        is_body_eq = False
         try:
-            is_body_eq = PageBodyComparator.is_equal(self.body, other.body)
+            return PageBodyComparator.is_equal(self.body, other.body)
         except Exception as err:
             log.warning('WARNING Can\'t compare {} and {} {}'.format(self.title, other.title, err))
-
-        return is_body_eq and (first == second)
+            return False
 
 
 class Ancestor(Content):
-    type = 'page'
+    __slots__ = ()
+    TYPE = 'page'
 
 
 class ConfluenceManager(object):
@@ -92,16 +146,88 @@ class ConfluenceManager(object):
 
 
 class ConfluencePageManager(ConfluenceManager):
+    # number of page ids in one CQL query and number of results in one search response
+    search_ids_count = 100
+    search_limit = 100
+
+    metadata_expand = 'ancestors,version,space'
+    body_expand = 'body.storage'
+
+    def load(self, content_id, with_body=False):
+        """
+        Loads the page. Without ``with_body`` its body is fetched on first access.
+        """
+        data = self._api.get_content(content_id, self._expand(with_body))
+        return self._page_from_data(data)
+
+    def load_many(self, content_ids, with_body=False):
+        """
+        Returns pages keyed by page id, using a few CQL searches for the whole list instead of one request per page.
+        Pages that are not found are missing from the result. Without ``with_body`` a body is fetched on first
+        access.
+        """
+        pages = dict()
+        for cql in self._ids_cql(content_ids):
+            for content_data in self._api.iter_search(cql, expand=self._expand(with_body),
+                                                      page_size=self.search_limit):
+                pages[content_data['id']] = self._page_from_data(content_data)
+        return pages
+
+    def load_body(self, content_id):
+        data = self._api.get_content(content_id, self.body_expand)
+        return data['body']['storage']['value']
+
+    def load_versions(self, content_ids):
+        """
+        Returns current version numbers of pages keyed by page id, using a few CQL searches for the whole list.
+        """
+        versions = dict()
+        for cql in self._ids_cql(content_ids):
+            for content_data in self._api.iter_search(cql, expand='version', page_size=self.search_limit):
+                versions[content_data['id']] = content_data['version']['number']
+        return versions
+
+    def load_titles(self, content_ids):
+        """
+        Returns current titles of pages keyed by page id, using a few CQL searches for the whole list.
+        """
+        titles = dict()
+        for cql in self._ids_cql(content_ids):
+            for content_data in self._api.iter_search(cql, page_size=self.search_limit):
+                titles[content_data['id']] = content_data['title']
+        return titles
+
+    def create(self, page):
+        ret = self._api.create_content(self._create_payload(page))
+        page.id = ret['id']
+        return page.id
+
+    def update(self, page, bump_version=True):
+        if bump_version:
+            page.version_number += 1
+
+        ret = self._api.update_content(page.id, self._update_payload(page))
+        page.id = ret['id']
+        return page.id
 
-    def load(self, content_id):
-        data = self._api.get_content(content_id, 'ancestors,version,space,body.storage')
+    @classmethod
+    def _expand(cls, with_body=False):
+        if with_body:
+            return cls.metadata_expand + ',' + cls.body_expand
+        return cls.metadata_expand
+
+    def _page_from_data(self, data):
         p = Page()
         p.id = data['id']
         p.type = data['type']
         p.version_number = data['version']['number']
         p.space_key = data['space']['key']
         p.title = data['title']
-        p.body = data['body']['storage']['value']
+        if 'storage' in data.get('body', {}):
+            p.body = data['body']['storage']['value']
+        else:
+            p.body = NOT_LOADED
+            p.body_loader = functools.partial(self.load_body, p.id)
 
         for ancestor_data in data['ancestors']:
             ancestor = Ancestor()
@@ -111,27 +237,24 @@ class ConfluencePageManager(ConfluenceManager):
 
         return p
 
-    def create(self, page):
-        ancestor = page.ancestors[-1]
-
-        data = self._page_payload(page.space_key, page.body, page.title,
-                                  ancestor_id=ancestor.id, ancestor_type=ancestor.type,)
-        ret = self._api.create_content(data)
-        page.id = ret['id']
-        return page.id
-
-    def update(self, page, bump_version=True):
-        if bump_version:
-            page.version_number += 1
+    @classmethod
+    def _ids_cql(cls, content_ids):
+        content_ids = [str(content_id) for content_id in content_ids]
+        for i in range(0, len(content_ids), cls.search_ids_count):
+            yield 'id in ({})'.format(','.join(content_ids[i:i + cls.search_ids_count]))
 
+    @classmethod
+    def _create_payload(cls, page):
         ancestor = page.ancestors[-1]
+        return cls._page_payload(page.space_key, page.body, page.title,
+                                 ancestor_id=ancestor.id, ancestor_type=ancestor.type,)
 
-        data = self._page_payload(page.space_key, page.body, page.title,
-                                  ancestor_id=ancestor.id, ancestor_type=ancestor.type,
-                                  content_id=page.id, version=page.version_number)
-        ret = self._api.update_content(page.id, data)
-        page.id = ret['id']
-        return page.id
+    @classmethod
+    def _update_payload(cls, page):
+        ancestor = page.ancestors[-1]
+        return cls._page_payload(page.space_key, page.body, page.title,
+                                 ancestor_id=ancestor.id, ancestor_type=ancestor.type,
+                                 content_id=page.id, version=page.version_number)
 
     @staticmethod
     def _page_payload(space_key, body=None, title=None,
@@ -176,146 +299,449 @@ class ConfluencePageManager(ConfluenceManager):
 
 AttachmentFile = namedtuple('attachment_file', [
     'filename',
-    'attachment',
-    'media_type'
+    'filepath',
+    'media_type',
+    'size',
+    'digest',
 ])
 
+ATTACHMENT_DIGEST_PREFIX = 'sha256:'
+ATTACHMENT_DIGEST_RE = re.compile(re.escape(ATTACHMENT_DIGEST_PREFIX) + r'([0-9a-f]{64})')
+
+
+def file_digest(filepath, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file_:
+        for chunk in iter(lambda: file_.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def attachment_file(filepath):
+    """
+    Describes a file to be uploaded. Reads the whole file once to compute its digest.
+    """
+    filename = os.path.basename(filepath)
+    url_ = pathname2url(filename)
+    media_type, encoding = mimetypes.guess_type(url_)
+    return AttachmentFile(filename, filepath, media_type, os.path.getsize(filepath), file_digest(filepath))
+
 
 class AttachmentPublisher(ConfluenceManager):
-    def publish(self, content_id, filepath):
-        attachments = self._get_page_attachments(content_id)
-        attachment_file = self._read_file(filepath)
-
-        if attachment_file.filename in map(attrgetter('title'), attachments):
-            original_attachment = next(
-                iter(
-                    filter(lambda x: x.title == attachment_file.filename, attachments)
-                )
-            )
-            self._api.update_attachment_data(content_id, original_attachment.id, attachment_file)
-        else:
-            self._api.create_attachment(content_id, attachment_file)
+    # number of attachments in one list response
+    list_limit = 100
+    # upload progress is logged for uploads of this size and bigger
+    progress_min_size = 10 * 1024 * 1024
+    # limits of one request creating several attachments
+    batch_max_files = 20
+    batch_max_size = 20 * 1024 * 1024
+
+    def publish(self, content_id, filepath, force=False):
+        self.publish_page(content_id, [attachment_file(filepath)], force)
+
+    def publish_page(self, content_id, attachment_files, force=False):
+        """
+        Uploads files to the page. Existing attachments are looked up once per page in an index of all
+        attachments of the page. Files with the same size and digest as the existing attachment are skipped
+        unless ``force`` is set. New files are created in batches of several files per request.
+
+        :param content_id:      page id
+        :param attachment_files: list of ``AttachmentFile``
+        :param force:           upload not changed files
+        :raises AttachmentsError: if some files failed to upload, after all other files are uploaded
+        """
+        attachments_index = self._attachments_index(content_id)
+        updates, batches = self._plan_uploads(attachments_index, attachment_files, force)
+
+        failures = []
+        for original_attachment, attachment_file_ in updates:
+            try:
+                self._api.update_attachment_data(content_id, original_attachment.id, attachment_file_,
+                                                 comment=self._digest_comment(attachment_file_),
+                                                 callback=self._progress_callback([attachment_file_]))
+            except Exception as err:
+                failures.append((attachment_file_.filename, err))
+
+        for batch in batches:
+            try:
+                ret = self._api.create_attachments(content_id, batch,
+                                                   comments=[self._digest_comment(f) for f in batch],
+                                                   callback=self._progress_callback(batch))
+            except Exception as err:
+                failures.extend((f.filename, err) for f in batch)
+                continue
+            failures.extend(self._batch_failures(attachments_index, batch, ret))
+
+        if failures:
+            raise AttachmentsError(failures)
+
+    def _plan_uploads(self, attachments_index, attachment_files, force=False):
+        """
+        Splits files into updates of existing attachments and batches of new ones.
+
+        :return:                ``(updates, batches)``, where updates is a list of ``(attachment, attachment_file)``
+                                and batches is a list of lists of ``AttachmentFile``
+        """
+        updates = []
+        new_files = OrderedDict()
+        for attachment_file_ in attachment_files:
+            original_attachment = attachments_index.get(attachment_file_.filename)
+            if not force and self._is_uploaded(original_attachment, attachment_file_):
+                log.info('Attachment %s is not changed. Skip.' % attachment_file_.filename)
+            elif original_attachment is not None:
+                updates.append((original_attachment, attachment_file_))
+            else:
+                new_files[attachment_file_.filename] = attachment_file_
+
+        return updates, self._batches(list(new_files.values()))
+
+    def _batches(self, attachment_files):
+        batches = []
+        batch, batch_size = [], 0
+        for attachment_file_ in attachment_files:
+            if batch and (len(batch) >= self.batch_max_files
+                          or batch_size + attachment_file_.size > self.batch_max_size):
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append(attachment_file_)
+            batch_size += attachment_file_.size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @classmethod
+    def _batch_failures(cls, attachments_index, batch, data):
+        created = cls._update_index(attachments_index, data)
+        return [(f.filename, PublisherError('attachment is missing in the response'))
+                for f in batch if f.filename not in created]
+
+    @staticmethod
+    def _is_uploaded(attachment, attachment_file_):
+        return attachment is not None \
+            and attachment.file_size == attachment_file_.size \
+            and attachment.digest == attachment_file_.digest
+
+    @staticmethod
+    def _digest_comment(attachment_file_):
+        return ATTACHMENT_DIGEST_PREFIX + attachment_file_.digest
+
+    def _attachments_index(self, content_id):
+        return dict((attachment.title, attachment) for attachment in self._get_page_attachments(content_id))
 
     def _get_page_attachments(self, content_id):
-        data = self._api.list_attachments(content_id)
+        for attachment_data in self._api.iter_attachments(content_id, expand='version', page_size=self.list_limit):
+            yield self._parse_attachment(attachment_data)
 
-        page_attachments = self._parse_attachments(data)
+    @classmethod
+    def _update_index(cls, attachments_index, data):
+        titles = set()
+        for attachment in cls._parse_attachments(data):
+            attachments_index[attachment.title] = attachment
+            titles.add(attachment.title)
+        return titles
 
-        return page_attachments
+    @classmethod
+    def _parse_attachments(cls, data):
+        return [cls._parse_attachment(attachment_data) for attachment_data in data.get('results', [])]
 
     @staticmethod
-    def _parse_attachments(data):
-        attachments = []
-        for attachment_data in data['results']:
-            media_type = attachment_data['metadata']['mediaType']
-            attachment_class = ImageAttachement if 'image' in media_type else DownloadAttachement
-            attachment = attachment_class()
-            attachment.id = attachment_data['id']
-            attachment.title = attachment_data['title']
-            attachment.media_type = media_type
+    def _parse_attachment(attachment_data):
+        media_type = attachment_data['metadata']['mediaType']
+        attachment_class = ImageAttachement if 'image' in media_type else DownloadAttachement
+        attachment = attachment_class()
+        attachment.id = attachment_data['id']
+        attachment.title = attachment_data['title']
+        attachment.media_type = media_type
+        attachment.file_size = attachment_data.get('extensions', {}).get('fileSize')
+        attachment.version_number = attachment_data.get('version', {}).get('number')
 
-            attachments.append(attachment)
+        digest = ATTACHMENT_DIGEST_RE.search(attachment_data['metadata'].get('comment') or '')
+        attachment.digest = digest.group(1) if digest else None
 
-        return attachments
+        return attachment
 
-    @staticmethod
-    def _read_file(filepath):
-        filename = os.path.basename(filepath)
-        url_ = pathname2url(filename)
-        media_type, encoding = mimetypes.guess_type(url_)
-        with open(filepath, 'rb') as file_:
-            new_attachment_file = AttachmentFile(filename, file_.read(), media_type)
-        return new_attachment_file
+    @classmethod
+    def _progress_callback(cls, attachment_files):
+        if sum(f.size for f in attachment_files) < cls.progress_min_size:
+            return None
+        return ProgressLogger(', '.join(f.filename for f in attachment_files))
 
 
 class AllEntitiesXMLParser(object):
-    # http://stackoverflow.com/questions/7237466/python-elementtree-support-for-parsing-unknown-xml-entities
-    known_entity = {
-        'nbsp': 'nbsp',
-        'ldquo': 'ldquo',
-        'rdquo': 'rdquo'
-    }
+    """
+    Standard library ``XMLParser`` knowing every HTML5 named entity.
 
-    def __init__(self, *args, **kwargs):
-        self.args = args
-        self.kwargs = kwargs
-        self._original_parser = None
+    Entities missing from the table are found with one scan of the document before parsing and replaced by their
+    names, so every document is parsed in a single pass.
+    """
+    known_entity = HTML_ENTITIES
+    xml_entities = frozenset(('amp', 'lt', 'gt', 'quot', 'apos'))
+    entity_expression = re.compile(br'&(\w+);')
 
-    def _init_parser(self):
-        self._original_parser = etree.XMLParser(*self.args, **self.kwargs)
+    def __init__(self, *args, **kwargs):
+        self._original_parser = ElementTree.XMLParser(*args, **kwargs)
         self._original_parser.entity.update(self.known_entity)
 
     def feed(self, data):
-        self._init_parser()
-        try:
-            return self._original_parser.feed(data)
-        except etree.ParseError as _err:
-            str_err = str(_err)
-            # fix unknown entity
-            if 'undefined entity' in str_err:
-                log.warning('WARNING {}'.format(str_err))
-                entity = re.search(r'&\w+;', str_err)
-                if entity:
-                    raw_entity = entity.group()[1:-1]
-                    self.known_entity[raw_entity] = raw_entity
-                    return self.feed(data)
-            raise _err
+        unknown_entity = self._unknown_entity(data)
+        if unknown_entity:
+            log.warning('WARNING undefined entities: {}'.format(', '.join(sorted(unknown_entity))))
+            self._original_parser.entity.update(unknown_entity)
+        return self._original_parser.feed(data)
 
     def close(self):
-        if self._original_parser is not None:
-            return self._original_parser.close()
+        return self._original_parser.close()
+
+    @classmethod
+    def _unknown_entity(cls, data):
+        unknown_entity = dict()
+        for name in set(cls.entity_expression.findall(data)):
+            name = name.decode('ascii', 'replace')
+            if name not in cls.known_entity and name not in cls.xml_entities:
+                unknown_entity[name] = name
+        return unknown_entity
+
+
+class FingerprintCache(object):
+    """
+    Thread-safe LRU cache of body fingerprints keyed by the SHA-1 of the raw body.
+
+    :param store:           ``PublishState`` keeping fingerprints between runs. Optional
+    :param max_size:        maximum number of fingerprints kept in memory
+    """
+
+    def __init__(self, store=None, max_size=10000):
+        self.store = store
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fingerprints = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def body_hash(body, version=''):
+        return hashlib.sha1((version + body).encode('utf-8')).hexdigest()
+
+    def get(self, body, compute, version=''):
+        """
+        Returns the fingerprint of ``body``, calling ``compute(body)`` only if it is not cached.
+
+        :param version:         version of the fingerprint function: fingerprints of other versions are not used
+        """
+        body_hash = self.body_hash(body, version)
+        with self._lock:
+            fingerprint = self._fingerprints.pop(body_hash, None)
+            if fingerprint is not None:
+                self._fingerprints[body_hash] = fingerprint
+                self.hits += 1
+                return fingerprint
+
+        fingerprint = self.store.get_fingerprint(body_hash) if self.store is not None else None
+        if fingerprint is None:
+            fingerprint = compute(body)
+            if self.store is not None:
+                self.store.set_fingerprint(body_hash, fingerprint)
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.hits += 1
+
+        with self._lock:
+            self._fingerprints[body_hash] = fingerprint
+            while len(self._fingerprints) > self.max_size:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+
+class ComparatorStats(object):
+    """
+    Number of body comparisons by the path which settled them and by result.
+    """
+    PATHS = ('identical', 'normalized', 'cached', 'parsed')
+
+    def __init__(self):
+        self.paths = OrderedDict((path, 0) for path in self.PATHS)
+        self.different = 0
+        self._lock = threading.Lock()
+
+    def add(self, path, equal):
+        with self._lock:
+            self.paths[path] += 1
+            if not equal:
+                self.different += 1
+
+    @property
+    def count(self):
+        return sum(self.paths.values())
+
+    def __str__(self):
+        return '%d compared (%s), %d different' % (
+            self.count, ', '.join('%d %s' % (count, path) for path, count in self.paths.items()), self.different
+        )
 
 
 class PageBodyComparator(object):
+    """
+    Compares page bodies in the storage format by their canonical form.
+
+    The canonical form keeps tags, attributes, texts and tails (text after an element) of every element.
+    Whitespace-only texts and tails are formatting and are dropped. Structured macros are compared by name only:
+    Confluence adds generated attributes (``ac:macro-id``, ...) to them.
+
+    Cheap checks come first: identical bodies and bodies differing only in whitespace between tags are equal
+    without parsing. Otherwise bodies are compared by the SHA-1 fingerprint of their canonical form, cached in
+    ``cache``: a body is parsed at most once however many times it is compared. ``stats`` counts which of these
+    settled every comparison.
+
+    Parsing holds the GIL. With a ``concurrent.futures.ProcessPoolExecutor`` in ``executor``, fingerprints of
+    bodies of at least ``process_min_size`` characters are computed in its processes: only the body is sent
+    and only the fingerprint comes back.
+    """
+    cache = FingerprintCache()
+    stats = ComparatorStats()
+
+    executor = None
+    # smaller bodies are parsed faster than they are sent to another process
+    process_min_size = 16384
+
+    # bump when the canonical form changes, so fingerprints persisted by older versions are not used
+    canonical_version = 3
+    EMPTY_FINGERPRINT = ''
+
+    # lxml or xml.etree.ElementTree
+    etree = etree
+    _local = threading.local()
+
+    # 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    # 'xsi:schemaLocation="http://www.atlassian.com/schema/confluence/4/ac/ confluence.xsd" '
+    wrapper = u'<?xml version="1.0" encoding="UTF-8"?>' \
+              u'<!DOCTYPE ac:confluence SYSTEM "confluence.dtd">' \
+              u'<ac:confluence xmlns:ac="http://www.atlassian.com/schema/confluence/4/ac/" ' \
+              u'xmlns:ri="http://www.atlassian.com/schema/confluence/4/ri/">{}</ac:confluence>'
+
+    macro_name_attribute = '{http://www.atlassian.com/schema/confluence/4/ac/}name'
+
+    # whitespace after a complete tag and before the next one
+    whitespace_between_tags = re.compile(r'(<[^<>]*>)\s+(?=<)')
 
     @classmethod
     def is_equal(cls, first, second):
-        if first == '' and second == '':
-            return True
+        if first == second:
+            return cls._settled('identical', True)
 
-        if first == '' and second != '' or first != '' and second == '':
-            return False
+        if first and second and cls._normalize_whitespace(first) == cls._normalize_whitespace(second):
+            return cls._settled('normalized', True)
 
-        # 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-        # 'xsi:schemaLocation="http://www.atlassian.com/schema/confluence/4/ac/ confluence.xsd" '
-        wrapper = u'<?xml version="1.0" encoding="UTF-8"?>' \
-                  u'<!DOCTYPE ac:confluence SYSTEM "confluence.dtd">' \
-                  u'<ac:confluence xmlns:ac="http://www.atlassian.com/schema/confluence/4/ac/" ' \
-                  u'xmlns:ri="http://www.atlassian.com/schema/confluence/4/ri/">{}</ac:confluence>'
+        parsed = []
+        equal = cls.fingerprint(first, parsed) == cls.fingerprint(second, parsed)
+        return cls._settled('parsed' if parsed else 'cached', equal)
 
-        first_xml = etree.XML(wrapper.format(first).encode(encoding='utf-8'), parser=cls._parser())
-        second_xml = etree.XML(wrapper.format(second).encode(encoding='utf-8'), parser=cls._parser())
-        return cls._elements_equal(first_xml, second_xml)
+    @classmethod
+    def _settled(cls, path, equal):
+        log.debug('Page bodies are %s: settled by the %s path' % ('equal' if equal else 'different', path))
+        cls.stats.add(path, equal)
+        return equal
 
-    @staticmethod
-    def _parser():
-        # use lxml HTMLParser if it exists
-        if hasattr(etree, 'HTMLParser'):
-            return etree.HTMLParser()
+    @classmethod
+    def _normalize_whitespace(cls, body):
+        # CDATA content (code macros) is text, where whitespace is not formatting
+        if 'CDATA[' in body:
+            return body
+        return cls.whitespace_between_tags.sub(r'\1', body.strip())
 
-        # or xml.etree.ElementTree.XMLParser
-        parser = AllEntitiesXMLParser()
-        return parser
+    @classmethod
+    def fingerprint(cls, body, parsed=None):
+        """
+        :param parsed:          list a body is appended to if it had to be parsed. Optional
+        """
+        if not body:
+            return cls.EMPTY_FINGERPRINT
+
+        def compute(body_):
+            if parsed is not None:
+                parsed.append(body_)
+            if cls.executor is not None and len(body_) >= cls.process_min_size:
+                return cls.executor.submit(body_fingerprint, body_).result()
+            return cls._fingerprint(body_)
+
+        return cls.cache.get(body, compute, '{}:{}:'.format(cls.canonical_version, cls.etree.__name__))
 
     @classmethod
-    def _elements_equal(cls, e1, e2):
-        if e1.tag != e2.tag:
-            return False
-        if e1.text != e2.text:
-            return False
-        if not cls._attributes_equals(e1, e2):
-            return False
-        if len(e1) != len(e2):
-            return False
-        return all(cls._elements_equal(c1, c2) for c1, c2 in zip(e1, e2))
+    def _fingerprint(cls, body):
+        fingerprint = hashlib.sha1()
+        for token in cls._canonical_tokens(body):
+            fingerprint.update(token.encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    @classmethod
+    def canonical_form(cls, body):
+        """
+        Returns the canonical form of ``body``: one line per element start (``[tag, attributes, text]`` in JSON)
+        and end (``tail}``).
+        """
+        if not body:
+            return ''
+        return ''.join(cls._canonical_tokens(body))
+
+    @classmethod
+    def _canonical_tokens(cls, body):
+        root = cls.etree.XML(cls.wrapper.format(body).encode(encoding='utf-8'), parser=cls._parser())
+
+        yield cls._start_token(root)
+        stack = [(root, iter(root))]
+        while stack:
+            element, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                yield json.dumps(cls._text(element.tail)) + '}\n'
+                continue
+
+            yield cls._start_token(child)
+            stack.append((child, iter(child)))
+
+    @classmethod
+    def _start_token(cls, element):
+        return json.dumps([cls._tag(element), cls._attributes(element), cls._text(element.text)]) + '{\n'
 
     @staticmethod
-    def _attributes_equals(e1, e2):
+    def _text(text):
+        if text is None or not text.strip():
+            return None
+        return text
+
+    @staticmethod
+    def _tag(element):
+        # lxml comments and processing instructions have factory functions as tags
+        return getattr(element.tag, '__name__', element.tag)
+
+    @classmethod
+    def _attributes(cls, element):
         # confluence create additional attributes for structured macros
-        if 'structured-macro' == e1.tag:
-            return e1.attrib.get('name') == e2.attrib.get('name')
-        elif 'structured-macro' in e1.tag:
-            confluence_ac_attribute_name = '{http://www.atlassian.com/schema/confluence/4/ac/}name'
-            return e1.attrib.get(confluence_ac_attribute_name) == e2.attrib.get(confluence_ac_attribute_name)
+        tag = cls._tag(element)
+        if 'structured-macro' == tag:
+            return [['name', element.attrib.get('name')]]
+        elif 'structured-macro' in tag:
+            return [[cls.macro_name_attribute, element.attrib.get(cls.macro_name_attribute)]]
+
+        return sorted([name, value] for name, value in element.attrib.items())
 
-        return e1.attrib == e2.attrib
+    @classmethod
+    def _parser(cls):
+        # use lxml HTMLParser if it exists: it is reusable, one per thread
+        if hasattr(cls.etree, 'HTMLParser'):
+            parsers = cls._local.__dict__.setdefault('parsers', dict())
+            if cls.etree.__name__ not in parsers:
+                parsers[cls.etree.__name__] = cls.etree.HTMLParser()
+            return parsers[cls.etree.__name__]
+
+        # or xml.etree.ElementTree.XMLParser, which can parse one document only
+        return AllEntitiesXMLParser()
+
+
+def body_fingerprint(body):
+    """
+    ``PageBodyComparator`` fingerprint of ``body``, for process pools.
+    """
+    return PageBodyComparator._fingerprint(body)
@@ -1,9 +1,15 @@
+import time
+from timeit import default_timer
+
 import requests
 from . import log
 from .constants import DEFAULT_CONFLUENCE_API_VERSION
+from .multipart import MultipartEncoder
+from .retry import parse_retry_after
+from .workers import prefetch
 
 
-def create_confluence_api(version, url, session):
+def create_confluence_api(version, url, session, **kwargs):
     # Documentation for different REST API versions: https://docs.atlassian.com/confluence/REST/
 
     confluence_api_class = None
@@ -13,7 +19,7 @@ def create_confluence_api(version, url, session):
     if confluence_api_class is None:
         raise NotImplementedError('This API Version is not implemented')
 
-    confluence_api = confluence_api_class(url, session)
+    confluence_api = confluence_api_class(url, session, **kwargs)
 
     return confluence_api
 
@@ -21,9 +27,19 @@ def create_confluence_api(version, url, session):
 class ConfluenceRestApiBase(object):
     api_path = 'rest/api'
 
-    def __init__(self, url, session):
+    def __init__(self, url, session, retry_policy=None, limiter=None, metrics=None):
+        """
+        :param url:             base Confluence url
+        :param session:         HTTP session
+        :param retry_policy:    ``RetryPolicy`` for failed requests. Requests are not retried if not set
+        :param limiter:         concurrency limiter shared by all users of the API object. Optional.
+        :param metrics:         ``RequestMetrics`` every request attempt is recorded to. Optional.
+        """
         self.confluence_url = url.rstrip('/')
         self.session = session
+        self.retry_policy = retry_policy
+        self.limiter = limiter
+        self.metrics = metrics
         self.headers = {
             'content-type': 'application/json',
         }
@@ -36,29 +52,67 @@ class ConfluenceRestApiBase(object):
         parts = [str(part) for part in url_parts]
         return '/'.join([self.confluence_url, self.api_path] + parts)
 
-    def _get(self, url, **kwargs):
-        return self._request(self.session.get, url, **kwargs)
+    def _get(self, url, endpoint=None, **kwargs):
+        return self._request('GET', url, endpoint, **kwargs)
 
-    def _post(self, url, _json=None, **kwargs):
-        return self._request(self.session.post, url, json=_json, **kwargs)
+    def _post(self, url, endpoint=None, _json=None, **kwargs):
+        return self._request('POST', url, endpoint, json=_json, **kwargs)
 
-    def _put(self, url, _json=None, **kwargs):
-        return self._request(self.session.put, url, json=_json, **kwargs)
+    def _put(self, url, endpoint=None, _json=None, **kwargs):
+        return self._request('PUT', url, endpoint, json=_json, **kwargs)
 
-    def _delete(self, url, **kwargs):
-        return self._request(self.session.delete, url, **kwargs)
+    def _delete(self, url, endpoint=None, **kwargs):
+        return self._request('DELETE', url, endpoint, **kwargs)
 
-    def _request(self, requester, url, **kwargs):
+    def _request(self, method, url, endpoint=None, **kwargs):
+        """
+        :param endpoint:        logical endpoint name the request is recorded under in ``metrics``. Default: method
+        """
         if 'headers' not in kwargs:
             kwargs['headers'] = self.headers
 
         log.debug('Request URL: %s', url)
         log.debug('Request Arguments: %s', kwargs)
 
-        r = requester(url, **kwargs)
-        if r.status_code != requests.codes.ok:
-            log.error(r.content)
-            r.raise_for_status()
+        attempt = 0
+        # a PUT retried after a gateway or connection error may have been applied by an earlier attempt
+        maybe_applied = False
+        while True:
+            self._rewind(kwargs.get('data'))
+
+            if self.limiter is not None:
+                self.limiter.acquire()
+            status = None
+            r = None
+            started = default_timer()
+            try:
+                r = self.session.request(method, url, **kwargs)
+                status = r.status_code
+            except (requests.ConnectionError, requests.Timeout) as err:
+                delay = self._retry_delay(method, attempt, error=err)
+                if delay is None:
+                    raise
+            else:
+                if status == requests.codes.ok:
+                    break
+                delay = self._retry_delay(method, attempt, status, retry_after=r.headers.get('Retry-After'))
+                if delay is None and not (maybe_applied and status == requests.codes.conflict):
+                    log.error(r.content)
+                    r.raise_for_status()
+                    break
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release(self._is_throttled(status))
+                if self.metrics is not None:
+                    self._record(endpoint or method, status, started, r)
+
+            if delay is None:
+                return self._applied_update(url, kwargs.get('json'), r)
+
+            maybe_applied = maybe_applied or (method.upper() == 'PUT' and not self._is_throttled(status))
+            self._log_retry(method, url, attempt, status, delay)
+            time.sleep(delay)
+            attempt += 1
 
         ret = r.json()
 
@@ -66,6 +120,93 @@ class ConfluenceRestApiBase(object):
 
         return ret
 
+    def _applied_update(self, url, payload, response):
+        """
+        Returns the current content if the conflicting update ``payload`` was applied by an earlier attempt whose
+        response was lost, otherwise raises the conflict.
+        """
+        version = self._update_version(payload)
+        if version is not None:
+            current = self._get(url, 'get_content', params={'expand': 'version'})
+            if current.get('version', {}).get('number') == version:
+                self._log_applied(url, version)
+                return current
+        log.error(response.content)
+        response.raise_for_status()
+
+    @staticmethod
+    def _update_version(payload):
+        if not isinstance(payload, dict):
+            return None
+        return payload.get('version', {}).get('number')
+
+    @staticmethod
+    def _log_applied(url, version):
+        log.warning('PUT %s conflicted after a retry: version %s is already published' % (url, version))
+
+    def _is_throttled(self, status):
+        return self.retry_policy is not None and self.retry_policy.is_throttled(status)
+
+    def _retry_delay(self, method, attempt, status=None, error=None, retry_after=None):
+        """
+        Returns seconds to wait before the next attempt, or ``None`` if the request must not be retried.
+        """
+        if self.retry_policy is None or not self.retry_policy.is_retryable(method, attempt, status, error):
+            return None
+        return self.retry_policy.backoff(attempt, parse_retry_after(retry_after))
+
+    def _record(self, endpoint, status, started, response=None):
+        bytes_sent = bytes_received = 0
+        if response is not None:
+            bytes_sent = len(response.request.body or b'')
+            bytes_received = len(response.content)
+        self.metrics.record(endpoint, status, default_timer() - started, bytes_sent, bytes_received)
+
+    @staticmethod
+    def _log_retry(method, url, attempt, status, delay):
+        log.warning('%s %s failed (%s). Retry %d in %.1f s.' % (method, url, status or 'connection error',
+                                                                 attempt + 1, delay))
+
+    @staticmethod
+    def _rewind(data):
+        rewind = getattr(data, 'rewind', None)
+        if rewind is not None:
+            rewind()
+
+    @staticmethod
+    def _has_next(data):
+        return bool(data['results']) and 'next' in data.get('_links', {})
+
+    def _paginate(self, fetch, page_size):
+        """
+        Yields the items of every page of a paginated collection. ``fetch(start, limit)`` returns one page.
+
+        The next page is fetched in a background thread while the items of the current one are consumed,
+        so at most a few pages are held in memory.
+        """
+        data = fetch(0, page_size)
+        if not self._has_next(data):
+            for item in data['results']:
+                yield item
+            return
+
+        pages = prefetch(self._result_pages(fetch, page_size, data))
+        try:
+            for results in pages:
+                for item in results:
+                    yield item
+        finally:
+            pages.close()
+
+    def _result_pages(self, fetch, page_size, data):
+        start = 0
+        while True:
+            yield data['results']
+            if not self._has_next(data):
+                break
+            start += len(data['results'])
+            data = fetch(start, page_size)
+
 
 class ConfluenceRestApi553(ConfluenceRestApiBase):
     # Documentation for Confluence v5.5.3 REST API: https://docs.atlassian.com/confluence/REST/5.5.3/
@@ -93,9 +234,22 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
         url = self._construct_url('content')
         params = self._build_params(params_map)
 
-        ret = self._get(url, params=params)
+        ret = self._get(url, 'list_content', params=params)
         return ret
 
+    def iter_content(self, space_key, type='page', title=None, posting_day=None,
+                     expand='history,space,version', page_size=25):
+        """
+        Iterates over Content of all pages of ``list_content`` results.
+
+        :param page_size:       number of items requested at once
+        :return:                iterator of content
+        """
+        return self._paginate(
+            lambda start, limit: self.list_content(space_key, type, title, posting_day, expand, start, limit),
+            page_size
+        )
+
     def get_content(self, content_id, expand='history,space,version'):
         """
         Returns a piece of Content.
@@ -111,9 +265,44 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
         url = self._construct_url('content', content_id)
         params = self._build_params(params_map)
 
-        ret = self._get(url, params=params)
+        ret = self._get(url, 'get_content', params=params)
         return ret
 
+    def search_content(self, cql, cql_context=None, expand=None, start=0, limit=25):
+        """
+        Fetch a list of content using the Confluence Query Language (CQL).
+
+        GET /rest/api/content/search?cql&cqlcontext&expand&start&limit
+
+        :param cql:             a cql query string to use to locate content
+        :param cql_context:     the context to execute a cql search in, this is the json serialized form of
+                                SearchContext
+        :param expand:          a comma separated list of properties to expand on the content. Optional.
+        :param start:           the start point of the collection to return
+        :param limit:           the limit of the number of items to return, this may be restricted by fixed system
+                                limits. Default: 25
+        :return:
+        """
+        params_map = {'cql': cql, 'cqlcontext': cql_context, 'expand': expand, 'start': start, 'limit': limit}
+
+        url = self._construct_url('content', 'search')
+        params = self._build_params(params_map)
+
+        ret = self._get(url, 'search_content', params=params)
+        return ret
+
+    def iter_search(self, cql, cql_context=None, expand=None, page_size=25):
+        """
+        Iterates over Content of all pages of ``search_content`` results.
+
+        :param page_size:       number of items requested at once
+        :return:                iterator of content
+        """
+        return self._paginate(
+            lambda start, limit: self.search_content(cql, cql_context, expand, start, limit),
+            page_size
+        )
+
     def create_content(self, data):
         """
         Creates a new piece of Content.
@@ -124,7 +313,7 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
         :return:
         """
         url = self._construct_url('content')
-        ret = self._post(url, data)
+        ret = self._post(url, 'create_content', data)
         return ret
 
     def update_content(self, content_id, data):
@@ -140,7 +329,7 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
 
         """
         url = self._construct_url('content', content_id)
-        ret = self._put(url, data)
+        ret = self._put(url, 'update_content', data)
         return ret
 
     def delete_content(self, content_id):
@@ -153,7 +342,7 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
         :return:
         """
         url = self._construct_url('content', content_id)
-        ret = self._delete(url)
+        ret = self._delete(url, 'delete_content')
         return ret
 
     def list_attachments(self, content_id, expand=None, start=0, limit=50, filename=None, media_type=None):
@@ -175,26 +364,55 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
         url = self._construct_url('content', content_id, 'child', 'attachment')
         params = self._build_params(params_map)
 
-        ret = self._get(url, params=params)
+        ret = self._get(url, 'list_attachments', params=params)
         return ret
 
-    def create_attachment(self, content_id, attachment, comment=None, minor_edits=False):
+    def iter_attachments(self, content_id, expand=None, page_size=50, filename=None, media_type=None):
+        """
+        Iterates over attachments of all pages of ``list_attachments`` results.
+
+        :param page_size:       number of items requested at once
+        :return:                iterator of attachments
+        """
+        return self._paginate(
+            lambda start, limit: self.list_attachments(content_id, expand, start, limit, filename, media_type),
+            page_size
+        )
+
+    def create_attachment(self, content_id, attachment, comment=None, minor_edits=False, callback=None):
         """
         Add one or more attachments to a Confluence Content entity, with optional comments.
 
         POST /rest/api/content/{id}/child/attachment
 
         :param content_id:      a string containing the id of the attachments content container
-        :param attachment:
+        :param attachment:      ``AttachmentFile`` to upload. The file is streamed from disk
         :param comment:
         :param minor_edits:
+        :param callback:        upload progress callback, called with ``(bytes_sent, total_bytes)``
+        :return:
+        """
+        return self.create_attachments(content_id, [attachment], [comment], minor_edits, callback)
+
+    def create_attachments(self, content_id, attachments, comments=None, minor_edits=False, callback=None):
+        """
+        Add several attachments to a Confluence Content entity in one request.
+
+        POST /rest/api/content/{id}/child/attachment
+
+        :param content_id:      a string containing the id of the attachments content container
+        :param attachments:     list of ``AttachmentFile`` to upload. Files are streamed from disk
+        :param comments:        list of comments, one for each attachment. Optional.
+        :param minor_edits:
+        :param callback:        upload progress callback, called with ``(bytes_sent, total_bytes)``
         :return:
         """
         url = self._construct_url('content', content_id, 'child', 'attachment')
-        ret = self._create_attachment(url, attachment, comment, minor_edits)
+        ret = self._create_attachment(url, 'create_attachments', attachments, comments, minor_edits, callback)
         return ret
 
-    def update_attachment_data(self, content_id, attachment_id, attachment, comment=None, minor_edits=False):
+    def update_attachment_data(self, content_id, attachment_id, attachment, comment=None, minor_edits=False,
+                               callback=None):
         """
         Update the binary data of an Attachment, and optionally the comment.
 
@@ -202,22 +420,31 @@ class ConfluenceRestApi553(ConfluenceRestApiBase):
 
         :param content_id:      a string containing the id of the attachments content container
         :param attachment_id:   the id of the attachment to update
-        :param attachment:
+        :param attachment:      ``AttachmentFile`` to upload. The file is streamed from disk
         :param comment:
         :param minor_edits:
+        :param callback:        upload progress callback, called with ``(bytes_sent, total_bytes)``
         :return:
         """
         url = self._construct_url('content', content_id, 'child', 'attachment', attachment_id, 'data')
-        ret = self._create_attachment(url, attachment, comment, minor_edits)
+        ret = self._create_attachment(url, 'update_attachment_data', [attachment], [comment], minor_edits, callback)
         return ret
 
-    def _create_attachment(self, url, attachment, comment=None, minor_edits=False):
+    def _create_attachment(self, url, endpoint, attachments, comments=None, minor_edits=False, callback=None):
+        # Confluence matches comments to files by their order
+        fields = [('comment', comment) for comment in comments or [] if comment is not None]
+        fields.append(('minorEdit', minor_edits))
+
+        encoder = MultipartEncoder(
+            fields=fields,
+            files=[('file', attachment.filename, attachment.filepath, attachment.media_type)
+                   for attachment in attachments],
+            callback=callback
+        )
         headers = {
             'X-Atlassian-Token': 'no-check',
+            'content-type': encoder.content_type,
         }
 
-        params_map = {'comment': comment, 'minorEdit': minor_edits}
-        params = self._build_params(params_map)
-
-        ret = self._post(url, files={'file': attachment}, data=params, headers=headers)
+        ret = self._post(url, endpoint, data=encoder, headers=headers)
         return ret
@@ -1,2 +1,4 @@
 DEFAULT_CONFLUENCE_API_VERSION = '5.5.3'
 DEFAULT_WATERMARK_CONTENT = 'Automatically generated content. Do not edit directly.'
+# the asyncio engine uses async generators
+ASYNCIO_MIN_PYTHON = (3, 6)
@@ -4,3 +4,25 @@ class PublisherError(Exception):
 
 class ConfigError(PublisherError):
     pass
+
+
+class PublishError(PublisherError):
+    def __init__(self, failures):
+        self.failures = failures
+        super(PublishError, self).__init__(
+            '{count} page(s) failed to publish: {ids}'.format(
+                count=len(failures),
+                ids=', '.join(str(content_id) for content_id, _ in failures)
+            )
+        )
+
+
+class AttachmentsError(PublisherError):
+    def __init__(self, failures):
+        self.failures = failures
+        super(AttachmentsError, self).__init__(
+            '{count} attachment(s) failed to upload: {names}'.format(
+                count=len(failures),
+                names=', '.join('{} ({})'.format(filename, err) for filename, err in failures)
+            )
+        )
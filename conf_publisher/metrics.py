@@ -0,0 +1,160 @@
+import json
+import math
+import threading
+from collections import OrderedDict, Counter
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list. Returns ``None`` for an empty list.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class EndpointStats(object):
+    """
+    Requests made to one logical endpoint: every attempt counts, retries included.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.latencies = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses = Counter()
+
+    def add(self, status, seconds, bytes_sent=0, bytes_received=0):
+        self.count += 1
+        self.latencies.append(seconds)
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+        self.statuses[str(status)] += 1
+
+    def latency(self):
+        latencies = sorted(self.latencies)
+        return OrderedDict([
+            ('p50', percentile(latencies, 50)),
+            ('p95', percentile(latencies, 95)),
+            ('p99', percentile(latencies, 99)),
+            ('max', latencies[-1] if latencies else None),
+            ('sum', sum(latencies)),
+        ])
+
+    def to_dict(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('latency', self.latency()),
+            ('bytes_sent', self.bytes_sent),
+            ('bytes_received', self.bytes_received),
+            ('statuses', OrderedDict(sorted(self.statuses.items()))),
+        ])
+
+
+class RequestMetrics(object):
+    """
+    Thread-safe request metrics grouped by logical endpoint (``get_content``, ``update_content``, ...).
+
+    Status is the HTTP status code, or ``error`` if no response was received.
+    """
+    ERROR_STATUS = 'error'
+
+    def __init__(self):
+        self.endpoints = dict()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, seconds, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = EndpointStats()
+            self.endpoints[endpoint].add(status or self.ERROR_STATUS, seconds, bytes_sent, bytes_received)
+
+    def to_dict(self):
+        with self._lock:
+            return OrderedDict((endpoint, self.endpoints[endpoint].to_dict()) for endpoint in sorted(self.endpoints))
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix='confluence_publisher'):
+        """
+        Returns metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        endpoints = self.to_dict()
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, metric_type))
+            for suffix, labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(key, value_) for key, value_ in labels)
+                lines.append('{}_{}{}{{{}}} {}'.format(prefix, name, suffix, label_text, value))
+
+        metric('requests_total', 'counter', 'Number of HTTP requests by endpoint and status.', [
+            ('', [('endpoint', endpoint), ('status', status)], count)
+            for endpoint, stats in endpoints.items() for status, count in stats['statuses'].items()
+        ])
+
+        samples = []
+        for endpoint, stats in endpoints.items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                samples.append(('', [('endpoint', endpoint), ('quantile', quantile)], stats['latency'][key]))
+            samples.append(('_sum', [('endpoint', endpoint)], stats['latency']['sum']))
+            samples.append(('_count', [('endpoint', endpoint)], stats['count']))
+        metric('request_duration_seconds', 'summary', 'HTTP request duration by endpoint.', samples)
+
+        metric('request_sent_bytes_total', 'counter', 'Bytes of HTTP request bodies sent by endpoint.', [
+            ('', [('endpoint', endpoint)], stats['bytes_sent']) for endpoint, stats in endpoints.items()
+        ])
+        metric('response_received_bytes_total', 'counter', 'Bytes of HTTP response bodies received by endpoint.', [
+            ('', [('endpoint', endpoint)], stats['bytes_received']) for endpoint, stats in endpoints.items()
+        ])
+
+        return '\n'.join(lines) + '\n'
+
+    def format_table(self):
+        header = ('Endpoint', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Sent', 'Received', 'Statuses')
+        rows = [header]
+        for endpoint, stats in self.to_dict().items():
+            latency = stats['latency']
+            rows.append((
+                endpoint,
+                str(stats['count']),
+                self._milliseconds(latency['p50']),
+                self._milliseconds(latency['p95']),
+                self._milliseconds(latency['p99']),
+                self._size(stats['bytes_sent']),
+                self._size(stats['bytes_received']),
+                ' '.join('{}:{}'.format(status, count) for status, count in stats['statuses'].items()),
+            ))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for row in rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:-1], widths[1:-1])]
+            lines.append('  '.join(cells + [row[-1]]))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """
+        Writes metrics to ``path``: JSON if it ends with ``.json``, Prometheus text format otherwise.
+        """
+        content = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        with open(path, 'w') as f:
+            f.write(content)
+
+    @staticmethod
+    def _milliseconds(seconds):
+        if seconds is None:
+            return '-'
+        return '{:.0f}'.format(seconds * 1000)
+
+    @staticmethod
+    def _size(size):
+        for unit in ('B', 'KB', 'MB'):
+            if size < 1024:
+                return '{:.0f} {}'.format(size, unit)
+            size /= 1024.0
+        return '{:.1f} GB'.format(size)
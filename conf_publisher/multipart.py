@@ -0,0 +1,150 @@
+import os
+import uuid
+
+from . import log
+
+
+class MultipartEncoder(object):
+    """
+    File-like ``multipart/form-data`` body that streams files from disk.
+
+    The body is produced chunk by chunk while it is read, so memory use does not depend on the size of the files.
+    The total length is known in advance and is sent as Content-Length.
+
+    :param fields:          list of ``(name, value)`` form fields
+    :param files:           list of ``(name, filename, filepath, content_type)`` file parts
+    :param boundary:        multipart boundary. Generated if not set
+    :param callback:        called with ``(bytes_read, total_bytes)`` after every read
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, fields=(), files=(), boundary=None, callback=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.callback = callback
+        self._parts = []
+
+        for name, value in fields:
+            self._parts.append(self._part_header(name) + self._encode(value) + b'\r\n')
+
+        for name, filename, filepath, content_type in files:
+            self._parts.append(self._part_header(name, filename, content_type))
+            self._parts.append(_FilePart(filepath))
+            self._parts.append(b'\r\n')
+
+        self._parts.append(self._encode('--{}--\r\n'.format(self.boundary)))
+        self._length = sum(len(part) for part in self._parts)
+        self.rewind()
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={}'.format(self.boundary)
+
+    def __len__(self):
+        return self._length
+
+    def rewind(self):
+        """
+        Restarts the body from the beginning, e.g. to send it again.
+        """
+        self.close()
+        self._position = 0
+        self._index = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._position
+
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            chunk = self._read_part(self._parts[self._index], size)
+            if not chunk:
+                self._next_part()
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+
+        data = b''.join(chunks)
+        self._position += len(data)
+        if self.callback is not None and data:
+            self.callback(self._position, self._length)
+        return data
+
+    def close(self):
+        for part in getattr(self, '_parts', []):
+            if isinstance(part, _FilePart):
+                part.close()
+
+    def _read_part(self, part, size):
+        if isinstance(part, _FilePart):
+            return part.read(size)
+        chunk = part[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return chunk
+
+    def _next_part(self):
+        part = self._parts[self._index]
+        if isinstance(part, _FilePart):
+            part.close()
+        self._index += 1
+        self._offset = 0
+
+    def _part_header(self, name, filename=None, content_type=None):
+        disposition = 'form-data; name="{}"'.format(self._quote(name))
+        if filename is not None:
+            disposition += '; filename="{}"'.format(self._quote(filename))
+
+        lines = ['--{}'.format(self.boundary), 'Content-Disposition: {}'.format(disposition)]
+        if filename is not None:
+            lines.append('Content-Type: {}'.format(content_type or 'application/octet-stream'))
+        return self._encode('\r\n'.join(lines) + '\r\n\r\n')
+
+    @staticmethod
+    def _quote(value):
+        # same escaping as browsers use for form-data names
+        return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bool):
+            value = str(value).lower()
+        if not isinstance(value, bytes):
+            value = u'{}'.format(value).encode('utf-8')
+        return value
+
+
+class _FilePart(object):
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._size = os.path.getsize(filepath)
+        self._file = None
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size):
+        if self._file is None:
+            self._file = open(self.filepath, 'rb')
+        return self._file.read(size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProgressLogger(object):
+    """
+    Upload progress callback logging every ``step`` percent of the file.
+    """
+
+    def __init__(self, filename, step=10):
+        self.filename = filename
+        self.step = step
+        self._logged = -step
+
+    def __call__(self, bytes_read, total_bytes):
+        percent = 100 * bytes_read // total_bytes if total_bytes else 100
+        if percent >= self._logged + self.step:
+            self._logged = percent - percent % self.step
+            log.info('Uploading %s: %d%% of %d bytes' % (self.filename, percent, total_bytes))
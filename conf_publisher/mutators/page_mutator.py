@@ -1,5 +1,56 @@
+import hashlib
+import json
+import posixpath
 import re
 
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+# compiled prefix patterns keyed by the sorted (prefix, suffix) pairs
+_block_patterns = {}
+
+
+def _block_pattern(markers):
+    key = tuple(sorted(markers.items()))
+    pattern = _block_patterns.get(key)
+    if pattern is None:
+        # longest first: a prefix that starts another one must not shadow it
+        prefixes = sorted(markers, key=len, reverse=True)
+        pattern = _block_patterns[key] = re.compile('|'.join(re.escape(prefix) for prefix in prefixes))
+    return pattern
+
+
+def strip_blocks(body, markers):
+    """
+    Removes every block from a prefix to the nearest following suffix of that prefix in one scan of ``body``.
+
+    :param markers: suffixes keyed by prefixes
+    """
+    if not body or not markers:
+        return body
+    pattern = _block_pattern(markers)
+    parts = []
+    position = 0
+    # prefixes whose suffix does not occur further on: the rest of their occurrences are left as they are
+    unclosed = set()
+    match = pattern.search(body)
+    while match is not None:
+        prefix = match.group()
+        end = -1 if prefix in unclosed else body.find(markers[prefix], match.end())
+        if end == -1:
+            unclosed.add(prefix)
+            match = pattern.search(body, match.end())
+            continue
+        parts.append(body[position:match.start()])
+        position = end + len(markers[prefix])
+        match = pattern.search(body, position)
+    if not parts:
+        return body
+    parts.append(body[position:])
+    return ''.join(parts)
+
 
 class PageMutator(object):
 
@@ -21,11 +72,14 @@ class TemplatePageMutator(PageMutator):
     def set_param(self, name, value):
         self.template_params[name] = value
 
+    def render(self):
+        return self.template_prefix + self.template.format(**self.template_params) + self.template_suffix
+
     def apply_forward(self, page):
-        page.body = self.template_prefix + self.template.format(**self.template_params) + self.template_suffix + page.body
+        page.body = self.render() + page.body
 
     def apply_backward(self, page):
-        page.body = re.sub(re.escape(self.template_prefix) + '.*' + re.escape(self.template_suffix), '', page.body, flags=re.DOTALL)
+        page.body = strip_blocks(page.body, {self.template_prefix: self.template_suffix})
 
 
 class WatermarkPageMutator(TemplatePageMutator):
@@ -56,20 +110,231 @@ class LinkPageMutator(TemplatePageMutator):
         self.set_param('link', link)
 
 
+def anchor_title(title):
+    """
+    Page title as it starts the anchors of the page: without whitespace.
+    """
+    return ''.join(title.split()) if title else ''
+
+
+def _trie_regex(node):
+    end = '' in node
+    branches = [re.escape(char) + _trie_regex(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 and not end else '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if end else pattern
+
+
+def trie_pattern(words):
+    """
+    Regular expression matching any of ``words``, longest first.
+
+    Alternatives are merged by their common prefixes, so matching at a position costs the length of the longest
+    word instead of the number of words.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+    return _trie_regex(trie)
+
+
+class AnchorIndex(object):
+    """
+    Source titles of the pages published with held titles mapped to the titles they keep in Confluence.
+
+    ``rewrite`` renames the title part of every ``#Title-anchor`` reference to any of the pages with one regular
+    expression, so a body is scanned once however many pages the index has. If several pages have the same source
+    title the first one added wins.
+    """
+
+    def __init__(self, titles=None):
+        self._titles = dict()
+        self._expression = None
+        self._digest = None
+        for source_title, title in titles or ():
+            self.add(source_title, title)
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, source_title, title):
+        source_title, title = anchor_title(source_title), anchor_title(title)
+        if source_title and title and source_title != title and source_title not in self._titles:
+            self._titles[source_title] = title
+            self._expression = None
+            self._digest = None
+
+    @property
+    def digest(self):
+        """
+        SHA-1 of the sorted ``(source_title, title)`` pairs, computed once per index.
+        """
+        if self._digest is None:
+            data = json.dumps(sorted(self._titles.items()), ensure_ascii=False)
+            self._digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        return self._digest
+
+    @property
+    def expression(self):
+        if self._expression is None and self._titles:
+            self._expression = re.compile('(?<=#)' + trie_pattern(self._titles) + '(?=-)')
+        return self._expression
+
+    def rewrite(self, body):
+        if not body or self.expression is None:
+            return body
+        return self.expression.sub(lambda match: self._titles[match.group()], body)
+
+
+class PageLinkIndex(object):
+    """
+    Confluence page ids keyed by the source paths of the pages in the config.
+
+    ``rewrite`` turns relative links between Sphinx pages (``../guide.html#setup``, ``../guide/``) into links to the
+    published pages in one scan of the body. A link is resolved with a couple of dictionary lookups. The index
+    holds plain strings only, so it can be pickled and sent to worker processes.
+
+    :param pages:       page ids keyed by source paths, without the source extension
+    :param url:         Confluence Url
+    :param source_ext:  source extension, stripped from links as well as ``.html``
+    """
+    href_expression = re.compile(r'(\bhref=)(["\'])([^"\'<>]*)\2')
+    link_template = '{url}/pages/viewpage.action?pageId={id}'
+
+    def __init__(self, pages=None, url=None, source_ext=None):
+        self.url = (url or '').rstrip('/')
+        self.suffixes = tuple(suffix for suffix in ('.html', source_ext) if suffix)
+        self._pages = dict((self._normalize(source), str(content_id)) for source, content_id in (pages or ()))
+
+    @classmethod
+    def from_config(cls, config, page_configs):
+        return cls(((page_config.source, page_config.id) for page_config in page_configs
+                    if page_config.source and page_config.id is not None), config.url, config.source_ext)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, source):
+        return self._pages.get(self._normalize(source))
+
+    def resolve(self, href, source):
+        """
+        Returns the Confluence link of ``href`` found in the page built from ``source``, or ``None`` if it does not
+        point to a page of the index.
+        """
+        path, _, fragment = href.partition('#')
+        if not path or path.startswith('/') or '?' in path or ':' in path.split('/', 1)[0]:
+            return None
+
+        path = unquote(path)
+        source = self._normalize(source)
+        bases = (posixpath.dirname(source), source)
+        candidates = []
+        if path.endswith('/'):
+            # the json and dirhtml builders serve a page as a directory, and an index page as its parent directory
+            path = path.rstrip('/')
+            candidates.append(path + '/index')
+            if posixpath.basename(source) != 'index':
+                bases = (source, posixpath.dirname(source))
+        else:
+            for suffix in self.suffixes:
+                if path.endswith(suffix):
+                    path = path[:-len(suffix)]
+                    break
+        candidates.insert(0, path)
+
+        for base in bases:
+            for candidate in candidates:
+                content_id = self._pages.get(posixpath.normpath(posixpath.join(base, candidate)))
+                if content_id is not None:
+                    link = self.link_template.format(url=self.url, id=content_id)
+                    return link + '#' + fragment if fragment else link
+        return None
+
+    def rewrite(self, body, source):
+        if not body or not self._pages or 'href=' not in body:
+            return body
+
+        def _link(match):
+            link = self.resolve(match.group(3), source)
+            if link is None:
+                return match.group()
+            return match.group(1) + match.group(2) + link + match.group(2)
+
+        return self.href_expression.sub(_link, body)
+
+    @staticmethod
+    def _normalize(source):
+        return posixpath.normpath(source.replace('\\', '/').strip('/'))
+
+
 class AnchorPageMutator(PageMutator):
-    anchor_expression = None
-    _old_title = u''
+    """
+    Renames anchors made from the source title of the page to its held title. With an ``AnchorIndex`` of every
+    page of the run anchors pointing to the other pages are renamed too.
+    """
 
-    def __init__(self, old_title):
-        if old_title:
-            self._old_title = ''.join(old_title.split())
-            self.anchor_expression = re.compile(re.escape(self._old_title))
+    def __init__(self, old_title, anchors=None):
+        self._old_title = old_title
+        self.anchors = anchors
 
     def apply_forward(self, page):
-        if not page.title or not page.body or not self.anchor_expression:
+        if not page.title or not page.body:
             return
-        _title = ''.join(page.title.split())
-        page.body = self.anchor_expression.sub(_title, page.body, re.I|re.U)
+        anchors = self.anchors
+        if anchors is None:
+            anchors = AnchorIndex([(self._old_title, page.title)])
+        page.body = anchors.rewrite(page.body)
 
     def apply_backward(self, page):
         pass
+
+
+class PageMutatorPipeline(PageMutator):
+    """
+    Applies ``mutators`` in order with one pass over the body per step instead of one per mutator.
+
+    Blocks of every template mutator are removed in one scan, and consecutive template blocks are added with one
+    join. Other mutators are applied as they are, between them.
+    """
+
+    def __init__(self, mutators):
+        self.mutators = list(mutators)
+        self._markers = dict((mutator.template_prefix, mutator.template_suffix) for mutator in self.mutators
+                             if isinstance(mutator, TemplatePageMutator))
+
+    def __len__(self):
+        return len(self.mutators)
+
+    def __iter__(self):
+        return iter(self.mutators)
+
+    def apply_forward(self, page):
+        blocks = []
+        for mutator in self.mutators:
+            if isinstance(mutator, TemplatePageMutator):
+                blocks.append(mutator.render())
+                continue
+            self._add_blocks(page, blocks)
+            blocks = []
+            mutator.apply_forward(page)
+        self._add_blocks(page, blocks)
+
+    def apply_backward(self, page):
+        if self._markers:
+            page.body = strip_blocks(page.body, self._markers)
+        for mutator in self.mutators:
+            if not isinstance(mutator, TemplatePageMutator):
+                mutator.apply_backward(page)
+
+    @staticmethod
+    def _add_blocks(page, blocks):
+        # every template mutator puts its block before the body, so the last one comes first
+        if blocks:
+            blocks.reverse()
+            blocks.append(page.body or '')
+            page.body = ''.join(blocks)
@@ -26,7 +26,7 @@ def main():
 
     confluence_api = create_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, args.url, auth)
     page_manager = ConfluencePageManager(confluence_api)
-    page = page_manager.load(args.page_id)
+    page = page_manager.load(args.page_id, with_body=True)
 
     if args.output.lower() == 'stdout':
         f = sys.stdout
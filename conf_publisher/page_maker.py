@@ -3,8 +3,9 @@ import argparse
 from . import log, setup_logger
 from .auth import parse_authentication
 from .confluence_api import create_confluence_api
+from .transport import configure_session
 from .constants import DEFAULT_CONFLUENCE_API_VERSION
-from .config import ConfigLoader, ConfigDumper
+from .config import ConfigLoader, ConfigDumper, flatten_page_config_list
 from .confluence import ConfluencePageManager, Page, Ancestor
 
 
@@ -33,10 +34,25 @@ def make_page(parent_page, title, page_manager):
     return int(page_id)
 
 
-def make_pages(config, page_manager, parent_id=None):
+def load_parent_pages(config, page_manager, parent_id=None):
+    """
+    Loads every existing page having subpages in the config with one bulk request.
+    """
+    content_ids = [parent_id] if parent_id else []
+    content_ids += [page_config.id for page_config in flatten_page_config_list(config.pages)
+                    if page_config.id and len(page_config.pages)]
+    if len(content_ids) > 1:
+        return page_manager.load_many(content_ids)
+    return dict()
+
+
+def make_pages(config, page_manager, parent_id=None, parent_pages=None):
+    if parent_pages is None:
+        parent_pages = load_parent_pages(config, page_manager, parent_id)
+
     parent_page = None
     if parent_id:
-        parent_page = page_manager.load(parent_id)
+        parent_page = parent_pages.get(str(parent_id)) or page_manager.load(parent_id)
 
     for page_config in config.pages:
         if not page_config.id:
@@ -52,7 +68,7 @@ def make_pages(config, page_manager, parent_id=None):
             log.info('Skip page with id {page_id}'.format(page_id=page_config.id))
 
         if len(page_config.pages):
-            make_pages(page_config, page_manager, page_config.id)
+            make_pages(page_config, page_manager, page_config.id, parent_pages)
 
 
 def main():
@@ -72,6 +88,7 @@ def main():
     config = ConfigLoader.from_yaml(args.config)
     setup_config_overrides(config, args.url)
 
+    configure_session(auth, config.http)
     confluence_api = create_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, config.url, auth)
     page_manager = ConfluencePageManager(confluence_api)
     make_pages(config, page_manager, args.parent_id)
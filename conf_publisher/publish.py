@@ -1,15 +1,27 @@
 import argparse
 import copy
+import functools
+import itertools
+import sys
 
 from . import log, setup_logger
 from .auth import parse_authentication
 from .confluence_api import create_confluence_api
-from .confluence import ConfluencePageManager, AttachmentPublisher
+from .confluence import ConfluencePageManager, AttachmentPublisher, PageBodyComparator, FingerprintCache, \
+    attachment_file
 from .config import ConfigLoader, flatten_page_config_list, PageImageAattachmentConfig
-from .constants import DEFAULT_CONFLUENCE_API_VERSION, DEFAULT_WATERMARK_CONTENT
+from .constants import DEFAULT_CONFLUENCE_API_VERSION, DEFAULT_WATERMARK_CONTENT, ASYNCIO_MIN_PYTHON
+from .errors import PublisherError, PublishError
+from .metrics import RequestMetrics
+from .retry import RetryPolicy, AdaptiveLimit, ConcurrencyLimiter
+from .transport import configure_session, record_session, replay_session, session_connection_stats, \
+    log_connection_stats
+from .state import PublishState, default_state_path, source_hash
 from .data_providers.sphinx_fjson_data_provider import SphinxFJsonDataProvider
 from .data_providers.sphinx_html_data_provider import SphinxHTMLDataProvider
-from .mutators.page_mutator import WatermarkPageMutator, LinkPageMutator, AnchorPageMutator
+from .mutators.page_mutator import WatermarkPageMutator, LinkPageMutator, AnchorPageMutator, AnchorIndex, \
+    PageLinkIndex, PageMutatorPipeline
+from .workers import parallel_map, prefetch, process_pool
 
 
 def get_data_provider_class(config):
@@ -20,27 +32,43 @@ def get_data_provider_class(config):
     return data_provider_class
 
 
-def create_publisher(config, confluence_api):
-    page_manager = ConfluencePageManager(confluence_api)
-    attachment_publisher = AttachmentPublisher(confluence_api)
-
+def create_data_provider(config):
     data_provider_class = get_data_provider_class(config)
 
-    data_provider = data_provider_class(
+    return data_provider_class(
         base_dir=config.base_dir,
         downloads_dir=config.downloads_dir,
         images_dir=config.images_dir,
         source_ext=config.source_ext
     )
-    return Publisher(config, data_provider, page_manager, attachment_publisher)
+
+
+def create_publisher(config, confluence_api, jobs=1, state=None, queue_size=None):
+    page_manager = ConfluencePageManager(confluence_api)
+    attachment_publisher = AttachmentPublisher(confluence_api)
+    data_provider = create_data_provider(config)
+    return Publisher(config, data_provider, page_manager, attachment_publisher,
+                     jobs=jobs, state=state, queue_size=queue_size)
 
 
 class Publisher(object):
-    def __init__(self, config, data_provider, page_manager, attachment_manager):
+    # maximum number of pages loaded with one bulk request
+    load_batch_size = 50
+
+    def __init__(self, config, data_provider, page_manager, attachment_manager, jobs=1, state=None,
+                 queue_size=None):
         self._config = config
         self._data_provider = data_provider
         self._page_manager = page_manager
         self._attachment_manager = attachment_manager
+        self._jobs = jobs
+        self._queue_size = queue_size or 2 * jobs
+        self._state = state
+        self._failures = []
+        self._remote_versions = dict()
+        self._source_hashes = dict()
+        self._anchors = None
+        self._links = PageLinkIndex.from_config(config, flatten_page_config_list(config.pages))
 
     @staticmethod
     def _page_title(current_title, new_title, config_title=None, hold_current=False):
@@ -55,11 +83,24 @@ class Publisher(object):
             result = current_title
         return result
 
-    def _page(self, current_page, source):
+    def _source_data(self, page_config):
+        title, body = self._data_provider.get_source_data(self._data_provider.get_source(page_config.source))
+        # links to the other pages are part of the source: they are hashed and compared rewritten
+        return title, self._links.rewrite(body, page_config.source)
+
+    @staticmethod
+    def _page(current_page, source_data):
         page = copy.copy(current_page)
-        page.title, page.body = self._data_provider.get_source_data(self._data_provider.get_source(source))
+        page.title, page.body = source_data
         return page
 
+    def _source_hash(self, page_config, source_data, hold_titles=False):
+        values = (source_data, page_config.title, page_config.link, page_config.watermark, hold_titles)
+        if hold_titles and self._anchors:
+            # anchors to other pages depend on their held titles too
+            values += (self._anchors.digest,)
+        return source_hash(*values)
+
     def _page_attachment_file(self, attachment_config):
         if isinstance(attachment_config, PageImageAattachmentConfig):
             return self._data_provider.get_image(attachment_config.path)
@@ -67,13 +108,11 @@ class Publisher(object):
 
     @staticmethod
     def _remove_page_mutators(page, mutators):
-        for mutator in mutators:
-            mutator.apply_backward(page)
+        mutators.apply_backward(page)
 
     @staticmethod
     def _add_page_mutators(page, mutators):
-        for mutator in mutators:
-            mutator.apply_forward(page)
+        mutators.apply_forward(page)
 
     def _init_page_mutators(self, page_config, old_title, hold_titles):
         mutators = []
@@ -83,64 +122,273 @@ class Publisher(object):
         if page_config.watermark:
             mutators.append(WatermarkPageMutator(page_config.watermark))
         if hold_titles:
-            mutators.append(AnchorPageMutator(old_title))
+            mutators.append(AnchorPageMutator(old_title, self._anchors))
 
-        return mutators
+        return PageMutatorPipeline(mutators)
 
-    def _pages_to_update(self, force=False, watermark=False, hold_titles=False):
-        pages_to_update = []
-        for page_config in flatten_page_config_list(self._config.pages):
+    def _page_configs(self):
+        page_configs = list(flatten_page_config_list(self._config.pages))
+        for page_config in page_configs:
             if page_config.id is None:
                 raise AttributeError('Missed attribute "id"')
-            current_page = self._page_manager.load(page_config.id)
-            page = self._page(current_page, page_config.source)
+        return page_configs
+
+    def _load_remote_versions(self, page_configs):
+        if self._state is None:
+            return
+        self._remote_versions = self._page_manager.load_versions([page_config.id for page_config in page_configs])
+
+    def _source_title(self, page_config):
+        return self._data_provider.get_source_data(self._data_provider.get_source(page_config.source))[0]
+
+    def _source_titles(self, page_configs):
+        """
+        Yields ``(page_config, source_title)`` of every page whose source can be read. Only titles are kept: the
+        source is read again when the page is compared, so memory does not grow with the size of the tree.
+        """
+        for result in parallel_map(self._source_title, page_configs, self._jobs):
+            if result.error is None:
+                yield result.item, result.value
+
+    def _anchor_index(self, page_configs, titles):
+        """
+        Builds the ``AnchorIndex`` of ``--hold-titles`` from current page titles keyed by page id.
+        """
+        return AnchorIndex((source_title, titles[str(page_config.id)])
+                           for page_config, source_title in self._source_titles(page_configs)
+                           if str(page_config.id) in titles)
+
+    def _load_titles(self, page_configs):
+        """
+        Returns current page titles keyed by page id. If the search fails, pages are loaded one by one without
+        bodies, and a page which can not be loaded fails.
+        """
+        content_ids = [page_config.id for page_config in page_configs]
+        try:
+            return self._page_manager.load_titles(content_ids)
+        except Exception as err:
+            log.warning('Loading titles of %d pages at once failed (%s). Loading them one by one.'
+                        % (len(content_ids), err))
+
+        titles = dict()
+        for result in parallel_map(self._page_manager.load, content_ids, self._jobs):
+            if result.error is not None:
+                self._page_failed(result.item, result.error)
+            else:
+                titles[str(result.item)] = result.value.title
+        return titles
+
+    def _load_anchors(self, page_configs):
+        """
+        Builds the anchor index. Returns the page configs to compare: without pages which failed to load.
+        """
+        self._anchors = self._anchor_index(page_configs, self._load_titles(page_configs))
+        return self._without_failed(page_configs)
+
+    def _without_failed(self, page_configs):
+        failed = set(str(content_id) for content_id, _ in self._failures)
+        return [page_config for page_config in page_configs if str(page_config.id) not in failed]
+
+    def _is_published(self, page_config, page_source_hash, force=False):
+        if force or self._state is None:
+            return False
+        version = self._remote_versions.get(str(page_config.id))
+        if self._state.is_unchanged(page_config.id, page_source_hash, version):
+            log.debug('Page %s is not changed since the last publish' % page_config.id)
+            return True
+        return False
+
+    def _remember_published(self, content_id, page_source_hash, version):
+        if self._state is not None and page_source_hash is not None:
+            self._state.set(content_id, page_source_hash, version)
+
+    def _page_source(self, page_config, force=False, hold_titles=False):
+        """
+        Returns ``(source_data, page_source_hash)``, or ``None`` if the page is not changed since the last publish.
+        """
+        source_data = self._source_data(page_config)
+        page_source_hash = self._source_hash(page_config, source_data, hold_titles)
+        if self._is_published(page_config, page_source_hash, force):
+            return None
+        return source_data, page_source_hash
+
+    def _load_pages(self, content_ids):
+        """
+        Returns pages keyed by page id, or the error raised loading a page. If the bulk load fails, pages are loaded
+        one by one, so one broken page does not fail the rest of the batch.
+        """
+        if len(content_ids) > 1:
+            try:
+                return self._page_manager.load_many(content_ids, with_body=True)
+            except Exception as err:
+                log.warning('Loading %d pages at once failed (%s). Loading them one by one.' % (len(content_ids), err))
+
+        pages = dict()
+        for content_id in content_ids:
+            try:
+                pages[str(content_id)] = self._page_manager.load(content_id, with_body=True)
+            except Exception as err:
+                pages[str(content_id)] = err
+        return pages
+
+    def _batch_to_update(self, page_configs, force=False, hold_titles=False):
+        """
+        Compares a batch of pages loaded together. Returns ``(page_config, page, error)`` for every changed
+        or failed page.
+        """
+        results = []
+        page_sources = []
+        for page_config in page_configs:
+            try:
+                page_source = self._page_source(page_config, force, hold_titles)
+            except Exception as err:
+                results.append((page_config, None, err))
+                continue
+            if page_source is not None:
+                page_sources.append((page_config, page_source))
+
+        current_pages = self._load_pages([page_config.id for page_config, _ in page_sources])
+        for page_config, (source_data, page_source_hash) in page_sources:
+            try:
+                current_page = current_pages.get(str(page_config.id))
+                if current_page is None:
+                    raise PublisherError('Page {} is not found'.format(page_config.id))
+                if isinstance(current_page, Exception):
+                    raise current_page
+                page = self._compared_page(current_page, page_config, source_data, page_source_hash,
+                                           force, hold_titles)
+            except Exception as err:
+                results.append((page_config, None, err))
+                continue
+            if page is not None:
+                results.append((page_config, page, None))
+        return results
+
+    def _batches(self, page_configs):
+        # small enough to keep every worker busy, large enough to load a batch with one or two searches
+        batch_size = max(min(self.load_batch_size, -(-len(page_configs) // max(self._jobs, 1))), 1)
+        for i in range(0, len(page_configs), batch_size):
+            yield page_configs[i:i + batch_size]
+
+    def _compared_page(self, current_page, page_config, source_data, page_source_hash=None,
+                       force=False, hold_titles=False):
+        """
+        Builds the new version of ``current_page`` from its source and returns it, or ``None`` if the page
+        is up to date and publishing is not forced.
+        """
+        page = self._page(current_page, source_data)
+
+        mutators = self._init_page_mutators(page_config, page.title, hold_titles)
+        self._remove_page_mutators(current_page, mutators)
+
+        page.title = self._page_title(current_page.title, page.title, page_config.title, hold_titles)
+        if not force and current_page == page:
+            self._remember_published(current_page.id, page_source_hash, current_page.version_number)
+            return None
+
+        self._add_page_mutators(page, mutators)
+        self._source_hashes[str(page.id)] = page_source_hash
 
-            mutators = self._init_page_mutators(page_config, page.title, hold_titles)
-            self._remove_page_mutators(current_page, mutators)
+        return page
 
-            page.title = self._page_title(current_page.title, page.title, page_config.title, hold_titles)
-            if not force and current_page == page:
+    def _pages_to_update(self, force=False, watermark=False, hold_titles=False):
+        """
+        Returns a generator of changed pages in config order. Page configs are validated before it is returned.
+        """
+        page_configs = self._page_configs()
+        self._load_remote_versions(page_configs)
+        if hold_titles:
+            page_configs = self._load_anchors(page_configs)
+        return self._iter_pages_to_update(page_configs, force, hold_titles)
+
+    def _iter_pages_to_update(self, page_configs, force=False, hold_titles=False):
+        batch_to_update = functools.partial(self._batch_to_update, force=force, hold_titles=hold_titles)
+        for result in parallel_map(batch_to_update, self._batches(page_configs), self._jobs):
+            if result.error is not None:
+                for page_config in result.item:
+                    self._page_failed(page_config.id, result.error)
                 continue
+            for page_config, page, err in result.value:
+                if err is not None:
+                    self._page_failed(page_config.id, err)
+                else:
+                    yield page
 
-            self._add_page_mutators(page, mutators)
+    def _page_failed(self, content_id, err):
+        log.error('Page %s failed: %s' % (content_id, err))
+        self._failures.append((content_id, err))
 
-            pages_to_update.append(page)
-        return pages_to_update
+    def _page_attachment_files(self, page_config):
+        return [self._page_attachment_file(attachment_config)
+                for attachment_config in page_config.images + page_config.downloads]
 
     def _attachments_to_update(self, force=False):
-        attachments_to_update = []
-        for page_config in flatten_page_config_list(self._config.pages):
-            for attachment_config in page_config.images + page_config.downloads:
-                page_attachment = (page_config.id, self._page_attachment_file(attachment_config))
-                attachments_to_update.append(page_attachment)
-        return attachments_to_update
+        """
+        Yields ``(content_id, attachment_files)`` for every page with attachments. Files are hashed in the worker pool.
+        """
+        page_files = (
+            (page_config.id, filepath)
+            for page_config in flatten_page_config_list(self._config.pages)
+            for filepath in self._page_attachment_files(page_config)
+        )
+        page_attachment_file = lambda item: attachment_file(item[1])
+        results = parallel_map(page_attachment_file, page_files, self._jobs)
+        for content_id, page_results in itertools.groupby(results, key=lambda result: result.item[0]):
+            attachment_files = []
+            for result in page_results:
+                if result.error is not None:
+                    self._page_failed(content_id, result.error)
+                else:
+                    attachment_files.append(result.value)
+            if attachment_files:
+                yield content_id, attachment_files
 
     def publish(self, force=False, watermark=False, hold_titles=False):
-        pages_to_update = self._pages_to_update(force, watermark, hold_titles)
-        attachments_to_update = self._attachments_to_update(force)
+        """
+        Compares pages in a background pipeline and uploads every changed page as soon as it is found.
+
+        At most ``queue_size`` changed pages wait for the upload, so memory does not grow with the size of the tree.
+        """
+        self._failures = []
+        try:
+            pages_to_update = self._pages_to_update(force, watermark, hold_titles)
 
-        log.info('Publishing pages...')
-        self._publish_pages(pages_to_update)
+            log.info('Publishing pages...')
+            self._publish_pages(prefetch(pages_to_update, self._queue_size))
 
-        log.info('Publishing attachments...')
-        self._publish_attachments(attachments_to_update)
+            log.info('Publishing attachments...')
+            self._publish_attachments(self._attachments_to_update(force), force)
+        finally:
+            if self._state is not None:
+                self._state.commit()
+
+        if self._failures:
+            raise PublishError(self._failures)
 
     def _publish_pages(self, pages):
         for page in pages:
-            self._publish_page(page)
+            try:
+                self._publish_page(page)
+            except Exception as err:
+                self._page_failed(page.id, err)
 
     def _publish_page(self, page):
         log.info('Publishing page: id: %s' % page.id)
         content_id = self._page_manager.update(page)
+        self._remember_published(content_id, self._source_hashes.pop(str(page.id), None), page.version_number)
         log.info('Published to: %s' % content_id)
 
-    def _publish_attachments(self, attachments):
-        for content_id, attachment in attachments:
-            self._publish_page_attachement(content_id, attachment)
-
-    def _publish_page_attachement(self, content_id, filename):
-        log.info('Publishing attachment: %s (parent_id: %s)' % (filename, content_id))
-        self._attachment_manager.publish(content_id, filename)
+    def _publish_attachments(self, attachments, force=False):
+        for content_id, attachment_files in attachments:
+            try:
+                self._publish_page_attachements(content_id, attachment_files, force)
+            except Exception as err:
+                self._page_failed(content_id, err)
+
+    def _publish_page_attachements(self, content_id, attachment_files, force=False):
+        log.info('Publishing attachments: %s (parent_id: %s)'
+                 % (', '.join(attachment_file.filepath for attachment_file in attachment_files), content_id))
+        self._attachment_manager.publish_page(content_id, attachment_files, force)
         log.info('Published to: %s' % content_id)
 
 
@@ -165,6 +413,24 @@ def setup_config_overrides(config, url=None, watermark=None, link=None):
                 page.link = link
 
 
+def setup_http_overrides(config, pool_size=None, pool_block=False, keep_alive=True):
+    if pool_size:
+        config.http.pool_maxsize = pool_size
+
+    if pool_block:
+        config.http.pool_block = True
+
+    if not keep_alive:
+        config.http.keep_alive = False
+
+
+def log_metrics(metrics, metrics_file=None):
+    if metrics.endpoints:
+        log.info('Requests:\n%s' % metrics.format_table())
+    if metrics_file:
+        metrics.write(metrics_file)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Publish documentation (Sphinx fjson) to Confluence')
     parser.add_argument('config', type=str, help='Configuration file')
@@ -172,7 +438,7 @@ def main():
     auth_group = parser.add_mutually_exclusive_group(required=True)
     auth_group.add_argument('-a', '--auth', type=str, help='Base64 encoded user:password string')
     auth_group.add_argument('-U', '--user', type=str, help='Username (prompt password)')
-    parser.add_argument('-F', '--force', action='store_true', help='Publish not changed page.')
+    parser.add_argument('-F', '--force', action='store_true', help='Publish not changed pages and attachments.')
     parser.add_argument('-w', '--watermark', type=str, help='Overrides the watermarks. Also can be "False" to remove '
                                                             'all watermarks; or "True" to add watermarks'
                                                             'with default text: "{}" on all pages.'
@@ -180,19 +446,106 @@ def main():
     parser.add_argument('-l', '--link', type=str, help="Overrides page link. If value is \"False\" "
                                                        "then removes the link.")
     parser.add_argument('-ht', '--hold-titles', action='store_true', help='Do not change page titles while publishing.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of pages to load and compare concurrently.')
+    parser.add_argument('-e', '--engine', choices=('threads', 'asyncio'), default='threads',
+                        help='Publish engine. "asyncio" requires aiohttp and uses --jobs as the concurrency limit.')
+    parser.add_argument('-q', '--queue-size', type=int,
+                        help='Maximum number of changed pages waiting for upload. Default: 2 * JOBS.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Skip pages whose source and Confluence version did not change since the last publish.')
+    parser.add_argument('--state-file', type=str, help='Publish state file: page records for --incremental '
+                                                       'and page body fingerprints. Without --incremental every page '
+                                                       'is still compared. '
+                                                       'Default: <config>.state.sqlite next to the config.')
+    parser.add_argument('-r', '--retries', type=int, default=5,
+                        help='Number of retries of throttled (429, 503) and failed requests. 0 disables retries. '
+                             'Default: 5.')
+    parser.add_argument('--pool-size', type=int, help='Maximum number of connections kept open to the Confluence '
+                                                      'host. Default: JOBS + 1, at least 10.')
+    parser.add_argument('--pool-block', action='store_true', help='Wait for a free pooled connection instead of '
+                                                                  'opening an extra one.')
+    parser.add_argument('--no-keep-alive', action='store_true', help='Close the connection after every request.')
+    parser.add_argument('--metrics-file', type=str, help='Write request metrics to the file: JSON if the name ends '
+                                                         'with .json, Prometheus text format otherwise.')
+    parser.add_argument('--compare-processes', type=int, metavar='PROCESSES',
+                        help='Parse and compare large page bodies in a pool of PROCESSES processes, 0 for one per '
+                             'CPU. Useful with --jobs. Default: compare in the publishing threads.')
+    transport_group = parser.add_mutually_exclusive_group()
+    transport_group.add_argument('--record', type=str, metavar='FILE',
+                                 help='Save every Confluence response with its timing to the file.')
+    transport_group.add_argument('--replay', type=str, metavar='FILE',
+                                 help='Answer requests with responses saved by --record instead of sending them.')
+    parser.add_argument('--replay-speed', choices=('fast', 'recorded'), default='fast',
+                        help='"recorded" waits as long as every recorded response took. Default: fast.')
     parser.add_argument('-v', '--verbose', action='count')
 
     args = parser.parse_args()
+    if args.engine == 'asyncio' and sys.version_info < ASYNCIO_MIN_PYTHON:
+        parser.error('--engine asyncio requires Python {}.{} or newer'.format(*ASYNCIO_MIN_PYTHON))
+    if args.engine == 'asyncio' and (args.record or args.replay):
+        parser.error('--record and --replay require the threads engine')
     auth = parse_authentication(args.auth, args.user)
     setup_logger(args.verbose)
 
     config = ConfigLoader.from_yaml(args.config)
 
     setup_config_overrides(config, args.url, args.watermark, args.link)
-
-    confluence_api = create_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, config.url, auth)
-    publisher = create_publisher(config, confluence_api)
-    publisher.publish(args.force, args.watermark, args.hold_titles)
+    setup_http_overrides(config, args.pool_size, args.pool_block, not args.no_keep_alive)
+
+    state = None
+    if args.incremental or args.state_file:
+        state = PublishState(args.state_file or default_state_path(args.config))
+        PageBodyComparator.cache = FingerprintCache(state)
+    # without --incremental the state file only keeps fingerprints: every page is compared
+    publish_state = state if args.incremental else None
+
+    retry_policy = None
+    if args.retries > 0:
+        # a fast replay does not wait for the backoff of recorded failures
+        backoff_scale = 0 if args.replay and args.replay_speed == 'fast' else 1.0
+        retry_policy = RetryPolicy(max_retries=args.retries, backoff_scale=backoff_scale)
+
+    if args.compare_processes is not None:
+        PageBodyComparator.executor = process_pool(args.compare_processes or None)
+
+    metrics = RequestMetrics()
+    try:
+        if args.engine == 'asyncio':
+            from .aio.publish import run_publish
+            run_publish(config, auth, args.jobs, args.force, args.watermark, args.hold_titles, publish_state,
+                        retry_policy, metrics)
+        else:
+            limiter = None
+            if retry_policy is not None:
+                # JOBS threads never have more requests in flight
+                limiter = ConcurrencyLimiter(AdaptiveLimit(args.jobs, max_limit=args.jobs))
+            if args.record:
+                record_session(auth, args.record, config.http, args.jobs)
+            elif args.replay:
+                replay_session(auth, args.replay, realtime=args.replay_speed == 'recorded')
+            else:
+                configure_session(auth, config.http, args.jobs)
+            confluence_api = create_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, config.url, auth,
+                                                   retry_policy=retry_policy, limiter=limiter, metrics=metrics)
+            publisher = create_publisher(config, confluence_api, args.jobs, publish_state, args.queue_size)
+            try:
+                publisher.publish(args.force, args.watermark, args.hold_titles)
+            finally:
+                log_connection_stats(session_connection_stats(auth))
+                auth.close()
+        # a forced run compares nothing and a failed one stops early: neither tells which fingerprints are stale
+        if state is not None and not args.force:
+            state.prune_fingerprints()
+    except PublishError as err:
+        log.error(str(err))
+        sys.exit(1)
+    finally:
+        if PageBodyComparator.executor is not None:
+            PageBodyComparator.executor.shutdown()
+        if state is not None:
+            state.close()
+        log.info('Page bodies: %s' % PageBodyComparator.stats)
+        log_metrics(metrics, args.metrics_file)
     log.info('Complete!')
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+import calendar
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+
+def parse_retry_after(value):
+    """
+    Returns the delay in seconds from a ``Retry-After`` header value (seconds or HTTP date), or ``None``.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(mktime_tz(date) - calendar.timegm(time.gmtime()), 0.0)
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried and how long to wait before the next attempt.
+
+    Throttled requests (429, 503) were not processed by the server and are retried for every method. Other
+    gateway errors and connection errors are retried only for idempotent methods. PUT is treated as idempotent:
+    a content update applied by an attempt whose response was lost conflicts (409) when it is repeated, and the API
+    then counts it as published if the page is already at the version sent.
+
+    Delay grows exponentially with full jitter, unless the server sends ``Retry-After``. Every delay is multiplied
+    by ``backoff_scale``: replayed responses are not worth waiting for, so a replay sets it to ``0``.
+    """
+    throttle_statuses = (429, 503)
+    retry_statuses = (429, 502, 503, 504)
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, max_retries=5, backoff_factor=0.5, max_backoff=60.0, backoff_scale=1.0):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.backoff_scale = backoff_scale
+
+    def is_throttled(self, status):
+        return status in self.throttle_statuses
+
+    def is_retryable(self, method, attempt, status=None, error=None):
+        if attempt >= self.max_retries:
+            return False
+        if self.is_throttled(status):
+            return True
+        if method.upper() not in self.idempotent_methods:
+            return False
+        return error is not None or status in self.retry_statuses
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff) * self.backoff_scale
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt)) * self.backoff_scale
+
+
+class AdaptiveLimit(object):
+    """
+    Additive increase / multiplicative decrease concurrency limit.
+
+    Every healthy response grows the limit by ``1 / limit``, so it grows by about one per round of requests.
+    A throttled response multiplies it by ``decrease_factor``, at most once per ``cooldown`` seconds, so a burst
+    of throttled responses to requests sent at the same time counts as one.
+
+    The limit never grows above ``max_limit``, which defaults to ``initial``: without a ceiling the limit starts at
+    its maximum, shrinks when throttled and recovers up to where it started.
+    """
+
+    def __init__(self, initial, min_limit=1, max_limit=None, decrease_factor=0.5, cooldown=1.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = float(max(min(initial, self.max_limit), min_limit))
+        self._decreased_at = None
+
+    def __int__(self):
+        return int(self.limit)
+
+    def on_success(self):
+        self.limit = min(self.limit + 1.0 / self.limit, float(self.max_limit))
+
+    def on_throttle(self):
+        now = time.time()
+        if self._decreased_at is not None and now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        self.limit = max(self.limit * self.decrease_factor, float(self.min_limit))
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limits the number of requests in flight across all threads sharing the API object.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit.on_throttle()
+            else:
+                self.limit.on_success()
+            self._condition.notify_all()
@@ -13,7 +13,7 @@ OrderedDumper.add_representer(OrderedDict, _dict_representer)
 
 
 def load(stream):
-    return yaml.load(stream)
+    return yaml.load(stream, Loader=yaml.SafeLoader)
 
 
 def dump(data, stream=None):
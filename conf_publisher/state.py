@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+def default_state_path(config_path):
+    return os.path.splitext(config_path)[0] + '.state.sqlite'
+
+
+def source_hash(*values):
+    """
+    Returns a stable hash of everything the published page is built from.
+    """
+    data = json.dumps(values, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class PublishState(object):
+    """
+    On-disk record of the last published state of every page.
+
+    For each page id it keeps the hash of the source that was published and the version number Confluence returned.
+    A page whose source hash and remote version both match the record does not need to be downloaded and compared.
+
+    It also keeps canonical fingerprints of page bodies (see ``PageBodyComparator``) keyed by the hash of the raw
+    body, so a body seen in a previous run is not parsed again. Every open of the state is a run: a fingerprint
+    remembers the last run which used it, so the ones not used for ``keep_runs`` runs can be pruned.
+    """
+    keep_runs = 10
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'id TEXT PRIMARY KEY, '
+            'source_hash TEXT NOT NULL, '
+            'version INTEGER NOT NULL)'
+        )
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints ('
+            'body_hash TEXT PRIMARY KEY, '
+            'fingerprint TEXT NOT NULL, '
+            'used_run INTEGER NOT NULL DEFAULT 0)'
+        )
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(fingerprints)')]
+        if 'used_run' not in columns:
+            # state written before fingerprints were pruned by age
+            self._connection.execute('ALTER TABLE fingerprints ADD COLUMN used_run INTEGER NOT NULL DEFAULT 0')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+        self.run = (row[0] if row else 0) + 1
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run', ?)", (self.run,))
+        self._used_fingerprints = set()
+
+    def get(self, content_id):
+        """
+        Returns ``(source_hash, version)`` recorded for the page or ``None``.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT source_hash, version FROM pages WHERE id = ?', (str(content_id),)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, content_id, source_hash, version):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pages (id, source_hash, version) VALUES (?, ?, ?)',
+                (str(content_id), source_hash, version)
+            )
+
+    def is_unchanged(self, content_id, source_hash, version):
+        if version is None:
+            return False
+        return self.get(content_id) == (source_hash, version)
+
+    def get_fingerprint(self, body_hash):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT fingerprint FROM fingerprints WHERE body_hash = ?', (body_hash,)
+            ).fetchone()
+            if row:
+                self._used_fingerprints.add(body_hash)
+        return row[0] if row else None
+
+    def set_fingerprint(self, body_hash, fingerprint):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO fingerprints (body_hash, fingerprint, used_run) VALUES (?, ?, ?)',
+                (body_hash, fingerprint, self.run)
+            )
+
+    def prune_fingerprints(self, keep_runs=None):
+        """
+        Removes fingerprints not read or written in the last ``keep_runs`` runs, this one included.
+        Default: ``PublishState.keep_runs``.
+        """
+        if keep_runs is None:
+            keep_runs = self.keep_runs
+        with self._lock:
+            self._mark_used_fingerprints()
+            return self._connection.execute('DELETE FROM fingerprints WHERE used_run <= ?',
+                                            (self.run - keep_runs,)).rowcount
+
+    def _mark_used_fingerprints(self):
+        self._connection.executemany('UPDATE fingerprints SET used_run = ? WHERE body_hash = ?',
+                                     [(self.run, body_hash) for body_hash in self._used_fingerprints])
+        self._used_fingerprints = set()
+
+    def commit(self):
+        with self._lock:
+            self._mark_used_fingerprints()
+            self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
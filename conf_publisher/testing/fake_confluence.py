@@ -0,0 +1,547 @@
+"""
+In-process stand-in for the Confluence 5.5.3 REST API used by ``ConfluenceRestApi553``.
+
+``FakeConfluence`` keeps pages and attachments in memory, ``FakeConfluenceServer`` serves it over HTTP
+on a local port. Latency, bandwidth, throttling, server errors and edit conflicts can be injected to load-test
+and regression-test the publisher without a real Confluence::
+
+    with FakeConfluenceServer(FakeConfluence(latency=0.05, fault_rate=0.1)) as server:
+        server.confluence.add_page(1, 'Home', '<p>Home</p>')
+        api = create_confluence_api(DEFAULT_CONFLUENCE_API_VERSION, server.url, requests.Session())
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from email.parser import BytesParser
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+from .. import log
+
+API_PATH = '/rest/api'
+
+
+class FakeResponse(object):
+    def __init__(self, status, data=None, headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+    @property
+    def body(self):
+        if self.data is None:
+            return b''
+        return json.dumps(self.data).encode('utf-8')
+
+
+class FakeConfluence(object):
+    """
+    In-memory Confluence content store answering REST requests.
+
+    :param latency:         seconds added to every request
+    :param bandwidth:       bytes per second each request and response body is transferred with. ``None``: no cap
+    :param fault_rate:      probability of answering a request with one of ``fault_statuses``
+    :param fault_statuses:  statuses of injected faults
+    :param retry_after:     ``Retry-After`` seconds sent with injected 429 and 503 responses. Optional
+    :param conflict_rate:   probability of a concurrent edit bumping the page version right before an update
+    :param max_limit:       maximum page size of paginated collections
+    :param seed:            random seed of fault and conflict injection
+    """
+
+    def __init__(self, latency=0, bandwidth=None, fault_rate=0, fault_statuses=(429, 500, 502, 503),
+                 retry_after=None, conflict_rate=0, max_limit=100, seed=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fault_rate = fault_rate
+        self.fault_statuses = fault_statuses
+        self.retry_after = retry_after
+        self.conflict_rate = conflict_rate
+        self.max_limit = max_limit
+
+        self.pages = OrderedDict()
+        self.attachments = OrderedDict()
+        self.requests = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self._random = random.Random(seed)
+        self._faults = deque()
+        self._next_id = 1
+        self._lock = threading.RLock()
+        self._routes = [
+            ('GET', re.compile(r'^/content$'), 'list_content'),
+            ('POST', re.compile(r'^/content$'), 'create_content'),
+            ('GET', re.compile(r'^/content/search$'), 'search_content'),
+            ('GET', re.compile(r'^/content/(\w+)$'), 'get_content'),
+            ('PUT', re.compile(r'^/content/(\w+)$'), 'update_content'),
+            ('DELETE', re.compile(r'^/content/(\w+)$'), 'delete_content'),
+            ('GET', re.compile(r'^/content/(\w+)/child/attachment$'), 'list_attachments'),
+            ('POST', re.compile(r'^/content/(\w+)/child/attachment$'), 'create_attachments'),
+            ('POST', re.compile(r'^/content/(\w+)/child/attachment/(\w+)/data$'), 'update_attachment_data'),
+        ]
+
+    # Store
+
+    def add_page(self, content_id=None, title=None, body='', space_key='TEST', ancestors=(), version=1):
+        """
+        Adds a page to the store and returns its id. ``ancestors`` are ids of parent pages, root first.
+        """
+        with self._lock:
+            content_id = str(content_id or self._new_id())
+            self.pages[content_id] = {
+                'id': content_id,
+                'type': 'page',
+                'title': title or 'Page {}'.format(content_id),
+                'space_key': space_key,
+                'body': body,
+                'ancestors': [str(ancestor_id) for ancestor_id in ancestors],
+                'version': version,
+            }
+            return content_id
+
+    def page_attachments(self, content_id):
+        with self._lock:
+            return [attachment for attachment in self.attachments.values()
+                    if attachment['container'] == str(content_id)]
+
+    def fail_next(self, status, count=1, retry_after=None):
+        """
+        Answers the next ``count`` requests with ``status``.
+        """
+        with self._lock:
+            for _ in range(count):
+                self._faults.append((status, retry_after))
+
+    def simulate_edit(self, content_id):
+        """
+        Bumps the page version as if somebody edited it, so an update built from the loaded page conflicts.
+        """
+        with self._lock:
+            self.pages[str(content_id)]['version'] += 1
+
+    def add_traffic(self, received, sent):
+        """
+        Counts body bytes of one request and its response.
+        """
+        with self._lock:
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def _new_id(self):
+        while str(self._next_id) in self.pages or 'att{}'.format(self._next_id) in self.attachments:
+            self._next_id += 1
+        return self._next_id
+
+    # Request handling
+
+    def handle(self, method, path, query=None, headers=None, body=b''):
+        """
+        Answers one REST request. ``path`` is the URL path, ``query`` the parsed query string.
+
+        :return:                ``FakeResponse``
+        """
+        query = dict((key, values[-1]) for key, values in (query or {}).items())
+        headers = dict((key.lower(), value) for key, value in (headers or {}).items())
+
+        if not path.startswith(API_PATH):
+            return self._error(404, 'Not found: {}'.format(path))
+        path = path[len(API_PATH):]
+
+        for route_method, pattern, endpoint in self._routes:
+            match = pattern.match(path)
+            if match is None or route_method != method:
+                continue
+
+            with self._lock:
+                self.requests.append((method, endpoint))
+                fault = self._fault()
+            if fault is not None:
+                return fault
+
+            try:
+                with self._lock:
+                    return getattr(self, '_' + endpoint)(query, headers, body, *match.groups())
+            except KeyError as err:
+                return self._error(404, 'No content found with id: {}'.format(err.args[0]))
+            except ValueError as err:
+                return self._error(400, str(err))
+
+        return self._error(404, 'Not found: {} {}'.format(method, path))
+
+    def _fault(self):
+        if self._faults:
+            status, retry_after = self._faults.popleft()
+        elif self.fault_rate and self._random.random() < self.fault_rate:
+            status, retry_after = self._random.choice(self.fault_statuses), self.retry_after
+        else:
+            return None
+
+        headers = {}
+        if retry_after is not None and status in (429, 503):
+            headers['Retry-After'] = str(retry_after)
+        return self._error(status, 'Injected fault', headers)
+
+    @staticmethod
+    def _error(status, message, headers=None):
+        return FakeResponse(status, {'statusCode': status, 'message': message}, headers)
+
+    def _paginated(self, path, items, query):
+        start = int(query.get('start', 0))
+        limit = min(int(query.get('limit', 25)), self.max_limit)
+        results = items[start:start + limit]
+        links = {'base': '', 'context': ''}
+        if start + len(results) < len(items):
+            links['next'] = '{}{}?start={}&limit={}'.format(API_PATH, path, start + len(results), limit)
+        return FakeResponse(200, {'results': results, 'start': start, 'limit': limit, 'size': len(results),
+                                  '_links': links})
+
+    # Content
+
+    def _list_content(self, query, headers, body):
+        expand = self._expand(query, 'history,space,version')
+        pages = [page for page in self.pages.values()
+                 if page['space_key'] == query.get('spaceKey')
+                 and page['type'] == query.get('type', 'page')
+                 and query.get('title') in (None, page['title'])]
+        return self._paginated('/content', [self._content_data(page, expand) for page in pages], query)
+
+    def _search_content(self, query, headers, body):
+        expand = self._expand(query)
+        predicates = self._parse_cql(query.get('cql', ''))
+        pages = [page for page in self.pages.values() if all(predicate(page) for predicate in predicates)]
+        return self._paginated('/content/search', [self._content_data(page, expand) for page in pages], query)
+
+    def _get_content(self, query, headers, body, content_id):
+        page = self.pages[content_id]
+        return FakeResponse(200, self._content_data(page, self._expand(query, 'history,space,version')))
+
+    def _create_content(self, query, headers, body):
+        data = json.loads(body.decode('utf-8'))
+        ancestors = self._ancestors(data)
+        content_id = self.add_page(title=data.get('title'), body=self._body_value(data),
+                                   space_key=data['space']['key'], ancestors=ancestors)
+        return FakeResponse(200, self._content_data(self.pages[content_id], self._expand({}, 'space,version')))
+
+    def _update_content(self, query, headers, body, content_id):
+        page = self.pages[content_id]
+        data = json.loads(body.decode('utf-8'))
+
+        if self.conflict_rate and self._random.random() < self.conflict_rate:
+            page['version'] += 1
+
+        version = data.get('version', {}).get('number')
+        if version != page['version'] + 1:
+            return self._error(409, 'Version must be incremented on update. Current version is: {}'
+                               .format(page['version']))
+
+        page['version'] = version
+        page['title'] = data.get('title', page['title'])
+        page['body'] = self._body_value(data, page['body'])
+        if data.get('ancestors'):
+            page['ancestors'] = self._ancestors(data)
+        return FakeResponse(200, self._content_data(page, self._expand({}, 'space,version')))
+
+    def _delete_content(self, query, headers, body, content_id):
+        del self.pages[content_id]
+        for attachment in self.page_attachments(content_id):
+            del self.attachments[attachment['id']]
+        return FakeResponse(204)
+
+    def _ancestors(self, data):
+        ancestors = []
+        if data.get('ancestors'):
+            parent = self.pages[str(data['ancestors'][-1]['id'])]
+            ancestors = parent['ancestors'] + [parent['id']]
+        return ancestors
+
+    @staticmethod
+    def _body_value(data, default=''):
+        return data.get('body', {}).get('storage', {}).get('value', default)
+
+    @staticmethod
+    def _expand(query, default=''):
+        return set(filter(None, query.get('expand', default).split(',')))
+
+    def _content_data(self, page, expand):
+        data = {
+            'id': page['id'],
+            'type': page['type'],
+            'title': page['title'],
+            '_links': {'webui': '/pages/viewpage.action?pageId={}'.format(page['id'])},
+        }
+        if 'space' in expand:
+            data['space'] = {'key': page['space_key']}
+        if 'version' in expand:
+            data['version'] = {'number': page['version']}
+        if 'body.storage' in expand:
+            data['body'] = {'storage': {'value': page['body'], 'representation': 'storage'}}
+        if 'ancestors' in expand:
+            data['ancestors'] = [{'id': ancestor_id, 'type': 'page'} for ancestor_id in page['ancestors']]
+        return data
+
+    @staticmethod
+    def _parse_cql(cql):
+        """
+        Supports ``and`` of ``id in (...)``, ``id = N``, ``type = T``, ``space = KEY``, ``title = "T"`` and
+        ``ancestor = N``.
+        """
+        predicates = []
+        for clause in re.split(r'\s+and\s+', cql.strip(), flags=re.I):
+            match = re.match(r'^(\w+)\s*(=|in)\s*(.+)$', clause.strip(), re.I)
+            if match is None:
+                raise ValueError('Could not parse cql: {}'.format(cql))
+            field, operator, value = match.group(1).lower(), match.group(2).lower(), match.group(3).strip()
+            if operator == 'in':
+                values = set(item.strip().strip('"') for item in value.strip('()').split(','))
+            else:
+                values = {value.strip('"')}
+
+            if field == 'id':
+                predicates.append(lambda page, values=values: page['id'] in values)
+            elif field == 'type':
+                predicates.append(lambda page, values=values: page['type'] in values)
+            elif field == 'space':
+                predicates.append(lambda page, values=values: page['space_key'] in values)
+            elif field == 'title':
+                predicates.append(lambda page, values=values: page['title'] in values)
+            elif field == 'ancestor':
+                predicates.append(lambda page, values=values: bool(values.intersection(page['ancestors'])))
+            else:
+                raise ValueError('Unsupported cql field: {}'.format(field))
+        return predicates
+
+    # Attachments
+
+    def _list_attachments(self, query, headers, body, content_id):
+        self._check_page(content_id)
+        attachments = [attachment for attachment in self.page_attachments(content_id)
+                       if query.get('filename') in (None, attachment['title'])
+                       and query.get('mediaType') in (None, attachment['media_type'])]
+        return self._paginated('/content/{}/child/attachment'.format(content_id),
+                               [self._attachment_data(attachment) for attachment in attachments], query)
+
+    def _create_attachments(self, query, headers, body, content_id):
+        self._check_page(content_id)
+        check = self._check_token(headers)
+        if check is not None:
+            return check
+
+        titles = set(attachment['title'] for attachment in self.page_attachments(content_id))
+        fields, files = self._parse_multipart(headers, body)
+        for filename, _, _ in files:
+            if filename in titles:
+                return self._error(400, 'Cannot add a new attachment with same file name as an existing '
+                                        'attachment: {}'.format(filename))
+
+        comments = [value for name, value in fields if name == 'comment']
+        results = []
+        for i, (filename, media_type, data) in enumerate(files):
+            attachment_id = 'att{}'.format(self._new_id())
+            self.attachments[attachment_id] = {
+                'id': attachment_id,
+                'container': content_id,
+                'title': filename,
+                'media_type': media_type,
+                'version': 1,
+            }
+            comment = comments[i] if i < len(comments) else None
+            self._set_attachment_data(self.attachments[attachment_id], data, comment)
+            results.append(self._attachment_data(self.attachments[attachment_id]))
+        return FakeResponse(200, {'results': results, 'size': len(results)})
+
+    def _update_attachment_data(self, query, headers, body, content_id, attachment_id):
+        attachment = self.attachments[attachment_id]
+        check = self._check_token(headers)
+        if check is not None:
+            return check
+
+        fields, files = self._parse_multipart(headers, body)
+        if len(files) != 1:
+            raise ValueError('Exactly one file is expected')
+        comments = [value for name, value in fields if name == 'comment']
+        filename, media_type, data = files[0]
+        attachment['version'] += 1
+        attachment['media_type'] = media_type
+        self._set_attachment_data(attachment, data, comments[0] if comments else attachment['comment'])
+        return FakeResponse(200, self._attachment_data(attachment))
+
+    def _check_page(self, content_id):
+        if content_id not in self.pages:
+            raise KeyError(content_id)
+
+    def _check_token(self, headers):
+        if headers.get('x-atlassian-token') != 'no-check':
+            return self._error(403, 'XSRF check failed')
+        return None
+
+    @staticmethod
+    def _set_attachment_data(attachment, data, comment):
+        # only the size and the digest are kept, so large uploads do not stay in memory
+        attachment['size'] = len(data)
+        attachment['sha256'] = hashlib.sha256(data).hexdigest()
+        attachment['comment'] = comment
+
+    @staticmethod
+    def _attachment_data(attachment):
+        return {
+            'id': attachment['id'],
+            'type': 'attachment',
+            'title': attachment['title'],
+            'metadata': {'mediaType': attachment['media_type'], 'comment': attachment['comment']},
+            'extensions': {'fileSize': attachment['size'], 'mediaType': attachment['media_type']},
+            'version': {'number': attachment['version']},
+            'container': {'id': attachment['container'], 'type': 'page'},
+        }
+
+    @staticmethod
+    def _parse_multipart(headers, body):
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+            raise ValueError('multipart/form-data is expected')
+
+        message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body)
+        fields, files = [], []
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            data = part.get_payload(decode=True)
+            if filename is None:
+                fields.append((name, data.decode('utf-8')))
+            else:
+                files.append((filename, part.get_content_type(), data))
+        return fields, files
+
+
+class FakeConfluenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, Nagle's algorithm would delay the body until the client's ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        confluence = self.server.confluence
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        response = confluence.handle(method, url.path, parse_qs(url.query), dict(self.headers.items()), body)
+        response_body = response.body
+        confluence.add_traffic(len(body), len(response_body))
+
+        delay = confluence.latency
+        if confluence.bandwidth:
+            delay += float(len(body) + len(response_body)) / confluence.bandwidth
+        if delay:
+            time.sleep(delay)
+
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        if response_body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        log.debug('Fake Confluence: ' + format % args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeConfluenceServer(object):
+    """
+    Serves ``FakeConfluence`` on a local port in a background thread. ``port=0`` picks a free port.
+    """
+
+    def __init__(self, confluence=None, host='127.0.0.1', port=0):
+        self.confluence = confluence or FakeConfluence()
+        self._server = _ThreadingHTTPServer((host, port), FakeConfluenceHandler)
+        self._server.confluence = self.confluence
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local Confluence stand-in for load tests')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--pages', type=int, default=0,
+                        help='Number of empty pages to create, ids from 1, under a common parent page.')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to every request.')
+    parser.add_argument('--bandwidth', type=int, help='Bytes per second of every request and response body.')
+    parser.add_argument('--fault-rate', type=float, default=0, help='Probability of a 429 or 5xx response.')
+    parser.add_argument('--retry-after', type=float, help='Retry-After seconds of injected 429 and 503 responses.')
+    parser.add_argument('--conflict-rate', type=float, default=0, help='Probability of a version conflict.')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    confluence = FakeConfluence(latency=args.latency, bandwidth=args.bandwidth, fault_rate=args.fault_rate,
+                                retry_after=args.retry_after, conflict_rate=args.conflict_rate, seed=args.seed)
+    if args.pages:
+        # pages without ancestors can not be updated by the publisher, so all of them get a common parent
+        root_id = confluence.add_page(args.pages + 1, 'Home')
+        for content_id in range(1, args.pages + 1):
+            confluence.add_page(content_id, ancestors=[root_id])
+
+    server = FakeConfluenceServer(confluence, args.host, args.port)
+    print('Serving fake Confluence on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
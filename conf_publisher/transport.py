@@ -0,0 +1,338 @@
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from timeit import default_timer
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter, DEFAULT_POOLSIZE, DEFAULT_POOLBLOCK
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import PoolManager
+
+from . import log
+
+
+class HttpSettings(object):
+    """
+    Connection settings resolved from ``HttpConfig`` and the publish concurrency.
+
+    Every worker thread (or coroutine) and the uploading thread may hold a connection at the same time, so the
+    default pool holds ``jobs + 1`` connections per host and never less than the ``requests`` default.
+    """
+
+    def __init__(self, http_config=None, jobs=1):
+        self.pool_connections = getattr(http_config, 'pool_connections', None) or DEFAULT_POOLSIZE
+        self.pool_maxsize = getattr(http_config, 'pool_maxsize', None) or max(jobs + 1, DEFAULT_POOLSIZE)
+        pool_block = getattr(http_config, 'pool_block', None)
+        self.pool_block = DEFAULT_POOLBLOCK if pool_block is None else pool_block
+        keep_alive = getattr(http_config, 'keep_alive', None)
+        self.keep_alive = True if keep_alive is None else keep_alive
+
+
+def configure_session(session, http_config=None, jobs=1):
+    """
+    Mounts pooled HTTP adapters on ``session``.
+
+    :param session:         ``requests.Session``
+    :param http_config:     ``HttpConfig``. Optional
+    :param jobs:            publish concurrency the defaults are sized to
+    :return:                ``session``
+    """
+    return _mount_pooled_adapter(session, PooledHTTPAdapter, http_config, jobs)
+
+
+def record_session(session, path, http_config=None, jobs=1):
+    """
+    Mounts pooled HTTP adapters on ``session`` which save every response to the recording file ``path``.
+    The file is complete once the session is closed.
+
+    :return:                ``session``
+    """
+    return _mount_pooled_adapter(session, RecordingHTTPAdapter, http_config, jobs, path=path)
+
+
+def replay_session(session, path, realtime=False):
+    """
+    Mounts adapters on ``session`` which answer requests with responses from the recording file ``path``
+    instead of sending them.
+
+    :param realtime:        wait as long as every recorded response took. Otherwise answer immediately
+    :return:                ``session``
+    """
+    adapter = ReplayHTTPAdapter(path, realtime)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _mount_pooled_adapter(session, adapter_class, http_config=None, jobs=1, **kwargs):
+    settings = HttpSettings(http_config, jobs)
+    adapter = adapter_class(pool_connections=settings.pool_connections, pool_maxsize=settings.pool_maxsize,
+                            pool_block=settings.pool_block, **kwargs)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not settings.keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+class ConnectionStats(object):
+    """
+    Number of requests sent and connections opened to send them.
+    """
+
+    def __init__(self, requests=0, connections=0):
+        self.requests = requests
+        self.connections = connections
+        self._lock = threading.Lock()
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    @property
+    def reused(self):
+        return max(self.requests - self.connections, 0)
+
+    def __add__(self, other):
+        return ConnectionStats(self.requests + other.requests, self.connections + other.connections)
+
+    def __str__(self):
+        percent = 100 * self.reused // self.requests if self.requests else 0
+        return '%d requests over %d connections (%d%% reused)' % (self.requests, self.connections, percent)
+
+
+class _CountingConnectionMixin(object):
+    stats = None
+
+    def connect(self):
+        super(_CountingConnectionMixin, self).connect()
+        if self.stats is not None:
+            self.stats.add_connection()
+
+
+class _CountingHTTPConnection(_CountingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _CountingHTTPSConnection(_CountingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _CountingPoolMixin(object):
+    stats = None
+
+    def _new_conn(self):
+        conn = super(_CountingPoolMixin, self)._new_conn()
+        conn.stats = self.stats
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class _CountingPoolManager(PoolManager):
+    def __init__(self, stats, *args, **kwargs):
+        super(_CountingPoolManager, self).__init__(*args, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+    def _new_pool(self, *args, **kwargs):
+        pool = super(_CountingPoolManager, self)._new_pool(*args, **kwargs)
+        pool.stats = self.stats
+        return pool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    ``HTTPAdapter`` counting sent requests and opened connections (TCP connects and TLS handshakes) in ``stats``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.stats = ConnectionStats()
+        super(PooledHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = _CountingPoolManager(self.stats, num_pools=connections, maxsize=maxsize, block=block,
+                                                **pool_kwargs)
+
+    def send(self, request, *args, **kwargs):
+        self.stats.add_request()
+        return super(PooledHTTPAdapter, self).send(request, *args, **kwargs)
+
+    def __setstate__(self, state):
+        self.stats = ConnectionStats()
+        super(PooledHTTPAdapter, self).__setstate__(state)
+
+
+class ReplayError(requests.RequestException):
+    """
+    Raised when the recording has no response left for a request.
+    """
+
+
+class RecordingHTTPAdapter(PooledHTTPAdapter):
+    """
+    ``PooledHTTPAdapter`` writing every response, with its timing, to a gzipped JSON lines file.
+
+    Requests are stored by method and path with query: only the size of request bodies is kept. Of response
+    headers only the ones the client reads are kept. Connection errors and timeouts are recorded as well,
+    so retries replay the same way.
+    """
+    FORMAT = 'conf-publisher-recording'
+    VERSION = 1
+    RESPONSE_HEADERS = ('Content-Type', 'Retry-After', 'Location')
+
+    def __init__(self, path, *args, **kwargs):
+        self.path = path
+        self._file = gzip.open(path, 'wt')
+        self._file_lock = threading.Lock()
+        self._started = default_timer()
+        self._write({'format': self.FORMAT, 'version': self.VERSION})
+        super(RecordingHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        started = default_timer()
+        record = {
+            't': round(started - self._started, 6),
+            'method': request.method,
+            'url': request.path_url,
+            'sent': len(request.body or b''),
+        }
+        try:
+            response = super(RecordingHTTPAdapter, self).send(request, *args, **kwargs)
+            content = response.content
+        except requests.Timeout:
+            self._write(dict(record, elapsed=round(default_timer() - started, 6), error='timeout'))
+            raise
+        except requests.ConnectionError:
+            self._write(dict(record, elapsed=round(default_timer() - started, 6), error='connection'))
+            raise
+
+        record.update({
+            'elapsed': round(default_timer() - started, 6),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict((name, response.headers[name]) for name in self.RESPONSE_HEADERS
+                            if name in response.headers),
+            'body': content.decode('utf-8', 'replace'),
+        })
+        self._write(record)
+        return response
+
+    def close(self):
+        super(RecordingHTTPAdapter, self).close()
+        with self._file_lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._file_lock:
+            self._file.write(line + '\n')
+
+
+class ReplayHTTPAdapter(BaseAdapter):
+    """
+    Answers requests with responses saved by ``RecordingHTTPAdapter``, without touching the network.
+
+    Responses of the same method and path are served in the recorded order, whatever order the requests
+    come in. ``ReplayError`` is raised when none is left.
+
+    :param realtime:        wait as long as every recorded response took. Otherwise answer immediately
+    """
+
+    def __init__(self, path, realtime=False):
+        super(ReplayHTTPAdapter, self).__init__()
+        self.realtime = realtime
+        self.stats = ConnectionStats()
+        self._responses = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._load(path)
+
+    def _load(self, path):
+        with gzip.open(path, 'rt') as f:
+            header = json.loads(f.readline() or '{}')
+            if header.get('format') != RecordingHTTPAdapter.FORMAT:
+                raise ValueError('Not a recording file: {}'.format(path))
+            for line in f:
+                record = json.loads(line)
+                self._responses[(record['method'], record['url'])].append(record)
+
+    def send(self, request, *args, **kwargs):
+        self.stats.add_request()
+        with self._lock:
+            records = self._responses.get((request.method, request.path_url))
+            record = records.popleft() if records else None
+        if record is None:
+            raise ReplayError('No recorded response left for {} {}'.format(request.method, request.path_url),
+                              request=request)
+
+        if self.realtime:
+            time.sleep(record['elapsed'])
+
+        if record.get('error') == 'timeout':
+            raise requests.Timeout('Recorded timeout', request=request)
+        if record.get('error'):
+            raise requests.ConnectionError('Recorded connection error', request=request)
+
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record.get('reason')
+        response.headers = CaseInsensitiveDict(record.get('headers', {}))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = record['body'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=record['elapsed'])
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+    @property
+    def remaining(self):
+        """
+        Number of recorded responses not served yet.
+        """
+        with self._lock:
+            return sum(len(records) for records in self._responses.values())
+
+
+def session_connection_stats(session):
+    """
+    Sums ``ConnectionStats`` of every ``PooledHTTPAdapter`` mounted on ``session``.
+    """
+    stats = ConnectionStats()
+    for adapter in set(session.adapters.values()):
+        adapter_stats = getattr(adapter, 'stats', None)
+        if adapter_stats is not None:
+            stats = stats + adapter_stats
+    return stats
+
+
+def log_connection_stats(stats):
+    log.info('HTTP: %s' % stats)
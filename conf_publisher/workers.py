@@ -0,0 +1,134 @@
+import multiprocessing
+import threading
+from collections import namedtuple, deque
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+WorkResult = namedtuple('work_result', [
+    'item',
+    'value',
+    'error',
+])
+
+
+def _call(func, item):
+    try:
+        return WorkResult(item, func(item), None)
+    except Exception as err:
+        return WorkResult(item, None, err)
+
+
+def parallel_map(func, items, jobs=1, window=None):
+    """
+    Applies ``func`` to every item using a pool of ``jobs`` worker threads.
+
+    Results are yielded as ``WorkResult`` tuples in the order of ``items``. An exception raised by ``func``
+    is stored in ``WorkResult.error`` instead of being propagated, so one failed item does not abort the rest.
+
+    :param func:            callable taking a single item
+    :param items:           iterable of items, consumed lazily
+    :param jobs:            number of worker threads. ``1`` runs everything in the calling thread
+    :param window:          maximum number of submitted but not yet yielded items. Default: ``2 * jobs``
+    :return:                generator of ``WorkResult``
+    """
+    if not jobs or jobs <= 1:
+        for item in items:
+            yield _call(func, item)
+        return
+
+    window = max(window or 2 * jobs, 1)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for item in items:
+            pending.append(executor.submit(_call, func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+_DONE = object()
+
+
+def prefetch(items, size=1):
+    """
+    Consumes ``items`` in a background thread and yields them through a queue holding at most ``size`` items.
+
+    The producer runs ahead of the consumer by at most ``size`` items. An exception raised while producing items
+    is re-raised in the consumer after the items produced before it.
+
+    :param items:           iterable of items
+    :param size:            queue depth
+    :return:                generator of items
+    """
+    items = iter(items)
+    buffer = Queue(maxsize=max(size, 1))
+    stopped = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+                if stopped.is_set():
+                    break
+        except Exception as err:
+            errors.append(err)
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+            buffer.put(_DONE)
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                break
+            yield item
+
+        if errors:
+            raise errors[0]
+    finally:
+        stopped.set()
+        while producer.is_alive():
+            # unblock the producer waiting for free space in the queue
+            try:
+                buffer.get(timeout=0.1)
+            except Empty:
+                pass
+        producer.join()
+
+
+def process_pool(processes=None):
+    """
+    Creates a ``ProcessPoolExecutor`` safe to submit to from worker threads.
+
+    A forked pool process would inherit the locks of a multithreaded parent in whatever state they are, so the
+    processes are started with ``forkserver`` or ``spawn`` where ``mp_context`` is supported. Otherwise the pool
+    is started right away, before any worker thread.
+    """
+    get_context = getattr(multiprocessing, 'get_context', None)
+    if get_context is not None:
+        methods = multiprocessing.get_all_start_methods()
+        try:
+            return ProcessPoolExecutor(processes, mp_context=get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn'))
+        except TypeError:
+            # Python 3.6 and older: no mp_context
+            pass
+
+    executor = ProcessPoolExecutor(processes)
+    executor.submit(int).result()
+    return executor
@@ -1,14 +1,20 @@
 import os
+import sys
 from setuptools import setup, find_packages
 
 os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 
 long_description = open('README.rst' if os.path.exists('README.rst') else 'README.md').read()
 
+exclude_packages = ['tests', 'tests.*', 'benchmarks', 'benchmarks.*']
+if sys.version_info < (3, 6):
+    # the asyncio engine does not compile on older interpreters
+    exclude_packages.append('conf_publisher.aio')
+
 setup(
     name='confluence-publisher',
     version='1.2.1',
-    packages=find_packages(exclude=['tests', 'tests.*']),
+    packages=find_packages(exclude=exclude_packages),
     include_package_data=True,
     license='MIT',
     description='Tool for publishing Sphinx generated documents to Confluence',
@@ -16,6 +22,9 @@ setup(
     url='https://github.com/Arello-Mobile/confluence-publisher',
     author='Arello Mobile',
     install_requires=open('requirements.txt').read(),
+    extras_require={
+        'async': ['aiohttp>=3.0; python_version >= "3.6"'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
@@ -0,0 +1,7 @@
+import sys
+from unittest import SkipTest
+
+from conf_publisher.constants import ASYNCIO_MIN_PYTHON
+
+if sys.version_info < ASYNCIO_MIN_PYTHON:
+    raise SkipTest('The asyncio engine requires Python {}.{} or newer'.format(*ASYNCIO_MIN_PYTHON))
@@ -0,0 +1,106 @@
+from unittest import TestCase
+import asyncio
+
+import requests
+
+from conf_publisher.aio.confluence_api import AsyncConfluenceRestApi553
+from conf_publisher.retry import RetryPolicy
+
+
+class FakeAsyncListApi(AsyncConfluenceRestApi553):
+    def __init__(self, count):
+        super(FakeAsyncListApi, self).__init__('http://confluence', None)
+        self.items = [{'id': str(i)} for i in range(count)]
+        self.calls = []
+
+    async def search_content(self, cql, cql_context=None, expand=None, start=0, limit=25):
+        self.calls.append(start)
+        await asyncio.sleep(0)
+        results = self.items[start:start + limit]
+        data = {'results': results, '_links': {}}
+        if start + len(results) < len(self.items):
+            data['_links']['next'] = '/next'
+        return data
+
+
+class AsyncPaginationTestCase(TestCase):
+
+    @staticmethod
+    def collect(api, page_size):
+        async def collect():
+            return [item async for item in api.iter_search('type=page', page_size=page_size)]
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(collect())
+        finally:
+            loop.close()
+
+    def test_iterates_all_pages(self):
+        api = FakeAsyncListApi(25)
+        items = self.collect(api, 10)
+        self.assertEqual([item['id'] for item in items], [str(i) for i in range(25)])
+        self.assertEqual(api.calls, [0, 10, 20])
+
+
+class FakeAsyncResponse(object):
+    def __init__(self, status, data=None):
+        self.status = status
+        self.data = data
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return b''
+
+    async def json(self, content_type=None):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise requests.HTTPError('{} error'.format(self.status))
+
+
+class FakeAsyncSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(method)
+        return self.responses.pop(0)
+
+
+class NoSleepRetryPolicy(RetryPolicy):
+    def backoff(self, attempt, retry_after=None):
+        return 0
+
+
+class AsyncRetryTestCase(TestCase):
+
+    def update(self, responses):
+        self.session = FakeAsyncSession(responses)
+        api = AsyncConfluenceRestApi553('http://confluence', self.session, NoSleepRetryPolicy(max_retries=3))
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(api.update_content(1, {'version': {'number': 3}}))
+        finally:
+            loop.close()
+
+    def test_retried_update_already_applied(self):
+        ret = self.update([
+            FakeAsyncResponse(502),
+            FakeAsyncResponse(409),
+            FakeAsyncResponse(200, {'id': '1', 'version': {'number': 3}}),
+        ])
+        self.assertEqual(ret['id'], '1')
+        self.assertEqual(self.session.requests, ['PUT', 'PUT', 'GET'])
+
+    def test_update_conflict_without_retry(self):
+        with self.assertRaises(requests.HTTPError):
+            self.update([FakeAsyncResponse(409)])
+        self.assertEqual(self.session.requests, ['PUT'])
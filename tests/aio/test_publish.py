@@ -0,0 +1,109 @@
+from unittest import TestCase
+import asyncio
+import os
+
+from conf_publisher.aio.publish import AsyncPublisher
+from conf_publisher.confluence import Page
+from conf_publisher.config import ConfigLoader
+from conf_publisher.errors import PublishError
+from conf_publisher.data_providers.sphinx_fjson_data_provider import SphinxFJsonDataProvider
+
+
+class FakeAsyncPagePublisher(object):
+    def __init__(self, pages=None, failing_ids=None):
+        pages = pages or []
+        self._pages = dict((page.id, page) for page in pages)
+        self._failing_ids = failing_ids or []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def load(self, content_id, with_body=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if content_id in self._failing_ids:
+            raise IOError('Can not load page {}'.format(content_id))
+        return self._pages[content_id]
+
+    async def update(self, page, bump_version=True):
+        self._pages[page.id] = page
+        return page.id
+
+    def get(self):
+        return list(self._pages.values())
+
+
+class FakeAsyncAttachmentPublisher(object):
+    def __init__(self):
+        self.published = []
+
+    async def publish_page(self, content_id, attachment_files, force=False):
+        for attachment_file in attachment_files:
+            self.published.append((content_id, attachment_file.filename))
+
+
+class AsyncPublisherTestCase(TestCase):
+    tests_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def make_publisher(self, page_ids, failing_ids=None, jobs=1):
+        config = ConfigLoader.from_dict({
+            'version': 2,
+            'base_dir': 'fixtures',
+            'pages': [
+                {
+                    'id': page_id,
+                    'source': 'page',
+                    'attachments': {'images': ['test_image.png']},
+                } for page_id in page_ids
+            ],
+        })
+
+        pages = []
+        for page_id in page_ids:
+            page = Page()
+            page.id = page_id
+            page.title = u'pageTitle'
+            page.body = u'Old body'
+            pages.append(page)
+
+        data_provider = SphinxFJsonDataProvider(root_dir=self.tests_root, base_dir=config.base_dir)
+        self.page_manager = FakeAsyncPagePublisher(pages, failing_ids)
+        self.attachment_manager = FakeAsyncAttachmentPublisher()
+        return AsyncPublisher(config, data_provider, self.page_manager, self.attachment_manager, jobs=jobs)
+
+    @staticmethod
+    def run_publish(publisher, **kwargs):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(publisher.publish(**kwargs))
+        finally:
+            loop.close()
+
+    def test_publish(self):
+        publisher = self.make_publisher([1, 2, 3], jobs=2)
+        self.run_publish(publisher)
+        self.assertEqual([page.title for page in self.page_manager.get()], [u'Title'] * 3)
+        self.assertEqual(sorted(self.attachment_manager.published),
+                         [(1, 'test_image.png'), (2, 'test_image.png'), (3, 'test_image.png')])
+
+    def test_concurrency_limit(self):
+        publisher = self.make_publisher(list(range(1, 11)), jobs=3)
+        self.run_publish(publisher)
+        self.assertEqual(self.page_manager.max_in_flight, 3)
+
+    def test_failed_page_does_not_drop_batch(self):
+        publisher = self.make_publisher([1, 2, 3], failing_ids=[2], jobs=3)
+        with self.assertRaises(PublishError) as ctx:
+            self.run_publish(publisher)
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        self.assertEqual(sorted(self.attachment_manager.published), [(1, 'test_image.png'), (3, 'test_image.png')])
+
+    def test_titles_loaded_one_by_one_without_search(self):
+        publisher = self.make_publisher([1, 2, 3], failing_ids=[2], jobs=2)
+        with self.assertRaises(PublishError) as ctx:
+            self.run_publish(publisher, hold_titles=True)
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        self.assertEqual([page.title for page in self.page_manager.get()], [u'pageTitle'] * 3)
+        self.assertEqual(self.page_manager.max_in_flight, 2)
+        self.assertEqual(sorted(self.attachment_manager.published), [(1, 'test_image.png'), (3, 'test_image.png')])
@@ -1,24 +1,25 @@
 from unittest import TestCase
-from conf_publisher.mutators.page_mutator import AnchorPageMutator
+import re
+
+from conf_publisher.mutators.page_mutator import AnchorPageMutator, AnchorIndex, trie_pattern
 from conf_publisher.confluence import Page
 
 
 class ConfigLoaderTestCase(TestCase):
 
-    # TODO change regular expression to match only anchor
     def test_anchor_page_mutator_mutate(self):
-        original_content = u'''
-            <p>Default response</p>\n<p>Type: <a class="reference internal" href="#SnowTeq1.0.0-d-c40da07e339eaa512fd6189
-
-            f="#SnowTeq1.0.0-d-c40da07e339eaa512fd6189758a42db6"><span>ClubsSerializer</span></a></p>\n<p><strong>Example
-            <a class="reference internal" href="#SnowTeq1.0.0-d-c40da07e339eaa512fd6189758a42db6"><span>ClubsSerializer</
-        '''
-        correct_content = u'''
-            <p>Default response</p>\n<p>Type: <a class="reference internal" href="#TestPage#2-d-c40da07e339eaa512fd6189
-
-            f="#TestPage#2-d-c40da07e339eaa512fd6189758a42db6"><span>ClubsSerializer</span></a></p>\n<p><strong>Example
-            <a class="reference internal" href="#TestPage#2-d-c40da07e339eaa512fd6189758a42db6"><span>ClubsSerializer</
-        '''
+        # the anchor title is the only difference between the source and the expected body
+        content = (u'\n'
+                   u'            <p>Default response</p>\n<p>Type: <a class="reference internal" '
+                   u'href="#{0}-d-c40da07e339eaa512fd6189\n'
+                   u'\n'
+                   u'            f="#{0}-d-c40da07e339eaa512fd6189758a42db6"><span>ClubsSerializer</span></a></p>'
+                   u'\n<p><strong>Example\n'
+                   u'            <a class="reference internal" href="#{0}-d-c40da07e339eaa512fd6189758a42db6">'
+                   u'<span>ClubsSerializer</\n'
+                   u'        ')
+        original_content = content.format(u'SnowTeq1.0.0')
+        correct_content = content.format(u'TestPage#2')
         page_new_title = u'SnowTeq 1.0.0'
         page_old_title = u'Test Page #2'
 
@@ -30,3 +31,52 @@ class ConfigLoaderTestCase(TestCase):
         AnchorPageMutator(page_new_title).apply_forward(page)
 
         self.assertEqual(correct_content, page.body)
+
+    def test_anchor_page_mutator_only_anchors(self):
+        page = Page()
+        page.title = u'Held Title'
+        page.body = u'<p>Source Title</p><p>SourceTitle-like text</p><a href="#SourceTitle-intro">Intro</a>'
+
+        AnchorPageMutator(u'Source Title').apply_forward(page)
+
+        self.assertEqual(page.body, u'<p>Source Title</p><p>SourceTitle-like text</p>'
+                                    u'<a href="#HeldTitle-intro">Intro</a>')
+
+
+class AnchorIndexTestCase(TestCase):
+
+    def test_rewrite(self):
+        anchors = AnchorIndex([(u'API', u'Held API'), (u'API Guide', u'Held Guide'), (u'Same', u'Same')])
+
+        body = anchors.rewrite(u'<a href="#API-a">a</a><a href="x.html#APIGuide-b">b</a><a href="#Same-c">c</a>'
+                               u'<a href="#APIGuides-d">d</a>')
+
+        self.assertEqual(body, u'<a href="#HeldAPI-a">a</a><a href="x.html#HeldGuide-b">b</a><a href="#Same-c">c</a>'
+                               u'<a href="#APIGuides-d">d</a>')
+        self.assertEqual(len(anchors), 2)
+
+    def test_first_title_wins(self):
+        anchors = AnchorIndex([(u'Title', u'First'), (u'Title', u'Second')])
+
+        self.assertEqual(anchors.rewrite(u'#Title-a'), u'#First-a')
+
+    def test_empty(self):
+        self.assertEqual(AnchorIndex().rewrite(u'#Title-a'), u'#Title-a')
+
+    def test_digest(self):
+        anchors = AnchorIndex([(u'B', u'Held B'), (u'A', u'Held A')])
+        digest = anchors.digest
+
+        self.assertEqual(digest, AnchorIndex([(u'A', u'Held A'), (u'B', u'Held B')]).digest)
+        self.assertEqual(len(digest), 40)
+        anchors.add(u'C', u'Held C')
+        self.assertNotEqual(anchors.digest, digest)
+
+    def test_trie_pattern(self):
+        words = [u'a', u'ab', u'abc', u'b.c', u'bd', u'x' * 50, u'привет']
+        expression = re.compile(u'(?:' + trie_pattern(words) + u')$')
+
+        for word in words:
+            self.assertTrue(expression.match(word), word)
+        for word in (u'', u'ac', u'bxc', u'abcd', u'x' * 49):
+            self.assertFalse(expression.match(word), word)
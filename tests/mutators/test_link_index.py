@@ -0,0 +1,68 @@
+from unittest import TestCase
+import pickle
+
+from conf_publisher.config import ConfigLoader, flatten_page_config_list
+from conf_publisher.mutators.page_mutator import PageLinkIndex
+
+VIEWPAGE = 'http://confluence/pages/viewpage.action?pageId='
+
+
+class PageLinkIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.links = PageLinkIndex([
+            ('index', 1),
+            ('guide/index', 2),
+            ('guide/setup', 3),
+            ('api/client', 4),
+        ], 'http://confluence/', '.fjson')
+
+    def test_resolve_html(self):
+        self.assertEqual(self.links.resolve('setup.html', 'guide/index'), VIEWPAGE + '3')
+        self.assertEqual(self.links.resolve('../api/client.html#connect', 'guide/setup'), VIEWPAGE + '4#connect')
+        self.assertEqual(self.links.resolve('guide/index.html', 'index'), VIEWPAGE + '2')
+
+    def test_resolve_json(self):
+        self.assertEqual(self.links.resolve('../setup/', 'guide/index'), VIEWPAGE + '3')
+        self.assertEqual(self.links.resolve('../../guide/', 'api/client'), VIEWPAGE + '2')
+        self.assertEqual(self.links.resolve('../', 'guide/setup'), VIEWPAGE + '2')
+
+    def test_not_resolved(self):
+        for href in ('http://example.com/setup.html', 'mailto:docs@example.com', '#setup', '/guide/setup.html',
+                     'missing.html', 'setup.html?x=1', ''):
+            self.assertIsNone(self.links.resolve(href, 'guide/index'), href)
+
+    def test_rewrite(self):
+        body = (u'<a class="reference internal" href="setup.html#install">Install</a>'
+                u"<a href='../api/client.html'>Client</a>"
+                u'<a href="http://example.com/">Example</a>'
+                u'<a href="#local">Local</a>')
+
+        self.assertEqual(self.links.rewrite(body, 'guide/index'),
+                         u'<a class="reference internal" href="{0}3#install">Install</a>'
+                         u"<a href='{0}4'>Client</a>"
+                         u'<a href="http://example.com/">Example</a>'
+                         u'<a href="#local">Local</a>'.format(VIEWPAGE))
+
+    def test_pickle(self):
+        links = pickle.loads(pickle.dumps(self.links))
+
+        self.assertEqual(len(links), 4)
+        self.assertEqual(links.resolve('setup.html', 'guide/index'), VIEWPAGE + '3')
+
+    def test_from_config(self):
+        config = ConfigLoader.from_dict({
+            'version': 2,
+            'url': 'http://confluence',
+            'base_dir': 'docs',
+            'pages': [
+                {'id': 1, 'source': 'index', 'pages': [{'id': 2, 'source': 'guide/setup'}]},
+                {'source': 'draft'},
+            ],
+        })
+
+        links = PageLinkIndex.from_config(config, flatten_page_config_list(config.pages))
+
+        self.assertEqual(len(links), 2)
+        self.assertEqual(links.get('guide/setup'), '2')
+        self.assertEqual(links.resolve('guide/setup.html', 'index'), VIEWPAGE + '2')
@@ -1,5 +1,6 @@
 from unittest import TestCase
-from conf_publisher.mutators.page_mutator import WatermarkPageMutator
+from conf_publisher.mutators.page_mutator import WatermarkPageMutator, LinkPageMutator, AnchorPageMutator, \
+    PageMutatorPipeline
 from conf_publisher.confluence import Page
 
 
@@ -28,3 +29,65 @@ class ConfigLoaderTestCase(TestCase):
         WatermarkPageMutator(watermark).apply_backward(page)
 
         self.assertEqual(clean_content, page.body)
+
+    def test_watermark_page_mutator_remove_every_block(self):
+        block = WatermarkPageMutator.template_prefix + 'old' + WatermarkPageMutator.template_suffix
+
+        page = Page()
+        page.body = block + '<p>first</p>' + block + '<p>second</p>'
+
+        WatermarkPageMutator('test').apply_backward(page)
+
+        self.assertEqual(page.body, '<p>first</p><p>second</p>')
+
+    def test_watermark_page_mutator_remove_unclosed(self):
+        content = WatermarkPageMutator.template_prefix + '<p>content</p>'
+
+        page = Page()
+        page.body = content
+
+        WatermarkPageMutator('test').apply_backward(page)
+
+        self.assertEqual(page.body, content)
+
+
+class PageMutatorPipelineTestCase(TestCase):
+
+    def mutators(self):
+        return [LinkPageMutator('http://example.com'), WatermarkPageMutator('test'), AnchorPageMutator('Old Title')]
+
+    def test_apply_forward(self):
+        expected = Page()
+        expected.title = 'New Title'
+        expected.body = '<a href="#OldTitle-section">section</a>'
+        for mutator in self.mutators():
+            mutator.apply_forward(expected)
+
+        page = Page()
+        page.title = 'New Title'
+        page.body = '<a href="#OldTitle-section">section</a>'
+        PageMutatorPipeline(self.mutators()).apply_forward(page)
+
+        self.assertEqual(page.body, expected.body)
+        self.assertTrue(page.body.startswith(WatermarkPageMutator.template_prefix))
+        self.assertIn('#NewTitle-section', page.body)
+
+    def test_apply_backward(self):
+        page = Page()
+        page.title = 'Title'
+        page.body = '<p>content</p>'
+        pipeline = PageMutatorPipeline(self.mutators()[:2])
+        pipeline.apply_forward(page)
+        page.body = page.body + '<p>more</p>' + LinkPageMutator('http://example.com').render()
+
+        pipeline.apply_backward(page)
+
+        self.assertEqual(page.body, '<p>content</p><p>more</p>')
+
+    def test_empty(self):
+        page = Page()
+        page.body = '<p>content</p>'
+        PageMutatorPipeline([]).apply_forward(page)
+        PageMutatorPipeline([]).apply_backward(page)
+
+        self.assertEqual(page.body, '<p>content</p>')
@@ -0,0 +1,65 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+
+from benchmarks.run import Benchmark
+from benchmarks.tree import TreeSpec, SyntheticTree
+from conf_publisher.config import ConfigLoader, flatten_page_config_list
+from conf_publisher.testing.fake_confluence import FakeConfluence
+
+
+class SyntheticTreeTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_generate(self):
+        spec = TreeSpec(pages=13, depth=2, body_size=2048, images=2, downloads=1, download_size=3000)
+        tree = SyntheticTree(self.root, spec).generate('http://localhost')
+
+        config = ConfigLoader.from_yaml(tree.config_path)
+        page_configs = list(flatten_page_config_list(config.pages))
+        self.assertEqual(len(page_configs), 13)
+        self.assertEqual(len(config.pages), spec.fanout)
+        self.assertTrue(all(len(page_config.images) == 2 for page_config in page_configs))
+
+        with open(os.path.join(self.root, 'pages', 'page_00012.fjson')) as f:
+            body = json.load(f)['body']
+        self.assertGreaterEqual(len(body), 2048)
+        self.assertIn('image_00012_1.png', body)
+        self.assertEqual(os.path.getsize(os.path.join(self.root, '_downloads', 'download_00012_0.bin')), 3000)
+
+    def test_change(self):
+        tree = SyntheticTree(self.root, TreeSpec(pages=20, images=0, downloads=0)).generate('http://localhost')
+        path = os.path.join(self.root, 'pages', 'page_00010.fjson')
+        with open(path) as f:
+            before = f.read()
+
+        self.assertEqual(tree.change(0.1), [0, 10])
+        with open(path) as f:
+            self.assertNotEqual(f.read(), before)
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_run(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        tree = SyntheticTree(root, TreeSpec(pages=5, depth=2, body_size=512, download_size=256))
+
+        results = Benchmark(tree, FakeConfluence(), ['--jobs', '2']).run()
+        by_scenario = dict((result.scenario, result) for result in results)
+
+        self.assertEqual([result.scenario for result in results], ['make', 'cold', 'noop', 'changed', 'dump'])
+        self.assertEqual([result.exit_code for result in results], [0] * 5)
+        self.assertEqual(by_scenario['make'].endpoints['create_content'], 5)
+        self.assertEqual(by_scenario['cold'].endpoints['update_content'], 5)
+        self.assertEqual(by_scenario['noop'].endpoints['update_content'], 0)
+        self.assertEqual(by_scenario['changed'].endpoints['update_content'], 1)
+        self.assertGreater(by_scenario['cold'].bytes_sent, by_scenario['noop'].bytes_sent)
+        self.assertIn('update_content', by_scenario['cold'].client_metrics)
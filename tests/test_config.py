@@ -1,5 +1,5 @@
 from unittest import TestCase
-from conf_publisher.config import ConfigLoader, Config, PageConfig, flatten_page_config_list
+from conf_publisher.config import ConfigLoader, ConfigDumper, Config, PageConfig, flatten_page_config_list
 
 
 class ConfigLoaderTestCase(TestCase):
@@ -32,6 +32,19 @@ class ConfigLoaderTestCase(TestCase):
         self.assertEqual(result, expected)
 
 
+class ConfigDumperTestCase(TestCase):
+
+    def test_downloads_without_images(self):
+        config = ConfigLoader.from_dict({
+            'version': 2,
+            'pages': [{'id': 1, 'source': 'page', 'attachments': {'downloads': ['file.txt']}}],
+        })
+        config_dict = ConfigDumper.to_dict(config)
+
+        self.assertEqual(config_dict['pages'][0]['attachments']['downloads'], ['file.txt'])
+        self.assertEqual(ConfigLoader.from_dict(config_dict), config)
+
+
 class UtilsTestCase(TestCase):
 
     def test_flatten_page_config_list(self):
@@ -48,3 +61,33 @@ class UtilsTestCase(TestCase):
 
         pages = list(flatten_page_config_list(config.pages))
         self.assertEqual(len(list(pages)), 3)
+
+
+class HttpConfigTestCase(TestCase):
+
+    def test_http_from_dict(self):
+        data = {
+            'version': 2,
+            'http': {
+                'pool_maxsize': 32,
+                'keep_alive': False,
+            },
+        }
+
+        config = ConfigLoader.from_dict(data)
+
+        self.assertEqual(config.http.pool_maxsize, 32)
+        self.assertIs(config.http.keep_alive, False)
+        self.assertIsNone(config.http.pool_block)
+
+    def test_http_round_trip(self):
+        config = Config()
+        config.http.pool_block = True
+
+        config_dict = ConfigDumper.to_dict(config)
+
+        self.assertEqual(dict(config_dict['http']), {'pool_block': True})
+        self.assertEqual(ConfigLoader.from_dict(config_dict), config)
+
+    def test_http_not_dumped_by_default(self):
+        self.assertNotIn('http', ConfigDumper.to_dict(Config()))
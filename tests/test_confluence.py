@@ -3,7 +3,12 @@ import copy
 import os
 import codecs
 
-from conf_publisher.confluence import Page, Content, Ancestor, PageBodyComparator
+from conf_publisher.confluence import Page, Content, Ancestor, PageBodyComparator, FingerprintCache, \
+    ComparatorStats, NOT_LOADED, AllEntitiesXMLParser, ImageAttachement, DownloadAttachement, AttachmentPublisher, \
+    ConfluencePageManager, attachment_file
+from conf_publisher.confluence_api import ConfluenceRestApi553
+from conf_publisher.errors import AttachmentsError, PublisherError
+from conf_publisher.workers import process_pool
 
 
 class ContentTestCase(TestCase):
@@ -38,6 +43,57 @@ class PageTestCase(TestCase):
 
         self.assertTrue(first == second)
 
+    def test_not_eq(self):
+        first = Page()
+        first.id = 12345
+        first.body = '<p>body</p>'
+        first.ancestors.append(Ancestor())
+
+        second = copy.copy(first)
+        second.title = 'Other title'
+        third = copy.deepcopy(first)
+        third.ancestors[0].id = 1
+        fourth = copy.copy(first)
+        fourth.body = '<p>other body</p>'
+
+        self.assertFalse(first == second)
+        self.assertFalse(first == third)
+        self.assertFalse(first == fourth)
+        self.assertTrue(first != fourth)
+
+    def test_body_compared_last(self):
+        self.addCleanup(setattr, PageBodyComparator, 'stats', PageBodyComparator.stats)
+        PageBodyComparator.stats = stats = ComparatorStats()
+        first = Page()
+        first.body = '<p>body</p>'
+        second = copy.copy(first)
+        second.version_number = 2
+
+        self.assertFalse(first == second)
+        self.assertEqual(stats.count, 0)
+
+    def test_lazy_body(self):
+        loads = []
+        page = Page()
+        page.body = NOT_LOADED
+        page.body_loader = lambda: loads.append(1) or '<p>body</p>'
+        self.assertFalse(page.body_loaded)
+
+        self.assertEqual(page.body, '<p>body</p>')
+        self.assertEqual(page.body, '<p>body</p>')
+        self.assertTrue(page.body_loaded)
+        self.assertEqual(len(loads), 1)
+
+        page.body = NOT_LOADED
+        with self.assertRaises(PublisherError):
+            page.body
+
+    def test_slots(self):
+        for content in (Page(), Ancestor(), ImageAttachement(), DownloadAttachement()):
+            self.assertFalse(hasattr(content, '__dict__'))
+        self.assertEqual(Page().type, 'page')
+        self.assertEqual(ImageAttachement().type, 'attachment')
+
 
 class PageBodyComparatorTestCase(TestCase):
 
@@ -45,7 +101,8 @@ class PageBodyComparatorTestCase(TestCase):
         fixture_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'page_body.html')
         body_fixture = codecs.open(fixture_file, 'r', encoding='utf-8').read()
 
-        fixture_file_stripped = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'page_body_stripped.html')
+        fixture_file_stripped = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures',
+                                             'page_body_stripped.html')
         body_fixture_stripped = codecs.open(fixture_file_stripped, 'r', encoding='utf-8').read()
 
         result = PageBodyComparator.is_equal(body_fixture, body_fixture_stripped)
@@ -53,7 +110,282 @@ class PageBodyComparatorTestCase(TestCase):
 
     def test_attributes(self):
         first = """<ac:structured-macro ac:name="code"></ac:structured-macro>"""
-        second = """<ac:structured-macro ac:name="code" ac:macro-id="3a4340a5-f3e7-4a93-9d8a-8017715fbc94"></ac:structured-macro>"""
+        second = """<ac:structured-macro ac:name="code" ac:macro-id="3a4340a5-f3e7-4a93-9d8a-8017715fbc94">""" \
+                 """</ac:structured-macro>"""
 
         result = PageBodyComparator.is_equal(first, second)
         self.assertTrue(result)
+
+    def test_not_equal(self):
+        self.assertFalse(PageBodyComparator.is_equal('<p>a</p>', '<p>b</p>'))
+        self.assertFalse(PageBodyComparator.is_equal('<p>a</p>', '<p class="x">a</p>'))
+        self.assertFalse(PageBodyComparator.is_equal('<p>a</p>', '<p>a</p><p>a</p>'))
+        self.assertFalse(PageBodyComparator.is_equal('<p>a</p>', ''))
+        self.assertFalse(PageBodyComparator.is_equal(
+            '<ac:structured-macro ac:name="code"></ac:structured-macro>',
+            '<ac:structured-macro ac:name="info"></ac:structured-macro>'
+        ))
+
+    def test_canonical_form(self):
+        self.assertEqual(PageBodyComparator.canonical_form('<p b="2" a="1">x</p>\n<br/>'),
+                         PageBodyComparator.canonical_form('<p a="1" b="2">x</p><br/>'))
+        self.assertEqual(PageBodyComparator.canonical_form(''), '')
+
+    def test_deep_nesting(self):
+        body = '<div>' * 5000 + 'x' + '</div>' * 5000
+        self.assertTrue(PageBodyComparator.is_equal(body, body + '\n'))
+
+    def test_tails(self):
+        self.assertFalse(PageBodyComparator.is_equal('<p>a <b>b</b> c</p>', '<p>a <b>b</b> d</p>'))
+        self.assertTrue(PageBodyComparator.is_equal('<p>a <b>b</b></p>', '<p>a <b>b</b>\n  </p>'))
+
+    def test_whitespace_in_cdata_is_text(self):
+        first = '<ac:plain-text-body><![CDATA[<a>\n  <b>]]></ac:plain-text-body>'
+        second = '<ac:plain-text-body><![CDATA[<a><b>]]></ac:plain-text-body>'
+        self.assertFalse(PageBodyComparator.is_equal(first, second))
+
+    def test_stats(self):
+        self.addCleanup(setattr, PageBodyComparator, 'stats', PageBodyComparator.stats)
+        self.addCleanup(setattr, PageBodyComparator, 'cache', PageBodyComparator.cache)
+        PageBodyComparator.stats = stats = ComparatorStats()
+        PageBodyComparator.cache = FingerprintCache()
+
+        PageBodyComparator.is_equal('<p>a</p>', '<p>a</p>')
+        PageBodyComparator.is_equal('<p>a</p>\n<p>b</p>', '<p>a</p><p>b</p>')
+        PageBodyComparator.is_equal('<p>a</p>', '<p >a</p>')
+        PageBodyComparator.is_equal('<p >a</p>', '<p>a</p>')
+        PageBodyComparator.is_equal('<p>a</p>', '<p>b</p>')
+
+        self.assertEqual(dict(stats.paths), {'identical': 1, 'normalized': 1, 'parsed': 2, 'cached': 1})
+        self.assertEqual(stats.different, 1)
+        self.assertEqual(str(stats), '5 compared (1 identical, 1 normalized, 1 cached, 2 parsed), 1 different')
+
+    def test_fingerprints_are_cached(self):
+        cache = FingerprintCache()
+        self.addCleanup(setattr, PageBodyComparator, 'cache', PageBodyComparator.cache)
+        PageBodyComparator.cache = cache
+
+        for _ in range(3):
+            PageBodyComparator.is_equal('<p>first</p>', '<p>second</p>')
+
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 4)
+
+
+class CountingExecutor(object):
+    def __init__(self, executor):
+        self.executor = executor
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return self.executor.submit(*args, **kwargs)
+
+
+class ProcessPoolComparatorTestCase(TestCase):
+
+    def setUp(self):
+        for attr in ('cache', 'executor', 'process_min_size'):
+            self.addCleanup(setattr, PageBodyComparator, attr, getattr(PageBodyComparator, attr))
+        self.pool = process_pool(2)
+        self.addCleanup(self.pool.shutdown)
+        PageBodyComparator.cache = FingerprintCache()
+        PageBodyComparator.executor = CountingExecutor(self.pool)
+
+    def test_large_bodies_in_pool(self):
+        fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+        body = codecs.open(os.path.join(fixtures_dir, 'page_body.html'), 'r', encoding='utf-8').read()
+        body_stripped = codecs.open(os.path.join(fixtures_dir, 'page_body_stripped.html'), 'r', encoding='utf-8').read()
+        PageBodyComparator.process_min_size = 100
+
+        self.assertFalse(PageBodyComparator.is_equal(body, body_stripped + '<p>changed</p>'))
+        self.assertFalse(PageBodyComparator.is_equal('<p>a</p>', '<p>b</p>'))
+
+        self.assertEqual(PageBodyComparator.executor.submitted, 2)
+        self.assertEqual(PageBodyComparator.fingerprint(body), PageBodyComparator._fingerprint(body))
+
+
+class AllEntitiesXMLParserTestCase(TestCase):
+
+    def test_html_entities(self):
+        parser = AllEntitiesXMLParser()
+        body = u'<p>&nbsp;&mdash;&hellip;&amp;&#169;&zwnj;&unknown;</p>'
+        parser.feed(PageBodyComparator.wrapper.format(body).encode('utf-8'))
+        self.assertEqual(parser.close()[0].text, u'\u00a0\u2014\u2026&\u00a9\u200cunknown')
+
+    def test_entities_compare_to_characters(self):
+        self.assertTrue(PageBodyComparator.is_equal(u'<p>a&nbsp;&ndash; b</p>', u'<p>a\u00a0\u2013 b</p>'))
+
+
+class FingerprintCacheTestCase(TestCase):
+
+    def test_lru(self):
+        computed = []
+
+        def compute(body):
+            computed.append(body)
+            return body.upper()
+
+        cache = FingerprintCache(max_size=2)
+        for body in ('a', 'b', 'a', 'c', 'b'):
+            cache.get(body, compute)
+
+        self.assertEqual(computed, ['a', 'b', 'c', 'b'])
+
+    def test_store(self):
+        class Store(dict):
+            get_fingerprint = dict.get
+            set_fingerprint = dict.__setitem__
+
+        store = Store()
+        self.assertEqual(FingerprintCache(store).get('a', lambda body: 'A'), 'A')
+        self.assertEqual(FingerprintCache(store).get('a', lambda body: self.fail('computed twice')), 'A')
+        self.assertEqual(list(store.values()), ['A'])
+
+
+class FakeSearchApi(ConfluenceRestApi553):
+    page_size = 25
+
+    def __init__(self, page_ids):
+        self.contents = dict((str(page_id), self.content_data(str(page_id))) for page_id in page_ids)
+        self.search_calls = []
+
+    @staticmethod
+    def content_data(content_id):
+        return {
+            'id': content_id,
+            'type': 'page',
+            'title': 'Page {}'.format(content_id),
+            'space': {'key': 'TEST'},
+            'version': {'number': 3},
+            'body': {'storage': {'value': '<p>{}</p>'.format(content_id)}},
+            'ancestors': [{'id': '1', 'type': 'page'}],
+        }
+
+    def search_content(self, cql, cql_context=None, expand=None, start=0, limit=25):
+        self.search_calls.append((cql, start))
+        ids = cql[len('id in ('):-1].split(',')
+        found = [self.contents[content_id] for content_id in ids if content_id in self.contents]
+        results = found[start:start + min(limit, self.page_size)]
+        data = {'results': results, '_links': {}}
+        if start + len(results) < len(found):
+            data['_links']['next'] = '/next'
+        return data
+
+
+class PageManagerTestCase(TestCase):
+
+    def test_load_many(self):
+        api = FakeSearchApi(range(1, 131))
+        page_manager = ConfluencePageManager(api)
+
+        pages = page_manager.load_many(list(range(1, 131)) + [404])
+
+        self.assertEqual(len(pages), 130)
+        self.assertNotIn('404', pages)
+        self.assertEqual(pages['42'].body, '<p>42</p>')
+        self.assertEqual(pages['42'].version_number, 3)
+        self.assertEqual(pages['42'].ancestors[0].id, '1')
+        # 100 ids in the first query in 4 result pages, 31 ids in the second query in 2 result pages
+        self.assertEqual(len(api.search_calls), 6)
+
+
+class FakeAttachmentsApi(ConfluenceRestApi553):
+    page_size = 50
+
+    def __init__(self, titles):
+        self.attachments = [self.attachment_data(str(i), title) for i, title in enumerate(titles)]
+        self.list_calls = 0
+        self.create_calls = 0
+        self.rejected = []
+        self.created = []
+        self.updated = []
+
+    @staticmethod
+    def attachment_data(attachment_id, title, size=None, comment=None):
+        return {
+            'id': attachment_id,
+            'title': title,
+            'metadata': {'mediaType': 'image/png', 'comment': comment},
+            'extensions': {'fileSize': size},
+            'version': {'number': 1},
+        }
+
+    def list_attachments(self, content_id, expand=None, start=0, limit=50, filename=None, media_type=None):
+        self.list_calls += 1
+        results = self.attachments[start:start + min(limit, self.page_size)]
+        data = {'results': results, '_links': {}}
+        if start + len(results) < len(self.attachments):
+            data['_links']['next'] = '/next'
+        return data
+
+    def create_attachments(self, content_id, attachments, comments=None, callback=None):
+        self.create_calls += 1
+        results = []
+        for attachment, comment in zip(attachments, comments):
+            if attachment.filename in self.rejected:
+                continue
+            self.created.append(attachment.filename)
+            data = self.attachment_data('new-' + attachment.filename, attachment.filename, attachment.size, comment)
+            self.attachments.append(data)
+            results.append(data)
+        return {'results': results}
+
+    def update_attachment_data(self, content_id, attachment_id, attachment, comment=None, callback=None):
+        self.updated.append(attachment_id)
+        for data in self.attachments:
+            if data['id'] == attachment_id:
+                data['metadata']['comment'] = comment
+                data['extensions']['fileSize'] = attachment.size
+
+
+class AttachmentPublisherTestCase(TestCase):
+    fixtures_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+    def setUp(self):
+        self.image = attachment_file(os.path.join(self.fixtures_root, '_images', 'test_image.png'))
+        self.download = attachment_file(os.path.join(self.fixtures_root, '_downloads', 'test_download.txt'))
+
+    def test_attachment_file(self):
+        self.assertEqual(self.image.filename, 'test_image.png')
+        self.assertEqual(self.image.media_type, 'image/png')
+        self.assertEqual(self.image.size, os.path.getsize(self.image.filepath))
+        self.assertEqual(len(self.image.digest), 64)
+
+    def test_publish_page(self):
+        api = FakeAttachmentsApi(['file_{}.png'.format(i) for i in range(119)] + ['test_image.png'])
+
+        AttachmentPublisher(api).publish_page(1, [self.image, self.download, self.download])
+
+        self.assertEqual(api.list_calls, 3)
+        self.assertEqual(api.updated, ['119'])
+        self.assertEqual(api.created, ['test_download.txt'])
+
+    def test_skip_not_changed(self):
+        api = FakeAttachmentsApi([])
+
+        AttachmentPublisher(api).publish_page(1, [self.image, self.download])
+        AttachmentPublisher(api).publish_page(1, [self.image, self.download])
+        self.assertEqual(api.created, ['test_image.png', 'test_download.txt'])
+        self.assertEqual(api.updated, [])
+
+        AttachmentPublisher(api).publish_page(1, [self.image], force=True)
+        self.assertEqual(api.updated, ['new-test_image.png'])
+
+    def test_batches(self):
+        api = FakeAttachmentsApi([])
+        files = [self.image._replace(filename='image_{}.png'.format(i)) for i in range(45)]
+        api.rejected = ['image_7.png']
+
+        with self.assertRaises(AttachmentsError) as ctx:
+            AttachmentPublisher(api).publish_page(1, files)
+
+        self.assertEqual(api.create_calls, 3)
+        self.assertEqual(len(api.created), 44)
+        self.assertEqual([filename for filename, _ in ctx.exception.failures], ['image_7.png'])
+
+    def test_batch_size(self):
+        publisher = AttachmentPublisher(None)
+        publisher.batch_max_size = 2 * self.image.size
+        files = [self.image._replace(filename='image_{}.png'.format(i)) for i in range(5)]
+        self.assertEqual([len(batch) for batch in publisher._batches(files)], [2, 2, 1])
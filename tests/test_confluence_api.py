@@ -0,0 +1,59 @@
+from unittest import TestCase
+import threading
+
+from conf_publisher.confluence_api import ConfluenceRestApi553
+
+
+class FakeListApi(ConfluenceRestApi553):
+    def __init__(self, count, page_size_limit=None):
+        super(FakeListApi, self).__init__('http://confluence', None)
+        self.items = [{'id': str(i)} for i in range(count)]
+        self.page_size_limit = page_size_limit
+        self.calls = []
+        self.fetched = threading.Event()
+
+    def list_attachments(self, content_id, expand=None, start=0, limit=50, filename=None, media_type=None):
+        self.calls.append((start, limit))
+        if self.page_size_limit:
+            limit = min(limit, self.page_size_limit)
+        results = self.items[start:start + limit]
+        data = {'results': results, '_links': {}}
+        if start + len(results) < len(self.items):
+            data['_links']['next'] = '/next'
+        if start > 0:
+            self.fetched.set()
+        return data
+
+
+class PaginationTestCase(TestCase):
+
+    def test_iterates_all_pages(self):
+        api = FakeListApi(25)
+        items = list(api.iter_attachments(1, page_size=10))
+        self.assertEqual([item['id'] for item in items], [str(i) for i in range(25)])
+        self.assertEqual(api.calls, [(0, 10), (10, 10), (20, 10)])
+
+    def test_follows_server_limit(self):
+        api = FakeListApi(25, page_size_limit=4)
+        self.assertEqual(len(list(api.iter_attachments(1, page_size=10))), 25)
+        self.assertEqual([start for start, _ in api.calls], [0, 4, 8, 12, 16, 20, 24])
+
+    def test_single_page(self):
+        api = FakeListApi(3)
+        self.assertEqual(len(list(api.iter_attachments(1))), 3)
+        self.assertEqual(len(api.calls), 1)
+
+    def test_next_page_fetched_in_background(self):
+        api = FakeListApi(20)
+        items = api.iter_attachments(1, page_size=10)
+        next(items)
+        # the second page is requested while the first one is still being consumed
+        self.assertTrue(api.fetched.wait(5))
+        items.close()
+
+    def test_stop_early(self):
+        api = FakeListApi(1000)
+        items = api.iter_attachments(1, page_size=10)
+        self.assertEqual(next(items)['id'], '0')
+        items.close()
+        self.assertLess(len(api.calls), 10)
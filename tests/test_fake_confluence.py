@@ -0,0 +1,220 @@
+from unittest import TestCase, skipIf
+import os
+import sys
+import time
+
+import requests
+
+from conf_publisher.config import ConfigLoader
+from conf_publisher.constants import ASYNCIO_MIN_PYTHON
+from conf_publisher.confluence import ConfluencePageManager, AttachmentPublisher, Page, Ancestor, attachment_file
+from conf_publisher.confluence_api import ConfluenceRestApi553
+from conf_publisher.errors import PublishError
+from conf_publisher.publish import Publisher, create_data_provider
+from conf_publisher.retry import RetryPolicy
+from conf_publisher.testing.fake_confluence import FakeConfluence, FakeConfluenceServer
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class NoBackoffRetryPolicy(RetryPolicy):
+    def backoff(self, attempt, retry_after=None):
+        return 0
+
+
+class FakeConfluenceTestCase(TestCase):
+    fixtures_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+    def setUp(self):
+        self.confluence = FakeConfluence()
+        self.server = FakeConfluenceServer(self.confluence).start()
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def make_api(self, retry_policy=None):
+        return ConfluenceRestApi553(self.server.url, self.session, retry_policy)
+
+    def make_config(self, page_ids):
+        config = ConfigLoader.from_dict({
+            'version': 2,
+            'url': self.server.url,
+            'base_dir': self.fixtures_root,
+            'pages': [
+                {
+                    'id': page_id,
+                    'source': 'page',
+                    'attachments': {'images': ['test_image.png'], 'downloads': ['test_download.txt']},
+                } for page_id in page_ids
+            ],
+        })
+        self.confluence.add_page(100, title='Parent')
+        for page_id in page_ids:
+            self.confluence.add_page(page_id, body='<p>Old body</p>', ancestors=[100])
+        return config
+
+    def make_publisher(self, config, api, jobs=4):
+        return Publisher(config, create_data_provider(config), ConfluencePageManager(api), AttachmentPublisher(api),
+                         jobs=jobs)
+
+    def endpoint_calls(self, endpoint):
+        return len([request for request in self.confluence.requests if request[1] == endpoint])
+
+
+class PageManagerTestCase(FakeConfluenceTestCase):
+
+    def test_create_load_update(self):
+        parent_id = self.confluence.add_page(title='Parent')
+        page_manager = ConfluencePageManager(self.make_api())
+
+        ancestor = Ancestor()
+        ancestor.id = parent_id
+        page = Page()
+        page.space_key = 'TEST'
+        page.title = 'Child'
+        page.body = '<p>Body</p>'
+        page.ancestors.append(ancestor)
+        content_id = page_manager.create(page)
+
+        page = page_manager.load(content_id)
+        self.assertEqual(page.body, '<p>Body</p>')
+        self.assertEqual(page.ancestors[0].id, parent_id)
+
+        page.body = '<p>New body</p>'
+        page_manager.update(page)
+        self.assertEqual(self.confluence.pages[content_id]['body'], '<p>New body</p>')
+        self.assertEqual(self.confluence.pages[content_id]['version'], 2)
+
+    def test_version_conflict(self):
+        parent_id = self.confluence.add_page(title='Parent')
+        content_id = self.confluence.add_page(title='Page', ancestors=[parent_id])
+        page_manager = ConfluencePageManager(self.make_api())
+        page = page_manager.load(content_id)
+
+        self.confluence.simulate_edit(content_id)
+        with self.assertRaises(requests.HTTPError) as ctx:
+            page_manager.update(page)
+        self.assertEqual(ctx.exception.response.status_code, 409)
+
+    def test_load_many_paginates(self):
+        self.confluence.max_limit = 7
+        page_ids = [self.confluence.add_page() for _ in range(30)]
+        pages = ConfluencePageManager(self.make_api()).load_many(page_ids)
+        self.assertEqual(sorted(pages), sorted(page_ids))
+        self.assertEqual(self.endpoint_calls('search_content'), 5)
+
+    def test_injected_faults_are_retried(self):
+        content_id = self.confluence.add_page(title='Page')
+        self.confluence.fail_next(429, retry_after=0)
+        self.confluence.fail_next(503)
+        page = ConfluencePageManager(self.make_api(NoBackoffRetryPolicy())).load(content_id)
+        self.assertEqual(page.title, 'Page')
+        self.assertEqual(self.endpoint_calls('get_content'), 3)
+
+
+    def test_latency_and_bandwidth(self):
+        content_id = self.confluence.add_page(title='Page', body='x' * 10000)
+        self.confluence.latency = 0.05
+        self.confluence.bandwidth = 100000
+
+        started = time.time()
+        ConfluencePageManager(self.make_api()).load(content_id, with_body=True)
+        self.assertGreaterEqual(time.time() - started, 0.15)
+
+    def test_load_titles(self):
+        first_id = self.confluence.add_page(title='First', body='x' * 10000)
+        second_id = self.confluence.add_page(title='Second')
+
+        titles = ConfluencePageManager(self.make_api()).load_titles([first_id, second_id, '404'])
+
+        self.assertEqual(titles, {first_id: 'First', second_id: 'Second'})
+        self.assertLess(self.confluence.bytes_sent, 10000)
+
+    def test_lazy_body(self):
+        content_id = self.confluence.add_page(title='Page', body='x' * 10000)
+        page_manager = ConfluencePageManager(self.make_api())
+
+        page = page_manager.load(content_id)
+        pages = page_manager.load_many([content_id])
+        self.assertFalse(page.body_loaded)
+        self.assertLess(self.confluence.bytes_sent, 10000)
+
+        self.assertEqual(page.body, 'x' * 10000)
+        self.assertEqual(page.body, 'x' * 10000)
+        self.assertTrue(page.body_loaded)
+        self.assertEqual(self.endpoint_calls('get_content'), 2)
+
+        self.assertTrue(page_manager.load_many([content_id], with_body=True)[content_id].body_loaded)
+        self.assertFalse(pages[content_id].body_loaded)
+
+
+class AttachmentsTestCase(FakeConfluenceTestCase):
+
+    def test_upload_and_skip_not_changed(self):
+        content_id = self.confluence.add_page()
+        files = [attachment_file(os.path.join(self.fixtures_root, '_images', 'test_image.png')),
+                 attachment_file(os.path.join(self.fixtures_root, '_downloads', 'test_download.txt'))]
+
+        AttachmentPublisher(self.make_api()).publish_page(content_id, files)
+        attachments = self.confluence.page_attachments(content_id)
+        self.assertEqual([attachment['title'] for attachment in attachments], ['test_image.png', 'test_download.txt'])
+        self.assertEqual(attachments[0]['sha256'], files[0].digest)
+        self.assertEqual(self.endpoint_calls('create_attachments'), 1)
+
+        AttachmentPublisher(self.make_api()).publish_page(content_id, files)
+        AttachmentPublisher(self.make_api()).publish_page(content_id, files[:1], force=True)
+        self.assertEqual(self.endpoint_calls('create_attachments'), 1)
+        self.assertEqual(self.endpoint_calls('update_attachment_data'), 1)
+        self.assertEqual(self.confluence.page_attachments(content_id)[0]['version'], 2)
+
+
+class PublisherTestCase(FakeConfluenceTestCase):
+
+    def test_publish(self):
+        config = self.make_config(list(range(1, 11)))
+        self.make_publisher(config, self.make_api(), jobs=2).publish()
+
+        for page_id in range(1, 11):
+            page = self.confluence.pages[str(page_id)]
+            self.assertEqual(page['title'], 'Title')
+            self.assertEqual(page['version'], 2)
+            self.assertEqual(len(self.confluence.page_attachments(page_id)), 2)
+        self.assertEqual(self.endpoint_calls('get_content'), 0)
+
+        self.make_publisher(config, self.make_api()).publish()
+        self.assertEqual(self.endpoint_calls('update_content'), 10)
+        self.assertEqual(self.endpoint_calls('create_attachments'), 10)
+
+    def test_publish_with_faults(self):
+        self.confluence.fault_rate = 0.2
+        self.confluence.fault_statuses = (429, 503)
+        self.confluence.retry_after = 0
+        self.confluence._random.seed(1)
+        config = self.make_config(list(range(1, 11)))
+
+        self.make_publisher(config, self.make_api(NoBackoffRetryPolicy(max_retries=10))).publish()
+        self.assertEqual([self.confluence.pages[str(page_id)]['version'] for page_id in range(1, 11)], [2] * 10)
+
+    def test_version_conflict_fails_page(self):
+        self.confluence.conflict_rate = 1
+        config = self.make_config([1, 2])
+
+        with self.assertRaises(PublishError) as ctx:
+            self.make_publisher(config, self.make_api()).publish()
+        self.assertEqual(sorted(content_id for content_id, _ in ctx.exception.failures), ['1', '2'])
+
+    @skipIf(sys.version_info < ASYNCIO_MIN_PYTHON or aiohttp is None, 'asyncio engine is not available')
+    def test_publish_asyncio(self):
+        from conf_publisher.aio.publish import run_publish
+
+        config = self.make_config(list(range(1, 11)))
+        run_publish(config, self.session, jobs=4)
+
+        for page_id in range(1, 11):
+            self.assertEqual(self.confluence.pages[str(page_id)]['version'], 2)
+            self.assertEqual(len(self.confluence.page_attachments(page_id)), 2)
@@ -0,0 +1,92 @@
+from unittest import TestCase
+import json
+import os
+import shutil
+import tempfile
+
+import requests
+
+from conf_publisher.confluence_api import ConfluenceRestApi553
+from conf_publisher.metrics import RequestMetrics, percentile
+
+from .test_retry import FakeResponse, FakeSession, NoSleepRetryPolicy
+
+
+class PercentileTestCase(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+
+class RequestMetricsTestCase(TestCase):
+    def make_metrics(self):
+        metrics = RequestMetrics()
+        for i in range(1, 101):
+            metrics.record('get_content', 200, i / 1000.0, bytes_received=100)
+        metrics.record('update_content', 409, 0.5, bytes_sent=2048)
+        metrics.record('update_content', None, 1.0)
+        return metrics
+
+    def test_to_dict(self):
+        data = self.make_metrics().to_dict()
+        self.assertEqual(list(data), ['get_content', 'update_content'])
+        self.assertEqual(data['get_content']['count'], 100)
+        self.assertEqual(data['get_content']['bytes_received'], 10000)
+        self.assertAlmostEqual(data['get_content']['latency']['p95'], 0.095)
+        self.assertEqual(dict(data['update_content']['statuses']), {'409': 1, 'error': 1})
+
+    def test_to_prometheus(self):
+        text = self.make_metrics().to_prometheus()
+        self.assertIn('# TYPE confluence_publisher_requests_total counter', text)
+        self.assertIn('confluence_publisher_requests_total{endpoint="update_content",status="409"} 1', text)
+        self.assertIn('confluence_publisher_request_duration_seconds{endpoint="get_content",quantile="0.5"} 0.05',
+                      text)
+        self.assertIn('confluence_publisher_request_duration_seconds_count{endpoint="get_content"} 100', text)
+        self.assertIn('confluence_publisher_request_sent_bytes_total{endpoint="update_content"} 2048', text)
+
+    def test_format_table(self):
+        lines = self.make_metrics().format_table().split('\n')
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('Endpoint'))
+        self.assertIn('200:100', lines[1])
+        self.assertIn('2 KB', lines[2])
+
+    def test_write(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            metrics = self.make_metrics()
+            metrics.write(os.path.join(tmp_dir, 'metrics.json'))
+            metrics.write(os.path.join(tmp_dir, 'metrics.prom'))
+            with open(os.path.join(tmp_dir, 'metrics.json')) as f:
+                self.assertEqual(json.load(f)['get_content']['count'], 100)
+            with open(os.path.join(tmp_dir, 'metrics.prom')) as f:
+                self.assertTrue(f.read().startswith('# HELP'))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class ApiMetricsTestCase(TestCase):
+    def test_every_attempt_recorded(self):
+        metrics = RequestMetrics()
+        session = FakeSession([
+            FakeResponse(429),
+            FakeResponse(200, {'id': '1'}, content=b'{"id": "1"}'),
+            FakeResponse(200, {'id': '1'}, content=b'{"id": "1"}', body=b'{"type": "page"}'),
+            requests.ConnectionError(),
+        ])
+        api = ConfluenceRestApi553('http://confluence', session, NoSleepRetryPolicy(max_retries=1), metrics=metrics)
+
+        api.get_content(1)
+        api.update_content(1, {'type': 'page'})
+        with self.assertRaises(requests.ConnectionError):
+            api.create_content({'type': 'page'})
+
+        data = metrics.to_dict()
+        self.assertEqual(dict(data['get_content']['statuses']), {'200': 1, '429': 1})
+        self.assertEqual(data['get_content']['bytes_received'], 11)
+        self.assertEqual(data['update_content']['bytes_sent'], 16)
+        self.assertEqual(dict(data['create_content']['statuses']), {'error': 1})
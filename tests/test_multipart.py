@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from email.parser import BytesParser
+import os
+
+from conf_publisher.multipart import MultipartEncoder, ProgressLogger
+
+
+class MultipartEncoderTestCase(TestCase):
+    image = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', '_images', 'test_image.png')
+
+    def make_encoder(self, callback=None):
+        return MultipartEncoder(
+            fields=[('comment', u'комментарий'), ('minorEdit', False)],
+            files=[('file', 'test_image.png', self.image, 'image/png')],
+            callback=callback
+        )
+
+    @staticmethod
+    def parse(encoder, body):
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + encoder.content_type.encode('ascii') + b'\r\n\r\n' + body
+        )
+        return message.get_payload()
+
+    def test_body(self):
+        encoder = self.make_encoder()
+        body = encoder.read()
+        self.assertEqual(len(body), len(encoder))
+
+        comment, minor_edit, attachment = self.parse(encoder, body)
+        self.assertEqual(comment.get_param('name', header='content-disposition'), 'comment')
+        self.assertEqual(comment.get_payload(decode=True).decode('utf-8'), u'комментарий')
+        self.assertEqual(minor_edit.get_payload(), 'false')
+        self.assertEqual(attachment.get_filename(), 'test_image.png')
+        self.assertEqual(attachment.get_content_type(), 'image/png')
+        with open(self.image, 'rb') as f:
+            self.assertEqual(attachment.get_payload(decode=True), f.read())
+
+    def test_chunked_read(self):
+        encoder = self.make_encoder()
+        chunks = []
+        while True:
+            chunk = encoder.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+
+        encoder.rewind()
+        self.assertEqual(b''.join(chunks), encoder.read())
+
+    def test_callback(self):
+        progress = []
+        encoder = self.make_encoder(callback=lambda bytes_read, total: progress.append((bytes_read, total)))
+        while encoder.read(100):
+            pass
+        self.assertEqual(progress[-1], (len(encoder), len(encoder)))
+
+
+class ProgressLoggerTestCase(TestCase):
+
+    def test_steps(self):
+        logger = ProgressLogger('file.zip', step=25)
+        logged = []
+        for bytes_read in range(0, 101, 5):
+            before = logger._logged
+            logger(bytes_read, 100)
+            if logger._logged != before:
+                logged.append(logger._logged)
+        self.assertEqual(logged, [0, 25, 50, 75, 100])
@@ -12,15 +12,23 @@ class FakeConfluencePageManager(object):
         if initial_pages is None:
             initial_pages = []
         self._pages = dict((page.id, page) for page in initial_pages)
+        self.loads = 0
+        self.bulk_loads = 0
 
     def _get_last_content_id(self):
         if len(self._pages.keys()):
             return max(self._pages.keys())
         return 0
 
-    def load(self, content_id):
+    def load(self, content_id, with_body=False):
+        self.loads += 1
         return self._pages[content_id]
 
+    def load_many(self, content_ids, with_body=False):
+        self.bulk_loads += 1
+        return dict((str(content_id), self._pages[content_id]) for content_id in content_ids
+                    if content_id in self._pages)
+
     def create(self, page):
         content_id = self._get_last_content_id() + 1
         self._pages[content_id] = page
@@ -92,6 +100,32 @@ class PageMakerTestCase(TestCase):
         make_pages(config, page_manager, parent_id=40000000)
         self.assertTrue(40000001 in page_manager._pages)
 
+    def test_make_pages_loads_parents_in_bulk(self):
+        page_manager = FakeConfluencePageManager([
+            make_page_fixture(page_id=40000000, title='first parent'),
+            make_page_fixture(page_id=40000010, title='second parent'),
+        ])
+
+        config = ConfigLoader.from_dict({
+            'version': 2,
+            'base_dir': 'fixtures',
+            'pages': [
+                {
+                    'id': 40000000,
+                    'pages': [{'title': 'first child'}],
+                },
+                {
+                    'id': 40000010,
+                    'pages': [{'title': 'second child'}],
+                },
+            ]
+        })
+
+        make_pages(config, page_manager)
+        self.assertEqual(page_manager.bulk_loads, 1)
+        self.assertEqual(page_manager.loads, 0)
+        self.assertEqual(len(page_manager._pages), 4)
+
     def test_dump_config(self):
         expected = [
             'version: 2\n',
@@ -1,10 +1,16 @@
 from unittest import TestCase
+import copy
+import json
 import random
 import os
+import shutil
+import tempfile
 
 from conf_publisher.confluence import Page
 from conf_publisher.publish import Publisher
 from conf_publisher.config import ConfigLoader
+from conf_publisher.errors import PublishError
+from conf_publisher.state import PublishState
 from conf_publisher.data_providers.sphinx_fjson_data_provider import SphinxFJsonDataProvider
 
 
@@ -13,9 +19,12 @@ class FakePagePublisher(object):
         pages = pages or []
         self._pages = dict((page.id, page) for page in pages)
 
-    def load(self, content_id):
+    def load(self, content_id, with_body=False):
         return self._pages[content_id]
 
+    def load_many(self, content_ids, with_body=False):
+        return dict((str(content_id), self.load(content_id)) for content_id in content_ids)
+
     def create(self, page):
         page.id = random.randint(10000, 100000)
         self._pages[page.id] = page
@@ -30,8 +39,8 @@ class FakePagePublisher(object):
 
 
 class FakeAttachmentPublisher(object):
-    def publish(self, content_id, filename):
-        return random.randint(10000, 100000)
+    def publish_page(self, content_id, attachment_files, force=False):
+        return [random.randint(10000, 100000) for _ in attachment_files]
 
 
 class FakeEnv(object):
@@ -162,3 +171,322 @@ class PublisherTestCase(TestCase):
         self.assertEqual(_page[0].title, self.title)
         self.set_checker(_page[0].body, self.body)
 
+
+class FailingPagePublisher(FakePagePublisher):
+    def __init__(self, pages=None, failing_ids=None):
+        super(FailingPagePublisher, self).__init__(pages)
+        self._failing_ids = failing_ids or []
+
+    def load(self, content_id, with_body=False):
+        if content_id in self._failing_ids:
+            raise IOError('Can not load page {}'.format(content_id))
+        return super(FailingPagePublisher, self).load(content_id)
+
+
+class ConcurrentPublisherTestCase(TestCase):
+
+    @staticmethod
+    def make_env(page_ids, failing_ids=None):
+        env = FakeEnv()
+        env.config = ConfigLoader.from_dict({
+            'version': 2,
+            'base_dir': 'fixtures',
+            'pages': [{'id': page_id, 'source': 'page'} for page_id in page_ids],
+        })
+
+        pages = []
+        for page_id in page_ids:
+            page = Page()
+            page.id = page_id
+            page.title = u'pageTitle'
+            page.body = u'Old body'
+            pages.append(page)
+        env.page_manager = FailingPagePublisher(pages, failing_ids)
+        return env
+
+    def test_pages_to_update_keeps_config_order(self):
+        page_ids = list(range(1, 21))
+        env = self.make_env(page_ids)
+        publisher = Publisher(*env.items(), jobs=4)
+        pages = list(publisher._pages_to_update())
+        self.assertEqual([page.id for page in pages], page_ids)
+
+    def test_failed_page_does_not_drop_batch(self):
+        env = self.make_env([1, 2, 3], failing_ids=[2])
+        publisher = Publisher(*env.items(), jobs=3)
+        with self.assertRaises(PublishError) as ctx:
+            publisher.publish()
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        published = dict((page.id, page) for page in env.page_manager.get())
+        self.assertEqual(published[1].title, u'Title')
+        self.assertEqual(published[2].title, u'pageTitle')
+        self.assertEqual(published[3].title, u'Title')
+
+
+class VersionedPagePublisher(FakePagePublisher):
+    def __init__(self, pages=None):
+        super(VersionedPagePublisher, self).__init__(pages)
+        self.loaded = []
+
+    def load(self, content_id, with_body=False):
+        self.loaded.append(content_id)
+        return copy.copy(super(VersionedPagePublisher, self).load(content_id))
+
+    def load_versions(self, content_ids):
+        return dict((str(content_id), self._pages[content_id].version_number) for content_id in content_ids)
+
+    def update(self, page, bump_version=True):
+        if bump_version:
+            page.version_number += 1
+        return super(VersionedPagePublisher, self).update(page, bump_version)
+
+
+class IncrementalPublisherTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.state = PublishState(os.path.join(self.tmp_dir, 'config.state.sqlite'))
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_env(self):
+        env = ConcurrentPublisherTestCase.make_env([1, 2])
+        env.page_manager = VersionedPagePublisher(env.page_manager.get())
+        return env
+
+    def test_unchanged_pages_are_not_loaded(self):
+        env = self.make_env()
+        Publisher(*env.items(), state=self.state).publish()
+        self.assertEqual(env.page_manager.loaded, [1, 2])
+
+        env.page_manager.loaded = []
+        Publisher(*env.items(), state=self.state).publish()
+        self.assertEqual(env.page_manager.loaded, [])
+
+    def test_remote_version_change_reloads_page(self):
+        env = self.make_env()
+        Publisher(*env.items(), state=self.state).publish()
+
+        env.page_manager._pages[2].version_number += 1
+        env.page_manager.loaded = []
+        Publisher(*env.items(), state=self.state).publish()
+        self.assertEqual(env.page_manager.loaded, [2])
+
+
+class BulkPagePublisher(FakePagePublisher):
+    def __init__(self, pages=None):
+        super(BulkPagePublisher, self).__init__(pages)
+        self.bulk_loads = []
+
+    def load(self, content_id, with_body=False):
+        raise AssertionError('Pages must be loaded in bulk')
+
+    def load_many(self, content_ids, with_body=False):
+        self.bulk_loads.append(list(content_ids))
+        return dict((str(content_id), self._pages[content_id]) for content_id in content_ids
+                    if content_id in self._pages)
+
+
+class BulkLoadPublisherTestCase(TestCase):
+
+    def make_env(self, page_ids, missing_ids=()):
+        env = ConcurrentPublisherTestCase.make_env(page_ids)
+        env.page_manager = BulkPagePublisher(
+            [page for page in env.page_manager.get() if page.id not in missing_ids]
+        )
+        return env
+
+    def test_pages_loaded_in_batches(self):
+        env = self.make_env(list(range(1, 121)))
+        publisher = Publisher(*env.items(), jobs=2)
+        publisher.publish()
+        self.assertEqual(sorted(len(content_ids) for content_ids in env.page_manager.bulk_loads), [20, 50, 50])
+
+    def test_missing_page_fails(self):
+        env = self.make_env([1, 2, 3], missing_ids=[2])
+        with self.assertRaises(PublishError) as ctx:
+            Publisher(*env.items()).publish()
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        self.assertEqual(len(env.page_manager.bulk_loads), 1)
+
+
+class EventsPagePublisher(FakePagePublisher):
+    def __init__(self, pages=None):
+        super(EventsPagePublisher, self).__init__(pages)
+        self.events = []
+
+    def load(self, content_id, with_body=False):
+        self.events.append(('load', content_id))
+        return super(EventsPagePublisher, self).load(content_id)
+
+    def update(self, page, bump_version=True):
+        self.events.append(('update', page.id))
+        if page.id == 2:
+            raise IOError('Can not update page')
+        return super(EventsPagePublisher, self).update(page, bump_version)
+
+
+class StreamingPublisherTestCase(TestCase):
+
+    def test_upload_starts_before_comparison_ends(self):
+        env = ConcurrentPublisherTestCase.make_env(list(range(1, 31)))
+        env.page_manager = EventsPagePublisher(env.page_manager.get())
+        publisher = Publisher(*env.items(), jobs=2, queue_size=1)
+        publisher.load_batch_size = 5
+        with self.assertRaises(PublishError) as ctx:
+            publisher.publish()
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+
+        events = env.page_manager.events
+        self.assertLess(events.index(('update', 1)), events.index(('load', 30)))
+        self.assertEqual(len([event for event in events if event[0] == 'update']), 30)
+
+
+class TitledPagePublisher(FakePagePublisher):
+    def __init__(self, pages=None):
+        super(TitledPagePublisher, self).__init__(pages)
+        self.title_loads = []
+
+    def load_titles(self, content_ids):
+        self.title_loads.append(list(content_ids))
+        return dict((str(content_id), self._pages[content_id].title) for content_id in content_ids)
+
+
+class SearchFailingPagePublisher(FailingPagePublisher):
+    def load_titles(self, content_ids):
+        raise IOError('Search failed')
+
+
+class CountingDataProvider(SphinxFJsonDataProvider):
+    def __init__(self, *args, **kwargs):
+        super(CountingDataProvider, self).__init__(*args, **kwargs)
+        self.reads = []
+
+    def get_source_data(self, filename):
+        self.reads.append(os.path.basename(filename))
+        return super(CountingDataProvider, self).get_source_data(filename)
+
+
+class HoldTitlesPublisherTestCase(TestCase):
+    viewpage = 'http://confluence/pages/viewpage.action?pageId='
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def write_source(self, name, title, body):
+        with open(os.path.join(self.tmp_dir, name + '.fjson'), 'w') as f:
+            json.dump({'title': title, 'body': body}, f)
+
+    def test_anchors_to_other_pages(self):
+        self.write_source('api', u'API Guide', u'<a href="#APIGuide-intro">Intro</a>'
+                                               u'<a href="user.html#UserGuide-setup">Setup</a>')
+        self.write_source('user', u'User Guide', u'<a href="api.html#APIGuide-intro">API</a>')
+        env = FakeEnv()
+        env.config = ConfigLoader.from_dict({
+            'version': 2,
+            'url': 'http://confluence',
+            'base_dir': self.tmp_dir,
+            'pages': [{'id': 1, 'source': 'api'}, {'id': 2, 'source': 'user'}],
+        })
+        env.data_provider = CountingDataProvider(base_dir=self.tmp_dir)
+        pages = []
+        for page_id, title in ((1, u'Held API'), (2, u'Held User')):
+            page = Page()
+            page.id = page_id
+            page.title = title
+            page.body = u'Old body'
+            pages.append(page)
+        env.page_manager = TitledPagePublisher(pages)
+
+        Publisher(*env.items(), jobs=2).publish(hold_titles=True)
+
+        published = dict((page.id, page) for page in env.page_manager.get())
+        self.assertEqual(published[1].title, u'Held API')
+        self.assertEqual(published[1].body, u'<a href="#HeldAPI-intro">Intro</a>'
+                                            u'<a href="{}2#HeldUser-setup">Setup</a>'.format(self.viewpage))
+        self.assertEqual(published[2].body, u'<a href="{}1#HeldAPI-intro">API</a>'.format(self.viewpage))
+        self.assertEqual(env.page_manager.title_loads, [[1, 2]])
+        # the title pass keeps titles only, so every source is read again to be compared
+        self.assertEqual(sorted(env.data_provider.reads), ['api.fjson', 'api.fjson', 'user.fjson', 'user.fjson'])
+
+    def test_titles_loaded_one_by_one_if_search_fails(self):
+        self.write_source('api', u'API Guide', u'<a href="#APIGuide-intro">Intro</a>')
+        self.write_source('user', u'User Guide', u'<a href="api.html#APIGuide-intro">API</a>')
+        self.write_source('broken', u'Broken', u'Body')
+        env = FakeEnv()
+        env.config = ConfigLoader.from_dict({
+            'version': 2,
+            'url': 'http://confluence',
+            'base_dir': self.tmp_dir,
+            'pages': [{'id': 1, 'source': 'api'}, {'id': 2, 'source': 'user'}, {'id': 3, 'source': 'broken'}],
+        })
+        env.data_provider = SphinxFJsonDataProvider(base_dir=self.tmp_dir)
+        pages = []
+        for page_id, title in ((1, u'Held API'), (2, u'Held User'), (3, u'Held Broken')):
+            page = Page()
+            page.id = page_id
+            page.title = title
+            page.body = u'Old body'
+            pages.append(page)
+        env.page_manager = SearchFailingPagePublisher(pages, failing_ids=[3])
+
+        with self.assertRaises(PublishError) as ctx:
+            Publisher(*env.items(), jobs=2).publish(hold_titles=True)
+
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [3])
+        published = dict((page.id, page) for page in env.page_manager.get())
+        self.assertEqual(published[1].body, u'<a href="#HeldAPI-intro">Intro</a>')
+        self.assertEqual(published[2].body, u'<a href="{}1#HeldAPI-intro">API</a>'.format(self.viewpage))
+        self.assertEqual(published[3].body, u'Old body')
+
+
+class FallbackPagePublisher(VersionedPagePublisher):
+    def __init__(self, pages=None, failing_ids=None):
+        super(FallbackPagePublisher, self).__init__(pages)
+        self.failing_ids = failing_ids or []
+        self.bulk_loads = 0
+
+    def load(self, content_id, with_body=False):
+        if content_id in self.failing_ids:
+            raise IOError('Can not load page {}'.format(content_id))
+        return super(FallbackPagePublisher, self).load(content_id)
+
+    def load_many(self, content_ids, with_body=False):
+        self.bulk_loads += 1
+        raise IOError('Search failed')
+
+
+class BulkLoadFallbackTestCase(TestCase):
+
+    def make_env(self, failing_ids=None):
+        env = ConcurrentPublisherTestCase.make_env([1, 2, 3, 4])
+        env.page_manager = FallbackPagePublisher(env.page_manager.get(), failing_ids)
+        return env
+
+    def test_pages_loaded_one_by_one(self):
+        env = self.make_env(failing_ids=[2])
+        with self.assertRaises(PublishError) as ctx:
+            Publisher(*env.items()).publish()
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        self.assertEqual(env.page_manager.bulk_loads, 1)
+        self.assertEqual(env.page_manager.loaded, [1, 3, 4])
+
+    def test_unchanged_pages_not_failed(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        state = PublishState(os.path.join(tmp_dir, 'config.state.sqlite'))
+        self.addCleanup(state.close)
+        env = self.make_env()
+        Publisher(*env.items(), state=state).publish()
+
+        env.page_manager.failing_ids = [2]
+        env.page_manager._pages[2].version_number += 1
+        env.page_manager._pages[3].version_number += 1
+        env.page_manager.loaded = []
+        with self.assertRaises(PublishError) as ctx:
+            Publisher(*env.items(), state=state).publish()
+        self.assertEqual([content_id for content_id, _ in ctx.exception.failures], [2])
+        self.assertEqual(env.page_manager.loaded, [3])
@@ -0,0 +1,193 @@
+from unittest import TestCase
+import email.utils
+import time
+
+import requests
+
+from conf_publisher.confluence_api import ConfluenceRestApi553
+from conf_publisher.retry import parse_retry_after, RetryPolicy, AdaptiveLimit, ConcurrencyLimiter
+
+
+class FakeRequest(object):
+    def __init__(self, body=None):
+        self.body = body
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data=None, headers=None, content=b'', body=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.content = content
+        self.request = FakeRequest(body)
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError('{} error'.format(self.status_code), response=self)
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class NoSleepRetryPolicy(RetryPolicy):
+    def backoff(self, attempt, retry_after=None):
+        self.retry_after = retry_after
+        return 0
+
+
+class ParseRetryAfterTestCase(TestCase):
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('-1'), 0.0)
+
+    def test_date(self):
+        value = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertTrue(25 <= parse_retry_after(value) <= 30)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+class RetryPolicyTestCase(TestCase):
+    def test_throttled_retried_for_any_method(self):
+        policy = RetryPolicy(max_retries=2)
+        self.assertTrue(policy.is_retryable('POST', 0, status=429))
+        self.assertTrue(policy.is_retryable('GET', 1, status=503))
+        self.assertFalse(policy.is_retryable('GET', 2, status=429))
+
+    def test_errors_retried_for_idempotent_methods(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable('GET', 0, status=502))
+        self.assertTrue(policy.is_retryable('PUT', 0, error=requests.ConnectionError()))
+        self.assertFalse(policy.is_retryable('POST', 0, status=502))
+        self.assertFalse(policy.is_retryable('POST', 0, error=requests.ConnectionError()))
+        self.assertFalse(policy.is_retryable('GET', 0, status=404))
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff_factor=1, max_backoff=5)
+        for attempt in range(10):
+            self.assertTrue(0 <= policy.backoff(attempt) <= 5)
+        self.assertEqual(policy.backoff(0, retry_after=3), 3)
+        self.assertEqual(policy.backoff(0, retry_after=100), 5)
+
+    def test_backoff_scale(self):
+        policy = RetryPolicy(backoff_factor=1, backoff_scale=0)
+        self.assertEqual(policy.backoff(3), 0)
+        self.assertEqual(policy.backoff(0, retry_after=3), 0)
+
+
+class AdaptiveLimitTestCase(TestCase):
+    def test_decrease_and_recover(self):
+        limit = AdaptiveLimit(8, cooldown=0)
+        limit.on_throttle()
+        self.assertEqual(int(limit), 4)
+        limit.on_throttle()
+        limit.on_throttle()
+        limit.on_throttle()
+        self.assertEqual(int(limit), 1)
+
+        for _ in range(100):
+            limit.on_success()
+        self.assertEqual(int(limit), 8)
+
+    def test_max_limit(self):
+        limit = AdaptiveLimit(4, max_limit=8)
+        for _ in range(100):
+            limit.on_success()
+        self.assertEqual(int(limit), 8)
+
+    def test_cooldown(self):
+        limit = AdaptiveLimit(8, cooldown=60)
+        limit.on_throttle()
+        limit.on_throttle()
+        self.assertEqual(int(limit), 4)
+
+
+class RetryingApiTestCase(TestCase):
+    def make_api(self, responses, max_retries=3):
+        self.session = FakeSession(responses)
+        self.policy = NoSleepRetryPolicy(max_retries=max_retries)
+        self.limiter = ConcurrencyLimiter(AdaptiveLimit(4, cooldown=0))
+        return ConfluenceRestApi553('http://confluence', self.session, self.policy, self.limiter)
+
+    def test_retry_throttled(self):
+        api = self.make_api([
+            FakeResponse(429, headers={'Retry-After': '2'}),
+            FakeResponse(200, {'id': '1'}),
+        ])
+        self.assertEqual(api.get_content(1), {'id': '1'})
+        self.assertEqual(len(self.session.requests), 2)
+        self.assertEqual(self.policy.retry_after, 2.0)
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertEqual(int(self.limiter.limit), 2)
+
+    def test_retry_connection_error(self):
+        api = self.make_api([
+            requests.ConnectionError(),
+            FakeResponse(200, {'id': '1'}),
+        ])
+        self.assertEqual(api.get_content(1), {'id': '1'})
+        self.assertEqual(len(self.session.requests), 2)
+
+    def test_post_not_retried_on_error(self):
+        api = self.make_api([FakeResponse(502)])
+        with self.assertRaises(requests.HTTPError):
+            api.create_content({})
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_retries_exhausted(self):
+        api = self.make_api([FakeResponse(503)] * 3, max_retries=2)
+        with self.assertRaises(requests.HTTPError):
+            api.get_content(1)
+        self.assertEqual(len(self.session.requests), 3)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_no_policy(self):
+        api = ConfluenceRestApi553('http://confluence', FakeSession([FakeResponse(429)]))
+        with self.assertRaises(requests.HTTPError):
+            api.get_content(1)
+
+    def test_retried_update_already_applied(self):
+        api = self.make_api([
+            FakeResponse(504),
+            FakeResponse(409),
+            FakeResponse(200, {'id': '1', 'version': {'number': 3}}),
+        ])
+        self.assertEqual(api.update_content(1, {'version': {'number': 3}})['id'], '1')
+        self.assertEqual([method for method, _ in self.session.requests], ['PUT', 'PUT', 'GET'])
+        self.assertEqual(self.limiter.in_flight, 0)
+
+    def test_retried_update_conflict(self):
+        api = self.make_api([
+            FakeResponse(504),
+            FakeResponse(409),
+            FakeResponse(200, {'id': '1', 'version': {'number': 4}}),
+        ])
+        with self.assertRaises(requests.HTTPError):
+            api.update_content(1, {'version': {'number': 3}})
+
+    def test_update_conflict_without_retry(self):
+        api = self.make_api([FakeResponse(409)])
+        with self.assertRaises(requests.HTTPError):
+            api.update_content(1, {'version': {'number': 3}})
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_update_conflict_after_throttling(self):
+        api = self.make_api([FakeResponse(429), FakeResponse(409)])
+        with self.assertRaises(requests.HTTPError):
+            api.update_content(1, {'version': {'number': 3}})
+        self.assertEqual(len(self.session.requests), 2)
@@ -0,0 +1,101 @@
+from unittest import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from conf_publisher.state import PublishState, default_state_path, source_hash
+
+
+class PublishStateTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'config.state.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_state_path(self):
+        self.assertEqual(default_state_path('/docs/config.yml'), '/docs/config.state.sqlite')
+
+    def test_source_hash(self):
+        self.assertEqual(source_hash(('title', 'body'), None), source_hash(['title', 'body'], None))
+        self.assertNotEqual(source_hash(('title', 'body'), None), source_hash(('title', 'body'), 'link'))
+
+    def test_persistence(self):
+        state = PublishState(self.path)
+        state.set(12345, 'hash', 3)
+        state.close()
+
+        state = PublishState(self.path)
+        self.assertEqual(state.get('12345'), ('hash', 3))
+        self.assertIsNone(state.get(54321))
+        state.close()
+
+    def test_is_unchanged(self):
+        state = PublishState(self.path)
+        state.set(12345, 'hash', 3)
+        self.assertTrue(state.is_unchanged(12345, 'hash', 3))
+        self.assertFalse(state.is_unchanged(12345, 'hash', 4))
+        self.assertFalse(state.is_unchanged(12345, 'other hash', 3))
+        self.assertFalse(state.is_unchanged(12345, 'hash', None))
+        state.close()
+
+    def test_fingerprints(self):
+        state = PublishState(self.path)
+        state.set_fingerprint('body1', 'fingerprint1')
+        state.set_fingerprint('body2', 'fingerprint2')
+        state.close()
+
+        state = PublishState(self.path)
+        self.assertEqual(state.get_fingerprint('body1'), 'fingerprint1')
+        self.assertIsNone(state.get_fingerprint('body3'))
+        self.assertEqual(state.prune_fingerprints(keep_runs=1), 1)
+        self.assertIsNone(state.get_fingerprint('body2'))
+        self.assertEqual(state.get_fingerprint('body1'), 'fingerprint1')
+        state.close()
+
+    def test_prune_fingerprints_by_age(self):
+        state = PublishState(self.path)
+        state.set_fingerprint('body1', 'fingerprint1')
+        state.set_fingerprint('body2', 'fingerprint2')
+        state.close()
+
+        for run in range(2):
+            state = PublishState(self.path)
+            self.assertEqual(state.get_fingerprint('body1'), 'fingerprint1')
+            self.assertEqual(state.prune_fingerprints(keep_runs=3), 0)
+            state.close()
+
+        state = PublishState(self.path)
+        self.assertEqual(state.prune_fingerprints(keep_runs=3), 1)
+        self.assertIsNone(state.get_fingerprint('body2'))
+        self.assertEqual(state.get_fingerprint('body1'), 'fingerprint1')
+        state.close()
+
+    def test_used_fingerprints_kept_without_prune(self):
+        state = PublishState(self.path)
+        state.set_fingerprint('body1', 'fingerprint1')
+        state.close()
+
+        state = PublishState(self.path)
+        state.get_fingerprint('body1')
+        state.close()
+
+        state = PublishState(self.path)
+        self.assertEqual(state.prune_fingerprints(keep_runs=2), 0)
+        state.close()
+
+    def test_fingerprints_table_upgrade(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE fingerprints (body_hash TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)')
+        connection.execute("INSERT INTO fingerprints VALUES ('body1', 'fingerprint1')")
+        connection.commit()
+        connection.close()
+
+        state = PublishState(self.path)
+        self.assertEqual(state.get_fingerprint('body1'), 'fingerprint1')
+        state.set_fingerprint('body2', 'fingerprint2')
+        self.assertEqual(state.prune_fingerprints(keep_runs=1), 0)
+        state.close()
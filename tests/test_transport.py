@@ -0,0 +1,177 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from conf_publisher.config import HttpConfig
+from conf_publisher.confluence_api import ConfluenceRestApi553
+from conf_publisher.retry import RetryPolicy
+from conf_publisher.testing.fake_confluence import FakeConfluence, FakeConfluenceServer
+from conf_publisher.transport import HttpSettings, configure_session, record_session, replay_session, \
+    session_connection_stats, ReplayError
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpSettingsTestCase(TestCase):
+    def test_defaults_sized_to_jobs(self):
+        self.assertEqual(HttpSettings(HttpConfig(), jobs=1).pool_maxsize, 10)
+        self.assertEqual(HttpSettings(HttpConfig(), jobs=32).pool_maxsize, 33)
+        self.assertIs(HttpSettings(None).keep_alive, True)
+
+    def test_config_overrides_defaults(self):
+        http_config = HttpConfig()
+        http_config.pool_maxsize = 4
+        http_config.pool_block = True
+        http_config.keep_alive = False
+
+        settings = HttpSettings(http_config, jobs=32)
+
+        self.assertEqual(settings.pool_maxsize, 4)
+        self.assertIs(settings.pool_block, True)
+        self.assertIs(settings.keep_alive, False)
+
+
+class ConfigureSessionTestCase(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), OkHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_adapter_pool(self):
+        session = configure_session(requests.Session(), HttpConfig(), jobs=16)
+        adapter = session.get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 17)
+        self.assertIs(session.get_adapter('https://confluence'), adapter)
+
+    def test_keep_alive_reuses_connection(self):
+        session = configure_session(requests.Session())
+        for _ in range(3):
+            session.get(self.url)
+
+        stats = session_connection_stats(session)
+        self.assertEqual(stats.requests, 3)
+        self.assertEqual(stats.connections, 1)
+        self.assertEqual(stats.reused, 2)
+
+    def test_no_keep_alive(self):
+        http_config = HttpConfig()
+        http_config.keep_alive = False
+        session = configure_session(requests.Session(), http_config)
+        for _ in range(3):
+            session.get(self.url)
+
+        self.assertEqual(session_connection_stats(session).connections, 3)
+
+
+class RecordReplayTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'recording.jsonl.gz')
+        self.confluence = FakeConfluence(latency=0.02)
+        self.confluence.add_page(1, 'Home', '<p>Home</p>')
+        self.confluence.add_page(2, 'Child', '<p>Child</p>', ancestors=[1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self):
+        with FakeConfluenceServer(self.confluence) as server:
+            session = record_session(requests.Session(), self.path)
+            api = ConfluenceRestApi553(server.url, session)
+            results = [api.get_content('2', expand='body.storage,version'), api.get_content('1')]
+            data = api.get_content('2', expand='body.storage,version')
+            data['version']['number'] += 1
+            results.append(api.update_content('2', data))
+            results.append(api.get_content('2', expand='body.storage,version'))
+            session.close()
+        return server.url, results
+
+    def test_replay(self):
+        url, recorded = self.record()
+        session = replay_session(requests.Session(), self.path)
+        api = ConfluenceRestApi553(url, session)
+
+        started = time.time()
+        replayed = [api.get_content('2', expand='body.storage,version'), api.get_content('1')]
+        data = api.get_content('2', expand='body.storage,version')
+        self.assertEqual(data['version']['number'], 1)
+        data['version']['number'] += 1
+        replayed.append(api.update_content('2', data))
+        replayed.append(api.get_content('2', expand='body.storage,version'))
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed[-1]['version']['number'], 2)
+        self.assertLess(time.time() - started, 0.05)
+        self.assertEqual(session_connection_stats(session).requests, 5)
+        self.assertEqual(session_connection_stats(session).connections, 0)
+
+    def test_replay_at_recorded_speed(self):
+        url, _ = self.record()
+        api = ConfluenceRestApi553(url, replay_session(requests.Session(), self.path, realtime=True))
+
+        started = time.time()
+        api.get_content('1')
+        self.assertGreaterEqual(time.time() - started, 0.02)
+
+    def test_replay_exhausted(self):
+        url, _ = self.record()
+        api = ConfluenceRestApi553(url, replay_session(requests.Session(), self.path))
+        api.get_content('1')
+
+        with self.assertRaises(ReplayError):
+            api.get_content('1')
+
+    def test_replays_recorded_errors(self):
+        self.confluence.fail_next(404)
+        with FakeConfluenceServer(self.confluence) as server:
+            session = record_session(requests.Session(), self.path)
+            with self.assertRaises(requests.HTTPError):
+                ConfluenceRestApi553(server.url, session).get_content('1')
+            session.close()
+        api = ConfluenceRestApi553(server.url, replay_session(requests.Session(), self.path))
+
+        with self.assertRaises(requests.HTTPError):
+            api.get_content('1')
+
+    def test_replay_without_backoff(self):
+        self.confluence.fail_next(503, retry_after=5)
+        with FakeConfluenceServer(self.confluence) as server:
+            session = record_session(requests.Session(), self.path)
+            ConfluenceRestApi553(server.url, session, RetryPolicy(backoff_scale=0)).get_content('1')
+            session.close()
+        session = replay_session(requests.Session(), self.path)
+        api = ConfluenceRestApi553(server.url, session, RetryPolicy(backoff_scale=0))
+
+        started = time.time()
+        self.assertEqual(api.get_content('1')['id'], '1')
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(session_connection_stats(session).requests, 2)
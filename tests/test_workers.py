@@ -0,0 +1,79 @@
+from unittest import TestCase
+import threading
+import time
+
+from conf_publisher.confluence import body_fingerprint, PageBodyComparator
+from conf_publisher.workers import parallel_map, prefetch, process_pool
+
+
+class ParallelMapTestCase(TestCase):
+
+    def test_order(self):
+        def slow_square(x):
+            time.sleep(0.001 * (10 - x))
+            return x * x
+
+        results = list(parallel_map(slow_square, range(10), jobs=4))
+        self.assertEqual([result.value for result in results], [x * x for x in range(10)])
+
+    def test_errors(self):
+        def check(x):
+            if x == 2:
+                raise ValueError(x)
+            return x
+
+        results = list(parallel_map(check, range(4), jobs=2))
+        self.assertEqual([result.value for result in results], [0, 1, None, 3])
+        self.assertIsInstance(results[2].error, ValueError)
+
+
+class PrefetchTestCase(TestCase):
+
+    def test_order(self):
+        self.assertEqual(list(prefetch(range(100), 3)), list(range(100)))
+
+    def test_bounded(self):
+        produced = []
+
+        def produce():
+            for x in range(100):
+                produced.append(x)
+                yield x
+
+        items = prefetch(produce(), 2)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.05)
+        # one item is consumed, two are queued, one waits for free space
+        self.assertLessEqual(len(produced), 4)
+        items.close()
+
+    def test_error(self):
+        def produce():
+            yield 1
+            raise ValueError()
+
+        items = prefetch(produce(), 2)
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(ValueError):
+            next(items)
+
+    def test_close_stops_producer(self):
+        threads_count = threading.active_count()
+        items = prefetch(iter(range(1000)), 1)
+        next(items)
+        items.close()
+        self.assertEqual(threading.active_count(), threads_count)
+
+
+class ProcessPoolTestCase(TestCase):
+
+    def test_not_forked(self):
+        pool = process_pool(1)
+        self.addCleanup(pool.shutdown)
+        context = getattr(pool, '_mp_context', None)
+        if context is not None:
+            self.assertIn(context.get_start_method(), ('forkserver', 'spawn'))
+
+        # submitted from a worker thread, as the publisher does
+        results = list(parallel_map(lambda body: pool.submit(body_fingerprint, body).result(), ['<p>a</p>'], 2))
+        self.assertEqual(results[0].value, PageBodyComparator._fingerprint('<p>a</p>'))